@@ -0,0 +1,231 @@
+"""Screen capture backends for the agent.
+
+    pil        PIL.ImageGrab (Windows, macOS, X11)
+    mss        mss, much faster for repeated grabs (optional: uv pip install mss)
+    replay     screenshots from a directory, in order and looping, or from any
+               iterable of images, so the agent runs without a game
+    synthetic  generated frames of a blue target moving over a background
+
+Choose with VLA_CAPTURE (default pil); replay reads VLA_CAPTURE_SOURCE. Capture can
+be limited to the game viewport with VLA_CAPTURE_REGION=left,top,width,height or
+VLA_CAPTURE_WINDOW=<title substring> (window lookup needs pygetwindow, installed
+with pyautogui on Windows); a smaller grab is faster to capture, encode, upload and
+decode. replay and synthetic crop their frames to the region. grab() returns an RGB
+image and is called from a worker thread.
+
+    python client/capture.py [--backends pil,mss,synthetic] [--region 0,0,1280,720]
+"""
+import itertools
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageGrab
+
+try:
+    import mss
+except ImportError:
+    mss = None
+
+FRAME_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+
+def parse_region(text: str | None) -> tuple | None:
+    """"left,top,width,height" -> tuple of ints, or None."""
+    if not text:
+        return None
+    left, top, width, height = (int(v) for v in text.split(","))
+    return left, top, width, height
+
+
+def window_region(title: str) -> tuple:
+    """(left, top, width, height) of the first window whose title contains title."""
+    try:
+        import pygetwindow
+    except ImportError:
+        raise RuntimeError("Capturing a window needs pygetwindow: uv pip install pygetwindow")
+    windows = [w for w in pygetwindow.getWindowsWithTitle(title) if w.width > 0 and w.height > 0]
+    if not windows:
+        raise RuntimeError(f"No window titled {title!r}")
+    return windows[0].left, windows[0].top, windows[0].width, windows[0].height
+
+
+class CaptureBackend:
+    name = None
+
+    def __init__(self, region: tuple | None = None, window: str | None = None):
+        self.region = region
+        self.window = window
+
+    def bounds(self) -> tuple | None:
+        """Area to capture as (left, top, width, height); None is the whole screen."""
+        if self.window:
+            return window_region(self.window)  # looked up on every grab, the window may move
+        return self.region
+
+    def crop(self, image: Image.Image) -> Image.Image:
+        bounds = self.bounds()
+        if bounds is None:
+            return image
+        left, top, width, height = bounds
+        return image.crop((left, top, left + width, top + height))
+
+    def grab(self) -> Image.Image:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        area = f"window {self.window!r}" if self.window else ("region %d,%d %dx%d" % self.region if self.region else "full screen")
+        return f"{self.name} ({area})"
+
+
+class PilCapture(CaptureBackend):
+    name = "pil"
+
+    def grab(self) -> Image.Image:
+        bounds = self.bounds()
+        bbox = None if bounds is None else (bounds[0], bounds[1], bounds[0] + bounds[2], bounds[1] + bounds[3])
+        return ImageGrab.grab(bbox=bbox).convert("RGB")
+
+
+class MssCapture(CaptureBackend):
+    name = "mss"
+
+    def __init__(self, region=None, window=None):
+        if mss is None:
+            raise RuntimeError("The mss capture backend needs mss: uv pip install mss")
+        super().__init__(region, window)
+        # mss handles are per thread (grabs run in asyncio.to_thread workers)
+        self.local = threading.local()
+
+    def grab(self) -> Image.Image:
+        sct = getattr(self.local, "sct", None)
+        if sct is None:
+            sct = self.local.sct = mss.mss()
+        bounds = self.bounds()
+        if bounds is None:
+            monitor = sct.monitors[1]  # primary screen, as ImageGrab
+        else:
+            monitor = {"left": bounds[0], "top": bounds[1], "width": bounds[2], "height": bounds[3]}
+        shot = sct.grab(monitor)
+        return Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+
+class ReplayCapture(CaptureBackend):
+    name = "replay"
+
+    def __init__(self, source, region=None, window=None):
+        super().__init__(region, window)
+        self.lock = threading.Lock()
+        if isinstance(source, (str, Path)):
+            paths = sorted(p for p in Path(source).iterdir() if p.suffix.lower() in FRAME_SUFFIXES)
+            if not paths:
+                raise RuntimeError(f"No frames in {source}")
+            self.source = str(source)
+            self.frames = itertools.cycle(paths)
+        else:
+            self.source = type(source).__name__
+            self.frames = iter(source)
+
+    def grab(self) -> Image.Image:
+        with self.lock:
+            frame = next(self.frames, None)
+        if frame is None:
+            raise EOFError(f"Replay source {self.source} has no more frames")
+        if isinstance(frame, Path):
+            with Image.open(frame) as image:
+                frame = image.convert("RGB")
+        return self.crop(frame.convert("RGB"))
+
+    def describe(self) -> str:
+        return f"{super().describe()} from {self.source}"
+
+
+class SyntheticCapture(CaptureBackend):
+    name = "synthetic"
+
+    def __init__(self, region=None, window=None, size: tuple = (1920, 1080)):
+        super().__init__(region, window)
+        self.size = size
+        self.count = 0
+        self.lock = threading.Lock()
+        gradient = Image.linear_gradient("L").resize(size)
+        self.background = Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), Image.new("L", size, 90)))
+
+    def grab(self) -> Image.Image:
+        with self.lock:
+            step = self.count
+            self.count += 1
+        width, height = self.size
+        # The target sweeps across the frame row by row, so the expected action changes every frame
+        x = width // 2 + int(width * 0.3 * ((step % 40) / 20 - 1))
+        y = height // 2 + int(height * 0.3 * (((step // 40) % 20) / 10 - 1))
+        frame = self.background.copy()
+        ImageDraw.Draw(frame).rectangle((x - 20, y - 50, x + 20, y + 50), fill=(30, 60, 220))
+        return self.crop(frame)
+
+
+BACKENDS = {backend.name: backend for backend in (PilCapture, MssCapture, ReplayCapture, SyntheticCapture)}
+
+
+def make_capture(name: str = "pil", region: tuple | None = None, window: str | None = None, source=None) -> CaptureBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown capture backend {name!r}, expected one of {sorted(BACKENDS)}")
+    if name == "replay":
+        if source is None:
+            raise ValueError("The replay capture backend needs a source (VLA_CAPTURE_SOURCE)")
+        return ReplayCapture(source, region, window)
+    return BACKENDS[name](region, window)
+
+
+def capture_from_env() -> CaptureBackend:
+    return make_capture(
+        os.environ.get("VLA_CAPTURE", "pil"),
+        parse_region(os.environ.get("VLA_CAPTURE_REGION")),
+        os.environ.get("VLA_CAPTURE_WINDOW") or None,
+        os.environ.get("VLA_CAPTURE_SOURCE") or None,
+    )
+
+
+if __name__ == "__main__":
+    # Capture latency and frames/s per backend, grabbing back to back
+    import argparse
+    import statistics
+    import sys
+    import time
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from common.stats import summarize
+
+    parser = argparse.ArgumentParser(description="Capture latency and frames/s per backend.")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--frames", type=int, default=50, help="Grabs per backend")
+    parser.add_argument("--region", help="left,top,width,height")
+    parser.add_argument("--window", help="Title substring of the window to capture")
+    parser.add_argument("--source", help="Screenshot directory for the replay backend")
+    parser.add_argument("--encode", action="store_true", help="Also time the PNG encode of each frame")
+    args = parser.parse_args()
+
+    from frame_writer import encode_png
+
+    print(f"{'backend':<11}{'size':>11}{'p50 ms':>9}{'p90 ms':>9}{'max ms':>9}{'frames/s':>10}" + ("  encode p50 ms" if args.encode else ""))
+    for name in args.backends.split(","):
+        try:
+            capture = make_capture(name, parse_region(args.region), args.window, args.source)
+            image = capture.grab()  # first grab opens handles and loads files
+        except Exception as e:
+            print(f"{name:<11}unavailable: {e}")
+            continue
+        latencies, encodes = [], []
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            grab_start = time.perf_counter()
+            image = capture.grab()
+            latencies.append((time.perf_counter() - grab_start) * 1000.0)
+            if args.encode:
+                encode_start = time.perf_counter()
+                encode_png(image)
+                encodes.append((time.perf_counter() - encode_start) * 1000.0)
+        elapsed = time.perf_counter() - start - sum(encodes) / 1000.0
+        s = summarize(latencies)
+        print(f"{name:<11}{'%dx%d' % image.size:>11}{s['p50']:>9.2f}{s['p90']:>9.2f}{s['max']:>9.2f}{args.frames / elapsed:>10.1f}"
+              + (f"  {statistics.median(encodes):.2f}" if encodes else ""))
@@ -1,20 +1,22 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 import httpx
 import asyncio
 import pyautogui
 import keyboard
 import json
-from PIL import ImageGrab
 from pathlib import Path
 import logging
 import os
+from loop_controller import LoopController
+from capture import capture_from_env
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+capture = capture_from_env()  # VLA_CAPTURE, VLA_CAPTURE_REGION, ... (see capture.py)
 
 # Configuration
 WSL_SERVER_URL = "http://localhost:8000"
@@ -34,7 +36,7 @@ class GameAgent:
     async def capture_screenshot(self) -> tuple[bytes | None, bytes]:
         """Capture Windows screen and return as bytes."""
         logger.info("Capturing screenshot...")
-        screenshot = ImageGrab.grab()
+        screenshot = capture.grab()
         if os.path.exists(SCREENSHOT_SAVE_PATH): 
             os.remove(PREVIOUS_SAVE_PATH)
             os.rename(SCREENSHOT_SAVE_PATH, PREVIOUS_SAVE_PATH)
@@ -55,7 +57,7 @@ class GameAgent:
                 self.previous_screenshot = f.read()
         return self.previous_screenshot, self.last_screenshot
     
-    async def send_to_molmo(self, image_bytes: bytes, prompt: str) -> dict:
+    async def send_to_molmo(self, image_bytes: bytes, prompt: str, adapter: str | None = None) -> dict:
         """Send screenshot to Molmo2-4B and get streamed response."""
         logger.info(f"Sending screenshots to {WSL_SERVER_URL}/analyze")
         commands = {
@@ -72,6 +74,8 @@ class GameAgent:
                 # Send as multipart form
                 files = {"file": ("current_frame.png", image_bytes, "image/png")}
                 data = {"prompt": prompt}
+                if adapter:
+                    data["adapter"] = adapter
                 
                 async with client.stream("POST", f"{WSL_SERVER_URL}/analyze", files=files, data=data) as response:
                     if response.status_code != 200:
@@ -116,14 +120,14 @@ class GameAgent:
     
     async def execute_commands(self, commands: dict) -> dict:
         """Execute keyboard commands based on parsed output."""
-        logger.info("Executing movement commands...")
+        logger.debug("Executing movement commands...")
         executed = {}
 
         try:
             # Up arrow - move camera up (dy positive)
             if commands.get("up", 0) > 0:
                 duration = commands["up"] / 1000.0
-                logger.info(f"Pressing UP arrow for {duration:.2f}s")
+                logger.debug("Pressing UP arrow for %.2fs", duration)
                 keyboard.press('up')
                 await asyncio.sleep(duration)
                 keyboard.release('up')
@@ -132,7 +136,7 @@ class GameAgent:
             # Down arrow - move camera down (dy negative)
             if commands.get("down", 0) > 0:
                 duration = commands["down"] / 1000.0
-                logger.info(f"Pressing DOWN arrow for {duration:.2f}s")
+                logger.debug("Pressing DOWN arrow for %.2fs", duration)
                 keyboard.press('down')
                 await asyncio.sleep(duration)
                 keyboard.release('down')
@@ -141,7 +145,7 @@ class GameAgent:
             # Left arrow - move camera left (dx positive)
             if commands.get("left", 0) > 0:
                 duration = commands["left"] / 1000.0
-                logger.info(f"Pressing LEFT arrow for {duration:.2f}s")
+                logger.debug("Pressing LEFT arrow for %.2fs", duration)
                 keyboard.press('left')
                 await asyncio.sleep(duration)
                 keyboard.release('left')
@@ -150,7 +154,7 @@ class GameAgent:
             # Right arrow - move camera right (dx negative)
             if commands.get("right", 0) > 0:
                 duration = commands["right"] / 1000.0
-                logger.info(f"Pressing RIGHT arrow for {duration:.2f}s")
+                logger.debug("Pressing RIGHT arrow for %.2fs", duration)
                 keyboard.press('right')
                 await asyncio.sleep(duration)
                 keyboard.release('right')
@@ -166,7 +170,7 @@ class GameAgent:
                 print("Target aligned - task completed")
                 exit()
 
-            logger.info("Commands executed successfully")
+            logger.debug("Commands executed successfully")
 
         except Exception as e:
             logger.error(f"Error executing commands: {e}")
@@ -176,16 +180,17 @@ class GameAgent:
 
 # Global agent instance
 agent = GameAgent()
+loop = LoopController()
 
 @app.post("/run_iteration")
-async def run_iteration(prompt: str = SYSTEM_PROMPT):
+async def run_iteration(prompt: str = SYSTEM_PROMPT, adapter: str | None = None):
     """Run one full iteration: capture → analyze → execute."""
     try:
         # Capture screenshot
         _, image_bytes = await agent.capture_screenshot()
 
         # Send to Molmo
-        commands = await agent.send_to_molmo(image_bytes, prompt)
+        commands = await agent.send_to_molmo(image_bytes, prompt, adapter)
 
         # Execute commands
         executed = await agent.execute_commands(commands)
@@ -217,54 +222,50 @@ async def status():
         "status": "ok",
         "molmo_server": WSL_SERVER_URL,
         "game_delay_ms": GAME_DELAY_MS,
-        "last_commands": agent.last_commands
+        "last_commands": agent.last_commands,
+        "loop": loop.snapshot()
     })
 
-@app.post("/start_loop")
-async def start_loop(
+@app.post("/loop/start")
+async def loop_start(
     iterations: int = 50,
     delay_ms: int = GAME_DELAY_MS,
-    prompt: str = SYSTEM_PROMPT
+    prompt: str = SYSTEM_PROMPT,
+    adapter: str | None = None
 ):
-    """Start continuous game loop (0 = infinite)."""
+    """Start the game loop as a background task (0 = infinite)."""
     logger.info(f"Starting game loop: {iterations if iterations > 0 else 'infinite'} iterations, {delay_ms}ms delay")
-    
-    iteration = 0
+
+    async def loop_iteration(index: int) -> dict:
+        result = await run_iteration(prompt, adapter)
+        return json.loads(result.body)
+
     try:
-        while iterations == 0 or iteration < iterations:
-            iteration += 1
-            logger.info(f"\n{'='*60}")
-            logger.info(f"Iteration {iteration}")
-            logger.info(f"{'='*60}")
-            
-            try:
-                # Run iteration
-                result = await run_iteration(prompt)
-                if result.status_code == 200:
-                    logger.info(f"Iteration {iteration} completed successfully")
-                else:
-                    logger.warning(f"Iteration {iteration} failed: {result}")
-            
-            except Exception as e:
-                logger.error(f"Iteration {iteration} error: {e}")
-            
-            # Delay before next iteration
-            if iterations == 0 or iteration < iterations:
-                logger.info(f"Waiting {delay_ms}ms before next iteration...")
-                await asyncio.sleep(delay_ms / 3000.0)
-        
-        logger.info(f"Loop completed after {iteration} iterations")
-        return JSONResponse({
-            "status": "complete",
-            "iterations_completed": iteration
-        })
-    
-    except KeyboardInterrupt:
-        logger.info(f"Loop interrupted after {iteration} iterations")
-        return JSONResponse({
-            "status": "interrupted",
-            "iterations_completed": iteration
-        })
+        snapshot = loop.start(loop_iteration, iterations, delay_ms)
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"status": "error", "message": str(e)})
+    return JSONResponse({"status": "started", "loop": snapshot})
+
+@app.post("/loop/pause")
+async def loop_pause():
+    """Pause the loop after the current iteration."""
+    return JSONResponse({"status": "ok", "loop": loop.pause()})
+
+@app.post("/loop/resume")
+async def loop_resume():
+    """Resume a paused loop."""
+    return JSONResponse({"status": "ok", "loop": loop.resume()})
+
+@app.post("/loop/stop")
+async def loop_stop():
+    """Stop the loop after the current iteration."""
+    return JSONResponse({"status": "ok", "loop": loop.stop()})
+
+@app.get("/loop/events")
+async def loop_events(format: str = "ndjson"):
+    """Stream loop progress with per-iteration timings (format=ndjson or sse)."""
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(loop.events(format), media_type=media_type)
 
 @app.get("/health")
 async def health():
@@ -1,27 +1,59 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 import httpx
 import asyncio
 import pyautogui
 import keyboard
 import json
-from PIL import ImageGrab
 from pathlib import Path
 import logging
 import os
+import time
+import sys
+import uuid
 from datetime import datetime
+from loop_controller import LoopController
+from capture import capture_from_env
+from frame_writer import FrameWriter, encode_png
+from iteration_timing import IterationTimer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.tracing import recorder_from_env
+from common.run_store import ColumnarRunWriter
+from common.run_catalog import RunCatalog
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+tracer = recorder_from_env("fps-agent")
+# Screen capture backend and area (VLA_CAPTURE, VLA_CAPTURE_REGION, ...; see capture.py)
+capture = capture_from_env()
 
 # Configuration
 WSL_SERVER_URL = "http://localhost:8000"
 GAME_DELAY_MS = 3000
 SCREENSHOTS_DIR = Path("vla_evaluation")
 METADATA_FILE = SCREENSHOTS_DIR / "metadata.jsonl"
+# Optional columnar copy of the metadata with parsed outputs (needs pyarrow),
+# e.g. VLA_RUN_STORE=vla_evaluation/store; query it with utils/metadata_store.py
+RUN_STORE_DIR = os.environ.get("VLA_RUN_STORE")
+RUN_STORE_FLUSH_S = 60
+# Index of runs, iterations and frames; each run saves its frames under SCREENSHOTS_DIR/<run_id>/.
+# VLA_RUN_ID resumes (or starts) a named run, otherwise the latest active run is resumed.
+CATALOG_FILE = SCREENSHOTS_DIR / "runs.sqlite"
+# Screenshot writes run in the background; captures wait once this many are pending
+FRAME_WRITER_THREADS = 2
+FRAME_WRITER_MAX_PENDING = 8
+# With reuse_after_frame, the previous "after" frame is used as the next "before"
+# (saved as a hard link) when it is at most this old; keypress waits never reuse
+REUSE_FRAME_MAX_AGE_S = 1.0
+# Frames are sent with the run id as session: the service drops a queued frame once a
+# newer one of the same run arrives. VLA_ANALYZE_DEADLINE_MS (or deadline_ms of
+# /run_iteration and /loop/start) also has it dropped if it has not reached the model
+# within that many ms; off by default, as a shared service may well serve frames later
+ANALYZE_DEADLINE_MS = float(os.environ.get("VLA_ANALYZE_DEADLINE_MS", "0")) or None
 target = "blue soldier"
 
 SYSTEM_PROMPT = f"Point to the {target} and determine the action to be taken by the camera to align the centre of the image with it."
@@ -36,47 +68,133 @@ class GameAgent:
         self.last_commands = None
         self.iteration_count = 0
         self.paused = False
+        self.last_after = None  # previous "after" frame, kept for reuse_after_frame
+        self.run_store = ColumnarRunWriter(RUN_STORE_DIR, flush_interval_s=RUN_STORE_FLUSH_S) if RUN_STORE_DIR else None
         
         # Initialize metadata file with header if it doesn't exist
         if not METADATA_FILE.exists():
             with open(METADATA_FILE, 'w') as f:
                 f.write("")  # Empty file, will append JSONL
-    
 
-        numbers = []
-        for fname in os.listdir(SCREENSHOTS_DIR):
-            if fname.endswith(".png"):
-                # split on "_" then take the last part before ".png"
-                num_str = fname.split("_")[-1].split(".")[0]
-                numbers.append(int(num_str))
+        self.catalog = RunCatalog(CATALOG_FILE)
+        # Frames saved before runs existed keep their numbering as the "legacy" run
+        self.catalog.adopt_legacy_dir(SCREENSHOTS_DIR, METADATA_FILE)
+        run_id = os.environ.get("VLA_RUN_ID") or self.catalog.latest_run()
+        if run_id is None or self.catalog.run(run_id) is None:
+            self.start_run(run_id)
+        else:
+            self.run_id = run_id
+            self.iteration_count = self.catalog.last_iteration(run_id)
+            (SCREENSHOTS_DIR / run_id).mkdir(exist_ok=True)
+
+        print(f"Resuming run {self.run_id} from iteration:", self.iteration_count)
+        print(f"Capturing {capture.describe()}")
 
-        # initialize with largest number + 1
-        self.iteration_count = max(numbers) + 1 if numbers else 1
+    def start_run(self, run_id: str | None = None) -> str:
+        """Start a new run with its own screenshot directory and iteration numbering."""
+        self.run_id = self.catalog.start_run(run_id, prompt=SYSTEM_PROMPT, metadata_file=str(METADATA_FILE))
+        self.iteration_count = 0
+        self.discard_last_after()
+        (SCREENSHOTS_DIR / self.run_id).mkdir(exist_ok=True)
+        return self.run_id
 
-        print("Resuming from latest iteration:", self.iteration_count)
+    def next_iteration(self) -> int:
+        self.iteration_count = self.catalog.next_iteration(self.run_id)
+        return self.iteration_count
 
     
-    async def capture_screenshot(self, prefix: str) -> bytes:
-        """Capture Windows screen and return as bytes with naming."""
+    async def capture_screenshot(self, prefix: str, timer: IterationTimer | None = None) -> bytes:
+        """Capture the screen (or the configured region) and return as bytes with naming."""
+        timer = timer or IterationTimer()
         logger.info(f"Capturing {prefix} screenshot...")
-        screenshot = ImageGrab.grab()
+        with timer.stage(f"{prefix}_grab"):
+            screenshot = await asyncio.to_thread(capture.grab)
         
-        # Save with timestamped name
-        filename = f"{prefix}_{self.iteration_count:04d}.png"
-        filepath = SCREENSHOTS_DIR / filename
-        screenshot.save(filepath)
-        logger.info(f"Screenshot saved to {filepath}")
+        # Encode once, off the event loop; the same bytes are uploaded and saved
+        with timer.stage(f"{prefix}_encode"):
+            img_bytes = await asyncio.to_thread(encode_png, screenshot)
         
-        # Convert to bytes
-        import io
-        img_bytes = io.BytesIO()
-        screenshot.save(img_bytes, format='PNG')
-        img_bytes.seek(0)
+        # Save with timestamped name, relative to SCREENSHOTS_DIR, in the background.
+        # The save stage is only the time spent waiting when the disk falls behind.
+        filename = f"{self.run_id}/{prefix}_{self.iteration_count:04d}.png"
+        filepath = SCREENSHOTS_DIR / filename
+        with timer.stage(f"{prefix}_save"):
+            await frame_writer.submit(filepath, img_bytes)
+        self.catalog.record_frame(self.run_id, self.iteration_count, prefix, filename)
+        logger.info(f"Screenshot queued for {filepath}")
         
-        return img_bytes.getvalue(), filename
+        return img_bytes, filename
+
+    def keep_after_frame(self, img_bytes: bytes, filename: str):
+        self.discard_last_after()
+        self.last_after = {
+            "bytes": img_bytes,
+            "filename": filename,
+            "iteration": self.iteration_count,
+            "captured_at": time.monotonic(),
+            "speculation": None,
+        }
+
+    def take_after_frame(self, max_age_s: float) -> dict | None:
+        """The previous "after" frame if it is fresh enough to stand in for a new capture."""
+        last = self.last_after
+        self.last_after = None
+        if last is None:
+            return None
+        last["age_s"] = time.monotonic() - last["captured_at"]
+        if last["age_s"] > max_age_s:
+            logger.info(f"Previous after frame is {last['age_s']:.2f}s old, capturing a new one")
+            self.cancel_speculation(last)
+            return None
+        return last
+
+    def discard_last_after(self):
+        if self.last_after is not None:
+            self.cancel_speculation(self.last_after)
+            self.last_after = None
+
+    @staticmethod
+    def cancel_speculation(last: dict):
+        if last.get("speculation") is not None:
+            last["speculation"]["task"].cancel()
+            last["speculation"] = None
+
+    async def reuse_frame(self, last: dict, prefix: str, timer: IterationTimer) -> tuple[bytes, str]:
+        """Save a kept frame under this iteration's name (a hard link, no grab or encode)."""
+        filename = f"{self.run_id}/{prefix}_{self.iteration_count:04d}.png"
+        with timer.stage(f"{prefix}_reuse"):
+            await frame_writer.submit_link(SCREENSHOTS_DIR / last["filename"], SCREENSHOTS_DIR / filename, last["bytes"])
+        self.catalog.record_frame(self.run_id, self.iteration_count, prefix, filename)
+        logger.info(f"Reusing {last['filename']} as {filename}")
+        return last["bytes"], filename
+
+    def speculate(self, img_bytes: bytes, prompt: str, adapter: str | None, deadline_ms: float | None = None):
+        """Upload the kept "after" frame now, as the next iteration's analyze request."""
+        # Its own timer: the iteration that uses it records it as one stage (no trace spans here)
+        timer = IterationTimer()
+        request_id = uuid.uuid4().hex
+        task = asyncio.create_task(self.send_to_molmo(img_bytes, prompt, adapter, timer, request_id, deadline_ms))
+        # Retrieve the exception if the speculation is never used
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.last_after["speculation"] = {
+            "task": task, "timer": timer, "request_id": request_id, "prompt": prompt, "adapter": adapter,
+        }
     
-    async def send_to_molmo(self, image_bytes: bytes, prompt: str) -> dict:
-        """Send screenshot to Molmo2-4B and get streamed response."""
+    async def send_to_molmo(
+        self,
+        image_bytes: bytes,
+        prompt: str,
+        adapter: str | None = None,
+        timer: IterationTimer | None = None,
+        request_id: str | None = None,
+        deadline_ms: float | None = None
+    ) -> dict:
+        """Send screenshot to Molmo2-4B and get streamed response.
+
+        With a timer, records time to first byte, time to model output and the total
+        analyze time, and attaches the server's per-stage timings for request_id.
+        When the service drops the request, commands["dropped"] carries the reason.
+        """
         logger.info(f"Sending screenshots to {WSL_SERVER_URL}/analyze")
         commands = {
             "up": 0,
@@ -92,7 +210,18 @@ class GameAgent:
                 # Send as multipart form
                 files = {"file": ("current_frame.png", image_bytes, "image/png")}
                 data = {"prompt": prompt}
+                if adapter:
+                    data["adapter"] = adapter
+                if timer is not None:
+                    data["include_timings"] = "true"
+                if request_id:
+                    data["request_id"] = request_id
+                data["session_id"] = self.run_id
+                if deadline_ms:
+                    data["deadline_ms"] = str(deadline_ms)
                 
+                analyze_start = time.perf_counter()
+                first_line = True
                 async with client.stream("POST", f"{WSL_SERVER_URL}/analyze", files=files, data=data) as response:
                     if response.status_code != 200:
                         logger.error(f"Server error: {response.status_code}")
@@ -100,16 +229,25 @@ class GameAgent:
                     
                     # Process streamed NDJSON response
                     async for line in response.aiter_lines():
+                        if timer is not None and first_line:
+                            timer.record("analyze_ttfb", analyze_start, time.perf_counter())
+                            first_line = False
                         if line.strip():
                             try:
                                 json_obj = json.loads(line)
                                 status = json_obj.get("status")
                                 
                                 if status == "model_output":
+                                    if timer is not None:
+                                        timer.record("analyze_model_output", analyze_start, time.perf_counter())
                                     text = json_obj.get("text", "")
                                     logger.info(f"[MODEL] {text}")
                                     commands["raw_output"] += text
                                 
+                                elif status == "timings":
+                                    if timer is not None and json_obj.get("request_id") in (None, request_id):
+                                        timer.server = json_obj.get("data")
+                                
                                 elif status == "commands":
                                     data = json_obj.get("data", {})
                                     commands.update(data)
@@ -120,6 +258,9 @@ class GameAgent:
                                 
                                 elif status == "error":
                                     logger.error(f"[ERROR] {json_obj.get('message')}")
+                                    if json_obj.get("reason"):
+                                        # Expired or superseded in the service's queue: no commands
+                                        commands["dropped"] = json_obj["reason"]
                             
                             except json.JSONDecodeError:
                                 logger.warning(f"Failed to parse JSON: {line}")
@@ -131,19 +272,21 @@ class GameAgent:
             logger.error(f"Error communicating with Molmo: {e}")
             raise HTTPException(status_code=500, detail=str(e))
         
+        if timer is not None:
+            timer.record("analyze", analyze_start, time.perf_counter())
         self.last_commands = commands
         return commands
     
     async def execute_commands(self, commands: dict) -> dict:
         """Execute keyboard commands based on parsed output."""
-        logger.info("Executing movement commands...")
+        logger.debug("Executing movement commands...")
         executed = {}
 
         try:
             # Up arrow - move camera up (dy positive)
             if commands.get("up", 0) > 0:
                 duration = commands["up"] / 1000.0
-                logger.info(f"Pressing UP arrow for {duration:.2f}s")
+                logger.debug("Pressing UP arrow for %.2fs", duration)
                 keyboard.press('up')
                 await asyncio.sleep(duration)
                 keyboard.release('up')
@@ -152,7 +295,7 @@ class GameAgent:
             # Down arrow - move camera down (dy negative)
             if commands.get("down", 0) > 0:
                 duration = commands["down"] / 1000.0
-                logger.info(f"Pressing DOWN arrow for {duration:.2f}s")
+                logger.debug("Pressing DOWN arrow for %.2fs", duration)
                 keyboard.press('down')
                 await asyncio.sleep(duration)
                 keyboard.release('down')
@@ -161,7 +304,7 @@ class GameAgent:
             # Left arrow - move camera left (dx positive)
             if commands.get("left", 0) > 0:
                 duration = commands["left"] / 1000.0
-                logger.info(f"Pressing LEFT arrow for {duration:.2f}s")
+                logger.debug("Pressing LEFT arrow for %.2fs", duration)
                 keyboard.press('left')
                 await asyncio.sleep(duration)
                 keyboard.release('left')
@@ -170,7 +313,7 @@ class GameAgent:
             # Right arrow - move camera right (dx negative)
             if commands.get("right", 0) > 0:
                 duration = commands["right"] / 1000.0
-                logger.info(f"Pressing RIGHT arrow for {duration:.2f}s")
+                logger.debug("Pressing RIGHT arrow for %.2fs", duration)
                 keyboard.press('right')
                 await asyncio.sleep(duration)
                 keyboard.release('right')
@@ -185,7 +328,7 @@ class GameAgent:
                 executed["exit"] = True
                 logger.info("Target aligned - task completed")
 
-            logger.info("Commands executed successfully")
+            logger.debug("Commands executed successfully")
 
         except Exception as e:
             logger.error(f"Error executing commands: {e}")
@@ -194,48 +337,125 @@ class GameAgent:
         return executed
     
     def save_metadata(self, metadata: dict):
-        """Append metadata entry to JSONL file."""
-        with open(METADATA_FILE, 'a') as f:
-            f.write(json.dumps(metadata) + '\n')
+        """Append metadata entry to JSONL file and index it by run and iteration."""
+        with open(METADATA_FILE, 'ab') as f:
+            offset = f.tell()
+            f.write((json.dumps(metadata) + '\n').encode("utf-8"))
+        self.catalog.record_iteration(metadata["run_id"], metadata["iteration"], metadata, offset)
+        if self.run_store is not None:
+            self.run_store.append(metadata)
         logger.info(f"Metadata saved to {METADATA_FILE}")
 
 # Global agent instance
+frame_writer = FrameWriter(FRAME_WRITER_THREADS, FRAME_WRITER_MAX_PENDING)
 agent = GameAgent()
+loop = LoopController()
 
 @app.post("/run_iteration")
-async def run_iteration(prompt: str = SYSTEM_PROMPT):
-    """Run one full iteration: capture before → analyze → capture after → execute."""
+async def run_iteration(
+    prompt: str = SYSTEM_PROMPT,
+    adapter: str | None = None,
+    reuse_after_frame: bool = False,
+    speculative_upload: bool = False,
+    deadline_ms: float | None = None
+):
+    """Run one full iteration: capture before → analyze → capture after → execute.
+
+    With reuse_after_frame, a previous "after" frame younger than REUSE_FRAME_MAX_AGE_S
+    is used as this iteration's "before" frame instead of a new capture. With
+    speculative_upload as well, that frame is uploaded for analysis as soon as it
+    is captured, so the next iteration may find its model output already running.
+    deadline_ms (default: VLA_ANALYZE_DEADLINE_MS, 0 for none) is the analyze
+    request's deadline in the service queue; a frame dropped as expired is sent again
+    without one, so the iteration still actuates, and the drop is logged.
+    """
     try:
-        # Increment iteration counter
-        agent.iteration_count += 1
-        iteration_id = agent.iteration_count
+        deadline_ms = ANALYZE_DEADLINE_MS if deadline_ms is None else deadline_ms or None
+        # Reserve the next iteration number of the current run
+        iteration_id = agent.next_iteration()
         timestamp = datetime.now().isoformat()
+        last_after = agent.take_after_frame(REUSE_FRAME_MAX_AGE_S) if reuse_after_frame else None
+        speculation = last_after["speculation"] if last_after else None
+        if speculation is not None and (speculation["prompt"], speculation["adapter"]) != (prompt, adapter):
+            agent.cancel_speculation(last_after)
+            speculation = None
+        request_id = speculation["request_id"] if speculation is not None else uuid.uuid4().hex
+        timer = IterationTimer(tracer)
         
         logger.info(f"\n{'='*60}")
         logger.info(f"Starting Iteration {iteration_id}")
         logger.info(f"{'='*60}")
         
-        # 1. Capture BEFORE screenshot
-        before_bytes, before_filename = await agent.capture_screenshot("before")
+        # 1. Capture BEFORE screenshot (or reuse the previous AFTER screenshot)
+        if last_after is not None:
+            before_bytes, before_filename = await agent.reuse_frame(last_after, "before", timer)
+        else:
+            before_bytes, before_filename = await agent.capture_screenshot("before", timer)
         
         # 2. Send to Molmo for analysis
-        commands = await agent.send_to_molmo(before_bytes, prompt)
+        commands = None
+        if speculation is not None:
+            try:
+                wait_start = time.perf_counter()
+                commands = await speculation["task"]
+                # The analyze started during the previous iteration: record it as its own
+                # stage, and the time this iteration waited for it as analyze_wait
+                timer.record("analyze_wait", wait_start, time.perf_counter())
+                speculative = speculation["timer"]
+                begin, end = (speculative.start + ms / 1000.0 for ms in speculative.marks["analyze"])
+                timer.record("analyze_speculative", begin, end)
+                timer.server = speculative.server
+            except HTTPException as e:
+                logger.warning(f"Speculative analyze failed ({e.detail}), sending the frame again")
+                speculation = None
+        if commands is None:
+            commands = await agent.send_to_molmo(before_bytes, prompt, adapter, timer, request_id, deadline_ms)
+        dropped = commands.get("dropped")
+        expired_request_id = None
+        if dropped == "expired":
+            logger.warning(f"Iteration {iteration_id}: analyze expired after {deadline_ms:.0f} ms in the service queue, sending the frame again without a deadline")
+            # The expired attempt stays in the breakdown; the resend is a request of its own
+            for stage in ("analyze", "analyze_ttfb", "analyze_model_output"):
+                timer.rename(stage, stage.replace("analyze", "analyze_expired", 1))
+            expired_request_id, request_id = request_id, uuid.uuid4().hex
+            commands = await agent.send_to_molmo(before_bytes, prompt, adapter, timer, request_id)
+        elif dropped:
+            logger.warning(f"Iteration {iteration_id}: analyze {dropped} in the service queue, no commands to execute")
         
         # 3. Execute commands (actuation)
-        executed = await agent.execute_commands(commands)
+        with timer.stage("actuation"):
+            executed = await agent.execute_commands(commands)
         
         # 4. Wait a moment for game to settle after actuation
-        await asyncio.sleep(0.5)
+        with timer.stage("settle"):
+            await asyncio.sleep(0.5)
         
         # 5. Capture AFTER screenshot
-        after_bytes, after_filename = await agent.capture_screenshot("after")
+        after_bytes, after_filename = await agent.capture_screenshot("after", timer)
+        if reuse_after_frame:
+            agent.keep_after_frame(after_bytes, after_filename)
+            if speculative_upload and not commands.get("exit", 0):
+                agent.speculate(after_bytes, prompt, adapter, deadline_ms)
         
         # 6. Save metadata
+        timings = timer.as_dict()
+        tracer.complete("iteration", timer.start, time.perf_counter(), "iteration", "iteration",
+                        iteration=iteration_id, request_id=request_id)
         metadata = {
+            "run_id": agent.run_id,
             "iteration": iteration_id,
             "timestamp": timestamp,
+            "request_id": request_id,
+            "expired_request_id": expired_request_id,
             "before_screenshot": before_filename,
             "after_screenshot": after_filename,
+            # "reused": the before frame is the previous iteration's after frame
+            "before_source": "reused" if last_after is not None else "captured",
+            "before_reused_from": last_after["filename"] if last_after is not None else None,
+            "before_age_ms": round(last_after["age_s"] * 1000.0, 1) if last_after is not None else None,
+            "speculative_upload": speculation is not None,
+            # Reason the service dropped the first analyze request (expired ones were sent again)
+            "analyze_dropped": dropped,
             "prompt": prompt,
             "vla_output": commands.get("raw_output", ""),
             "commands": {
@@ -245,7 +465,8 @@ async def run_iteration(prompt: str = SYSTEM_PROMPT):
                 "right": commands.get("right", 0),
                 "exit": commands.get("exit", 0)
             },
-            "executed_durations": executed
+            "executed_durations": executed,
+            "timings": timings
         }
         agent.save_metadata(metadata)
         
@@ -257,6 +478,7 @@ async def run_iteration(prompt: str = SYSTEM_PROMPT):
             "iteration": iteration_id,
             "before_screenshot": str(before_filename),
             "after_screenshot": str(after_filename),
+            "before_source": metadata["before_source"],
             "model_output": commands.get("raw_output"),
             "commands": {
                 "up": commands.get("up", 0),
@@ -265,10 +487,12 @@ async def run_iteration(prompt: str = SYSTEM_PROMPT):
                 "right": commands.get("right", 0),
                 "exit": commands.get("exit", 0)
             },
-            "executed": executed
+            "executed": executed,
+            "timings": timings
         })
 
     except Exception as e:
+        agent.discard_last_after()
         logger.error(f"Iteration failed: {e}")
         return JSONResponse(
             status_code=500,
@@ -282,74 +506,115 @@ async def status():
         "status": "ok",
         "molmo_server": WSL_SERVER_URL,
         "game_delay_ms": GAME_DELAY_MS,
+        "run_id": agent.run_id,
         "iteration_count": agent.iteration_count,
         "screenshots_dir": str(SCREENSHOTS_DIR),
         "metadata_file": str(METADATA_FILE),
-        "last_commands": agent.last_commands
+        "last_commands": agent.last_commands,
+        "frame_writer": frame_writer.stats(),
+        "loop": loop.snapshot()
     })
 
-@app.post("/start_loop")
-async def start_loop(
+async def wait_for_space(controller: LoopController) -> bool:
+    """Wait for SPACE before the next iteration; 'p' or /loop/stop ends the loop."""
+    logger.info(f"\n Press SPACE to start iteration {agent.iteration_count + 1} (or 'p' to quit)...")
+    while not controller.stop_requested:
+        await asyncio.sleep(0.1)
+        if keyboard.is_pressed('space'):
+            logger.info("▶️  Starting iteration...")
+            await asyncio.sleep(0.3)  # Debounce
+            return True
+        elif keyboard.is_pressed('p'):
+            logger.info("❌ Quit key pressed, stopping loop")
+            return False
+    return False
+
+@app.post("/loop/start")
+async def loop_start(
     iterations: int = 50,
     delay_ms: int = GAME_DELAY_MS,
     prompt: str = SYSTEM_PROMPT,
-    wait_for_keypress: bool = True  # NEW: Wait for keypress between iterations
+    adapter: str | None = None,
+    wait_for_keypress: bool = True,  # Wait for keypress between iterations
+    reuse_after_frame: bool = False,  # Use the last after frame as the next before frame
+    speculative_upload: bool = False,  # Upload the after frame before the next iteration starts
+    deadline_ms: float | None = None  # Analyze deadline in the service queue (default: VLA_ANALYZE_DEADLINE_MS)
 ):
-    """Start continuous game loop with optional keypress wait."""
+    """Start the game loop as a background task with optional keypress wait."""
     logger.info(f"Starting game loop: {iterations if iterations > 0 else 'infinite'} iterations")
     logger.info(f"Wait for keypress: {wait_for_keypress}")
-    
-    iteration = 0
+    # With a delay of REUSE_FRAME_MAX_AGE_S or more the kept frame is always too old to
+    # reuse: uploading it speculatively would run a full generate only to throw it away
+    speculate = speculative_upload and delay_ms / 1000.0 < REUSE_FRAME_MAX_AGE_S
+    if reuse_after_frame and not wait_for_keypress:
+        logger.info(f"Reusing after frames up to {REUSE_FRAME_MAX_AGE_S}s old (speculative upload: {speculate})")
+        if speculative_upload and not speculate:
+            logger.info(f"Speculative upload skipped: the {delay_ms} ms delay outlives reusable frames")
+
+    async def loop_iteration(index: int) -> dict:
+        # Frames go stale while waiting for a keypress, so they are never reused then
+        reuse = reuse_after_frame and not wait_for_keypress
+        result = await run_iteration(prompt, adapter, reuse, reuse and speculate, deadline_ms)
+        return json.loads(result.body)
+
     try:
-        while iterations == 0 or iteration < iterations:
-            iteration += 1
-            
-            # Wait for SPACE key before starting iteration
-            if wait_for_keypress:
-                logger.info(f"\n Press SPACE to start iteration {agent.iteration_count + 1} (or 'p' to quit)...")
-                
-                # Async wait for key
-                while True:
-                    await asyncio.sleep(0.1)
-                    if keyboard.is_pressed('space'):
-                        logger.info("▶️  Starting iteration...")
-                        await asyncio.sleep(0.3)  # Debounce
-                        break
-                    elif keyboard.is_pressed('p'):
-                        logger.info("❌ Quit key pressed, stopping loop")
-                        raise KeyboardInterrupt
-            
-            try:
-                # Run iteration
-                result = await run_iteration(prompt)
-                if result.status_code == 200:
-                    logger.info(f"✓ Iteration {agent.iteration_count} completed")
-                else:
-                    logger.warning(f"✗ Iteration {agent.iteration_count} failed: {result}")
-            
-            except Exception as e:
-                logger.error(f"Iteration {agent.iteration_count} error: {e}")
-            
-            # Delay before next iteration (if not waiting for keypress)
-            if not wait_for_keypress and (iterations == 0 or iteration < iterations):
-                logger.info(f"Waiting {delay_ms}ms before next iteration...")
-                await asyncio.sleep(delay_ms / 1000.0)
-        
-        logger.info(f"Loop completed after {iteration} iterations")
-        return JSONResponse({
-            "status": "complete",
-            "iterations_completed": iteration,
-            "total_screenshots": agent.iteration_count * 2,
-            "screenshots_dir": str(SCREENSHOTS_DIR),
-            "metadata_file": str(METADATA_FILE)
-        })
-    
-    except KeyboardInterrupt:
-        logger.info(f"Loop interrupted after {iteration} iterations")
-        return JSONResponse({
-            "status": "interrupted",
-            "iterations_completed": iteration
-        })
+        snapshot = loop.start(
+            loop_iteration,
+            iterations,
+            # The delay only applies when not waiting for a keypress
+            0 if wait_for_keypress else delay_ms,
+            wait_before=wait_for_space if wait_for_keypress else None
+        )
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"status": "error", "message": str(e)})
+    return JSONResponse({
+        "status": "started",
+        "loop": snapshot,
+        "screenshots_dir": str(SCREENSHOTS_DIR),
+        "metadata_file": str(METADATA_FILE)
+    })
+
+@app.post("/loop/pause")
+async def loop_pause():
+    """Pause the loop after the current iteration."""
+    return JSONResponse({"status": "ok", "loop": loop.pause()})
+
+@app.post("/loop/resume")
+async def loop_resume():
+    """Resume a paused loop."""
+    return JSONResponse({"status": "ok", "loop": loop.resume()})
+
+@app.post("/loop/stop")
+async def loop_stop():
+    """Stop the loop after the current iteration."""
+    return JSONResponse({"status": "ok", "loop": loop.stop()})
+
+@app.get("/loop/events")
+async def loop_events(format: str = "ndjson"):
+    """Stream loop progress with per-iteration timings (format=ndjson or sse)."""
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(loop.events(format), media_type=media_type)
+
+@app.get("/trace")
+async def trace(clear: bool = False):
+    """Dump recorded spans as Chrome/Perfetto trace JSON (enable with VLA_TRACE=1 or /trace/enable)."""
+    trace_json = tracer.export_chrome()
+    if clear:
+        tracer.clear()
+    return JSONResponse(trace_json)
+
+@app.post("/trace/enable")
+async def trace_enable(enabled: bool = True):
+    tracer.enabled = enabled
+    return {"status": "ok", "tracing": tracer.enabled, "spans": len(tracer.events)}
+
+@app.on_event("shutdown")
+async def flush_on_shutdown():
+    """Finish queued screenshot writes and flush the run store."""
+    await frame_writer.drain()
+    frame_writer.close()
+    if agent.run_store is not None:
+        agent.run_store.close()
 
 @app.get("/health")
 async def health():
@@ -358,10 +623,11 @@ async def health():
 
 @app.post("/reset_counter")
 async def reset_counter():
-    """Reset iteration counter (useful for new evaluation runs)."""
-    agent.iteration_count = 0
-    logger.info("Iteration counter reset to 0")
-    return {"status": "ok", "iteration_count": 0}
+    """Start a new run: iterations restart at 1 in a new directory, earlier frames are kept."""
+    agent.catalog.finish_run(agent.run_id)
+    run_id = agent.start_run()
+    logger.info(f"Started run {run_id}, iteration counter reset to 0")
+    return {"status": "ok", "run_id": run_id, "iteration_count": 0}
 
 if __name__ == "__main__":
     logger.info("Starting FPS VLA Agent Client on http://0.0.0.0:8001")
@@ -370,4 +636,5 @@ if __name__ == "__main__":
     logger.info("\n🎮 Controls:")
     logger.info("  SPACE - Start next iteration (when wait_for_keypress=True)")
     logger.info("  P     - Quit loop")
+    logger.info("  POST /loop/start, /loop/pause, /loop/resume, /loop/stop; GET /loop/events")
     uvicorn.run(app, host="0.0.0.0", port=8001)
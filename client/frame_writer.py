@@ -0,0 +1,169 @@
+"""Background disk writer for encoded frames.
+
+Frames are encoded once (the bytes uploaded to the service are the bytes saved)
+and handed to a small thread pool, so the PNG write never blocks the event loop
+and overlaps with the upload. At most max_pending writes can be outstanding;
+submit() waits beyond that, which slows the agent down instead of letting
+frames pile up in memory when the disk falls behind.
+"""
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def encode_png(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_file(path: Path, data: bytes):
+    """Write via a temporary file so a crash never leaves a truncated frame."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def link_file(src: Path, dst: Path, data: bytes):
+    """Hard-link an already written frame under a second name (a copy if linking fails)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        write_file(dst, data)
+
+
+class FrameWriter:
+    def __init__(self, workers: int = 2, max_pending: int = 8):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-writer")
+        self.max_pending = max_pending
+        self.slots = None  # created lazily on the running event loop
+        self.pending = set()
+        self.by_path = {}  # path -> write future, while the write is outstanding
+        self.written = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.backpressure_s = 0.0
+
+    async def submit(self, path, data: bytes) -> asyncio.Future:
+        """Queue a write; waits while max_pending writes are outstanding."""
+        await self._acquire()
+        return self._start(Path(path), len(data), write_file, Path(path), data)
+
+    async def submit_link(self, src, dst, data: bytes) -> asyncio.Future:
+        """Queue dst as a hard link to src, once a queued write of src has finished."""
+        pending_write = self.by_path.get(Path(src))
+        if pending_write is not None:
+            await asyncio.gather(pending_write, return_exceptions=True)
+        await self._acquire()
+        # A link adds no bytes on disk (unless it falls back to a copy)
+        return self._start(Path(dst), 0, link_file, Path(src), Path(dst), data)
+
+    async def _acquire(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        start = time.perf_counter()
+        await self.slots.acquire()
+        self.backpressure_s += time.perf_counter() - start
+
+    def _start(self, path: Path, size: int, fn, *args) -> asyncio.Future:
+        future = asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        self.pending.add(future)
+        self.by_path[path] = future
+        future.add_done_callback(lambda f: self._done(f, path, size))
+        return future
+
+    def _done(self, future, path, size):
+        self.pending.discard(future)
+        if self.by_path.get(path) is future:
+            del self.by_path[path]
+        self.slots.release()
+        if future.cancelled() or future.exception() is not None:
+            self.errors += 1
+        else:
+            self.written += 1
+            self.bytes_written += size
+
+    async def drain(self):
+        """Wait for every queued write to finish."""
+        if self.pending:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "written": self.written,
+            "bytes_written": self.bytes_written,
+            "errors": self.errors,
+            "backpressure_s": round(self.backpressure_s, 3),
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    # Time until the upload can start and event-loop blocking per capture, for a
+    # 1920x1200 frame: PNG saved to disk and encoded again (before) versus
+    # encoded once in a thread with a background write (after)
+    import random
+    import tempfile
+    from PIL import Image
+
+    rng = random.Random(0)
+    # Flat colour blocks with some noise, closer to a game frame than random pixels
+    image = Image.new("RGB", (1920, 1200))
+    for _ in range(400):
+        x, y = rng.randrange(1920), rng.randrange(1200)
+        image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (x, y, x + rng.randrange(40, 300), y + rng.randrange(40, 300)))
+    image = Image.blend(image, Image.effect_noise((1920, 1200), 20).convert("RGB"), 0.15)
+    n = 5
+
+    async def blocked_ms(fn):
+        """Run fn while a ticker measures the longest event-loop stall."""
+        worst = 0.0
+        running = True
+
+        async def ticker():
+            nonlocal worst
+            while running:
+                t = time.perf_counter()
+                await asyncio.sleep(0.001)
+                worst = max(worst, (time.perf_counter() - t) * 1000.0 - 1.0)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await fn()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        running = False
+        await task
+        return elapsed, worst
+
+    async def main():
+        with tempfile.TemporaryDirectory() as tmp:
+            async def before():
+                for i in range(n):
+                    image.save(Path(tmp) / f"old_{i}.png")
+                    encode_png(image)
+                    await asyncio.sleep(0.005)  # one capture per iteration
+
+            writer = FrameWriter()
+
+            async def after():
+                for i in range(n):
+                    data = await asyncio.to_thread(encode_png, image)
+                    await writer.submit(Path(tmp) / f"new_{i}.png", data)
+
+            old_ms, old_block = await blocked_ms(before)
+            new_ms, new_block = await blocked_ms(after)
+            await writer.drain()
+            writer.close()
+            print(f"save + re-encode:     {old_ms / n:7.1f} ms per frame until upload, event loop blocked up to {old_block:7.1f} ms")
+            print(f"encode once + writer: {new_ms / n:7.1f} ms per frame until upload, event loop blocked up to {new_block:7.1f} ms")
+            print(f"writer {writer.stats()}")
+
+    asyncio.run(main())
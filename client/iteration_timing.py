@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+
+# Trace timeline row for each stage prefix, so capture, inference and actuation
+# appear on separate rows and any overlap between them is visible
+STAGE_TRACKS = {
+    "before": "capture",
+    "after": "capture",
+    "analyze": "inference",
+    "actuation": "actuation",
+    "settle": "actuation",
+}
+
+
+def stage_track(name: str) -> str:
+    return STAGE_TRACKS.get(name.split("_", 1)[0], "iteration")
+
+
+class IterationTimer:
+    """Monotonic stage timings for one agent iteration.
+
+    Stage durations are kept in stages_ms; marks_ms holds each stage's
+    [start, end] as milliseconds from the start of the iteration, so overlap
+    and gaps between stages can be reconstructed. Server-side timings returned
+    by the Molmo service are attached under server. With a tracer, each stage is
+    also recorded as a span on the track given by STAGE_TRACKS.
+    """
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.marks = {}
+        self.server = None
+
+    def _offset_ms(self, t: float) -> float:
+        return round((t - self.start) * 1000.0, 2)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name: str, start: float, end: float):
+        """Record a stage measured with time.perf_counter() timestamps."""
+        self.stages[name] = round((end - start) * 1000.0, 2)
+        self.marks[name] = [self._offset_ms(start), self._offset_ms(end)]
+        if self.tracer is not None and self.tracer.enabled:
+            self.tracer.complete(name, start, end, "iteration", stage_track(name))
+
+    def rename(self, name: str, new_name: str):
+        """Keep a recorded stage under another name, e.g. before the stage runs again."""
+        if name in self.stages:
+            self.stages[new_name] = self.stages.pop(name)
+            self.marks[new_name] = self.marks.pop(name)
+
+    def as_dict(self) -> dict:
+        timings = {
+            "total_ms": self._offset_ms(time.perf_counter()),
+            "stages_ms": self.stages,
+            "marks_ms": self.marks,
+        }
+        if self.server is not None:
+            timings["server"] = self.server
+        return timings
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ("complete", "stopped", "error")
+
+
+class LoopController:
+    """Run the agent loop as a background task that can be paused, stopped and observed.
+
+    Progress is published as NDJSON-style events ({"status": ..., ...}) to every
+    /loop/events subscriber. Recent events are kept so late subscribers can catch up.
+    Pause and stop take effect between iterations, so a key is never left pressed.
+    """
+
+    def __init__(self, history_size: int = 200, subscriber_queue_size: int = 500):
+        self.task = None
+        self.state = "idle"
+        self.iterations_completed = 0
+        self.iterations_requested = 0
+        self.stop_requested = False
+        self.resume_event = asyncio.Event()
+        self.resume_event.set()
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.subscriber_queue_size = subscriber_queue_size
+        self.seq = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, iteration_fn, iterations: int, delay_ms: int, wait_before=None) -> dict:
+        """Start the loop in the background.
+
+        - iteration_fn: async callable(loop_index) -> dict result of one iteration
+        - iterations: number of iterations, 0 = until stopped
+        - delay_ms: delay between iterations
+        - wait_before: optional async callable(controller) -> bool awaited before each
+          iteration; returning False stops the loop (e.g. wait for a keypress)
+        """
+        if self.running:
+            raise RuntimeError(f"Loop already {self.state}")
+        self.state = "running"
+        self.iterations_completed = 0
+        self.iterations_requested = iterations
+        self.stop_requested = False
+        self.resume_event.set()
+        self.history.clear()
+        self.task = asyncio.create_task(self._run(iteration_fn, iterations, delay_ms, wait_before))
+        return self.snapshot()
+
+    def pause(self) -> dict:
+        if self.state == "running":
+            self.state = "paused"
+            self.resume_event.clear()
+            self.publish({"status": "paused"})
+        return self.snapshot()
+
+    def resume(self) -> dict:
+        if self.state == "paused":
+            self.state = "running"
+            self.resume_event.set()
+            self.publish({"status": "resumed"})
+        return self.snapshot()
+
+    def stop(self) -> dict:
+        """Request a graceful stop after the current iteration."""
+        if self.running:
+            self.stop_requested = True
+            self.state = "stopping"
+            self.resume_event.set()
+            self.publish({"status": "stopping"})
+        return self.snapshot()
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "iterations_completed": self.iterations_completed,
+            "iterations_requested": self.iterations_requested,
+        }
+
+    def publish(self, event: dict):
+        self.seq += 1
+        event = {"seq": self.seq, "time": time.time(), **event}
+        self.history.append(event)
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow subscriber: drop its oldest event rather than stall the loop
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _sleep_unless_stopped(self, seconds: float):
+        end = time.monotonic() + seconds
+        while not self.stop_requested and time.monotonic() < end:
+            await asyncio.sleep(min(0.1, end - time.monotonic()))
+
+    async def _run(self, iteration_fn, iterations: int, delay_ms: int, wait_before):
+        self.publish({"status": "started", "iterations": iterations, "delay_ms": delay_ms})
+        index = 0
+        try:
+            while (iterations == 0 or index < iterations) and not self.stop_requested:
+                await self.resume_event.wait()
+                if self.stop_requested:
+                    break
+                if wait_before is not None and not await wait_before(self):
+                    self.stop_requested = True
+                    break
+
+                index += 1
+                start = time.perf_counter()
+                try:
+                    result = await iteration_fn(index)
+                    status = result.get("status", "success")
+                except Exception as e:
+                    logger.error(f"Iteration {index} error: {e}")
+                    result = {"status": "error", "message": str(e)}
+                    status = "error"
+                duration_ms = (time.perf_counter() - start) * 1000.0
+                self.iterations_completed = index
+
+                event = {
+                    "status": "iteration",
+                    "index": index,
+                    "result": status,
+                    "duration_ms": round(duration_ms, 1),
+                }
+                for key in ("iteration", "message", "commands", "timings"):
+                    if key in result:
+                        event[key] = result[key]
+                self.publish(event)
+
+                if delay_ms > 0 and (iterations == 0 or index < iterations):
+                    await self._sleep_unless_stopped(delay_ms / 1000.0)
+
+            self.state = "stopped" if self.stop_requested else "complete"
+            self.publish({"status": self.state, "iterations_completed": self.iterations_completed})
+        except asyncio.CancelledError:
+            self.state = "stopped"
+            self.publish({"status": "stopped", "iterations_completed": self.iterations_completed})
+            raise
+        except Exception as e:
+            logger.error(f"Loop failed: {e}")
+            self.state = "error"
+            self.publish({"status": "error", "message": str(e)})
+        logger.info(f"Loop {self.state} after {self.iterations_completed} iterations")
+
+    async def events(self, fmt: str = "ndjson"):
+        """Yield recent and live events as NDJSON lines or SSE messages until the loop ends."""
+        queue = asyncio.Queue(maxsize=self.subscriber_queue_size)
+        backlog = list(self.history)
+        self.subscribers.add(queue)
+        try:
+            for event in backlog:
+                yield self._format(event, fmt)
+            if not self.running:
+                return
+            while True:
+                event = await queue.get()
+                yield self._format(event, fmt)
+                if event["status"] in TERMINAL_STATES:
+                    return
+        finally:
+            self.subscribers.discard(queue)
+
+    @staticmethod
+    def _format(event: dict, fmt: str) -> str:
+        if fmt == "sse":
+            return f"event: {event['status']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
@@ -0,0 +1,5 @@
+"""Helpers shared by the client, orchestrator, molmo-service and utils scripts.
+
+The scripts in this repository are run directly (``python client/...``), so
+callers add the repository root to ``sys.path`` before importing from here.
+"""
@@ -0,0 +1,319 @@
+"""Deduplicated, content-addressed archive of evaluation frames.
+
+A campaign saves a before and an after PNG per iteration, and many of them are
+identical (reused frames, static scenes). An archive stores each distinct image
+once and indexes every frame name against it:
+
+    archive/
+      manifest.json   format, codec it was created with, codecs present, run names, counts
+      blobs.bin       encoded images, back to back
+      blobs.npy       per image: content digest, offset, length, size, codec
+      frames.npy      per frame: sort key, run, iteration, kind, image row
+      names.txt       original relative file names, one per frames.npy row
+
+Images are addressed by a digest of their decoded pixels, so the same image
+saved twice (or encoded differently) is stored once. The .npy index files are
+memory-mapped and blobs.bin is read through mmap, so opening an archive costs
+the same for ten frames or a million, and reading a frame is one slice and one
+decode:
+
+    archive = FrameArchive("vla_evaluation.frames")
+    image = archive.read(42, "before", run="20260301-101500-ab12cd")
+
+Codecs: "png" keeps imported PNG bytes as they are (lossless, no re-encode),
+"webp-lossless" is smaller and still lossless, "webp" and "jpeg" are lossy at
+the given quality. numpy and Pillow are the only requirements.
+"""
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+FORMAT_VERSION = 1
+CODECS = ("png", "webp-lossless", "webp", "jpeg")
+KINDS = ("before", "after")
+FRAME_NAME_REGEX = re.compile(r"^(?:(?P<run>.+)/)?(?P<kind>before|after)_(?P<iteration>\d+)\.png$")
+
+BLOB_DTYPE = np.dtype([
+    ("digest", "V16"),
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("codec", "u1"),
+])
+FRAME_DTYPE = np.dtype([
+    ("key", "<u8"),  # run << 40 | iteration << 8 | kind; rows are sorted by it
+    ("run", "<u2"),
+    ("iteration", "<u4"),
+    ("kind", "u1"),
+    ("blob", "<u4"),
+])
+
+
+def frame_key(run: int, iteration: int, kind: int) -> int:
+    return (run << 40) | (iteration << 8) | kind
+
+
+def parse_frame_name(name: str):
+    """(run, kind, iteration) of a frame name such as run_id/before_0001.png."""
+    match = FRAME_NAME_REGEX.match(name)
+    if not match:
+        raise ValueError(f"Not a frame name: {name}")
+    return match.group("run") or "", match.group("kind"), int(match.group("iteration"))
+
+
+def pixel_digest(image: Image.Image) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.digest()
+
+
+def encode(image: Image.Image, codec: str, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    if codec == "png":
+        image.save(buffer, format="PNG")
+    elif codec == "webp-lossless":
+        image.save(buffer, format="WEBP", lossless=True, method=4)
+    elif codec == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    elif codec == "jpeg":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    else:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+    return buffer.getvalue()
+
+
+class FrameArchiveWriter:
+    """
+    Adds frames to a new or existing archive. The index is rewritten on close()
+    (via temporary files, so a reader never sees a partial index); blobs written
+    after the last close are dropped when the archive is reopened.
+    """
+
+    def __init__(self, path, codec: str = "png", quality: int = 90):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.quality = quality
+        self.created_codec = codec
+        self.runs, blobs, frames, names = [], [], [], []
+        if (self.path / "manifest.json").exists():
+            manifest = json.loads((self.path / "manifest.json").read_text())
+            # Reopening with another codec adds blobs in it; existing ones keep theirs
+            self.created_codec = manifest["codec"]
+            self.runs = manifest["runs"]
+            blobs = np.load(self.path / "blobs.npy").tolist()
+            frames = np.load(self.path / "frames.npy").tolist()
+            names = (self.path / "names.txt").read_text(encoding="utf-8").splitlines()
+        self.blobs = blobs
+        self.frames = {row[0]: row for row in frames}
+        self.names = {row[0]: name for row, name in zip(frames, names)}
+        self.digests = {bytes(row[0]): i for i, row in enumerate(blobs)}
+        end = blobs[-1][1] + blobs[-1][2] if blobs else 0
+        self.data = open(self.path / "blobs.bin", "ab")
+        self.data.truncate(end)
+        self.data.seek(end)
+        self.added = 0
+        self.deduplicated = 0
+
+    def run_index(self, run: str) -> int:
+        if run not in self.runs:
+            self.runs.append(run)
+        return self.runs.index(run)
+
+    def add(self, name: str, image: Image.Image, source_bytes: bytes | None = None,
+            digest: bytes | None = None) -> bool:
+        """
+        Add one frame under its relative name (run_id/before_0001.png). With the png
+        codec, source_bytes (the original PNG file) are stored as they are. Returns
+        False when the image was already stored and only the frame was indexed.
+        """
+        run, kind, iteration = parse_frame_name(name)
+        digest = digest or pixel_digest(image)
+        blob = self.digests.get(digest)
+        is_new = blob is None
+        if is_new:
+            data = source_bytes if source_bytes is not None and self.codec == "png" else encode(image, self.codec, self.quality)
+            blob = self.add_blob(digest, data, image.width, image.height)
+        else:
+            self.deduplicated += 1
+        self.index_frame(name, run, iteration, kind, blob)
+        return is_new
+
+    def add_blob(self, digest: bytes, data: bytes, width: int, height: int) -> int:
+        offset = self.data.tell()
+        self.data.write(data)
+        self.blobs.append((digest, offset, len(data), width, height, CODECS.index(self.codec)))
+        self.digests[digest] = len(self.blobs) - 1
+        self.added += 1
+        return len(self.blobs) - 1
+
+    def index_frame(self, name: str, run: str, iteration: int, kind: str, blob: int):
+        run_index = self.run_index(run)
+        key = frame_key(run_index, iteration, KINDS.index(kind))
+        self.frames[key] = (key, run_index, iteration, KINDS.index(kind), blob)
+        self.names[key] = name
+
+    def close(self):
+        self.data.close()
+        keys = sorted(self.frames)
+        blobs = np.array(self.blobs, dtype=BLOB_DTYPE)
+        frames = np.array([self.frames[key] for key in keys], dtype=FRAME_DTYPE)
+        manifest = {
+            "format": FORMAT_VERSION,
+            "codec": self.created_codec,
+            "codecs": sorted({CODECS[row[5]] for row in self.blobs}, key=CODECS.index),
+            "quality": self.quality,
+            "runs": self.runs,
+            "frames": len(frames),
+            "blobs": len(blobs),
+        }
+        for name, write in (
+            ("blobs.npy", lambda f: np.save(f, blobs)),
+            ("frames.npy", lambda f: np.save(f, frames)),
+            ("names.txt", lambda f: f.write("".join(self.names[key] + "\n" for key in keys).encode("utf-8"))),
+            ("manifest.json", lambda f: f.write(json.dumps(manifest, indent=2).encode())),
+        ):
+            tmp_path = self.path / f".{name}.tmp"
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, self.path / name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameArchive:
+    """Read-only, memory-mapped view of an archive; safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / "manifest.json").read_text())
+        if self.manifest["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported frame archive format {self.manifest['format']}")
+        self.runs = self.manifest["runs"]
+        self.blobs = np.load(self.path / "blobs.npy", mmap_mode="r")
+        self.frames = np.load(self.path / "frames.npy", mmap_mode="r")
+        self._names = None
+        with open(self.path / "blobs.bin", "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def names(self) -> list[str]:
+        if self._names is None:
+            self._names = (self.path / "names.txt").read_text(encoding="utf-8").splitlines()
+        return self._names
+
+    def row(self, iteration: int, kind: str = "before", run: str | None = None) -> int:
+        """frames.npy row of a frame; run may be omitted when the archive holds one run."""
+        if run is None:
+            if len(self.runs) != 1:
+                raise KeyError(f"Archive holds {len(self.runs)} runs, pass run=")
+            run_index = 0
+        else:
+            run_index = self.runs.index(run)
+        key = frame_key(run_index, iteration, KINDS.index(kind))
+        row = int(np.searchsorted(self.frames["key"], key))
+        if row == len(self.frames) or self.frames["key"][row] != key:
+            raise KeyError(f"No {kind} frame for iteration {iteration} of run {self.runs[run_index]!r}")
+        return row
+
+    def row_of_name(self, name: str) -> int:
+        run, kind, iteration = parse_frame_name(name)
+        return self.row(iteration, kind, run if run in self.runs else None)
+
+    def read_bytes(self, row: int) -> memoryview:
+        """Encoded bytes of a frame (a view into the mapped file, no copy)."""
+        blob = self.blobs[self.frames["blob"][row]]
+        offset, length = int(blob["offset"]), int(blob["length"])
+        return memoryview(self.data)[offset:offset + length]
+
+    def read_row(self, row: int) -> Image.Image:
+        image = Image.open(io.BytesIO(self.read_bytes(row)))
+        image.load()
+        return image
+
+    def read(self, iteration: int, kind: str = "before", run: str | None = None) -> Image.Image:
+        return self.read_row(self.row(iteration, kind, run))
+
+    def read_name(self, name: str) -> Image.Image:
+        return self.read_row(self.row_of_name(name))
+
+    def codec(self, row: int) -> str:
+        return CODECS[self.blobs["codec"][self.frames["blob"][row]]]
+
+    def stats(self) -> dict:
+        stored = int(self.blobs["length"].sum()) if len(self.blobs) else 0
+        return {
+            "frames": len(self.frames),
+            "unique_images": len(self.blobs),
+            "runs": len(self.runs),
+            "stored_bytes": stored,
+            "dedup_ratio": round(len(self.frames) / len(self.blobs), 3) if len(self.blobs) else None,
+            # Codecs of the stored images: an archive reopened with another codec mixes them
+            "codec": "+".join(CODECS[i] for i in np.unique(self.blobs["codec"])) or self.manifest["codec"],
+        }
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def _decode_and_hash(path: Path):
+    data = path.read_bytes()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image, data, pixel_digest(image)
+
+
+def import_png_dir(frames_dir, archive_path, codec: str = "png", quality: int = 90, workers: int = 4) -> dict:
+    """
+    Add every before_/after_ PNG under frames_dir (including run subdirectories) to
+    an archive. Decoding and hashing run in a thread pool, and only images not yet
+    in the archive are encoded, in the same pool.
+    """
+    frames_dir = Path(frames_dir)
+    paths = sorted(
+        path for path in frames_dir.rglob("*.png")
+        if FRAME_NAME_REGEX.match(path.relative_to(frames_dir).as_posix())
+    )
+    source_bytes = 0
+    with FrameArchiveWriter(archive_path, codec, quality) as writer, ThreadPoolExecutor(workers) as pool:
+        window = max(1, workers * 4)  # bounds the decoded images held in memory
+        for start in range(0, len(paths), window):
+            batch = paths[start:start + window]
+            decoded = list(pool.map(_decode_and_hash, batch))
+            new = {}
+            for path, (image, data, digest) in zip(batch, decoded):
+                if digest not in writer.digests and digest not in new:
+                    new[digest] = pool.submit(lambda i=image, d=data: d if codec == "png" else encode(i, codec, quality))
+            for path, (image, data, digest) in zip(batch, decoded):
+                name = path.relative_to(frames_dir).as_posix()
+                run, kind, iteration = parse_frame_name(name)
+                source_bytes += len(data)
+                if digest in new and digest not in writer.digests:
+                    blob = writer.add_blob(digest, new[digest].result(), image.width, image.height)
+                else:
+                    blob = writer.digests[digest]
+                    writer.deduplicated += 1
+                writer.index_frame(name, run, iteration, kind, blob)
+        result = {"files": len(paths), "source_bytes": source_bytes,
+                  "new_images": writer.added, "deduplicated": writer.deduplicated}
+    return result
@@ -0,0 +1,285 @@
+"""Single-pass parser for the fine-tuned Molmo output template.
+
+    The blue soldier in the image is at <points coords="1 1 257 917">blue soldier</points>
+    while the centre of the image is at <points coords="1 1 500 500">centre of image</points>.
+    The action to be taken is therefore (243, -417)
+
+One regex scan over the text collects every <points>/<tracks> tag (coords and label)
+and every (dx, dy) tuple, so the service and all utils analyses read the same
+ParsedOutput instead of re-parsing the text with their own regexes:
+
+    parsed = parse(text)
+    parsed.commands()               # keyboard commands, as the service actuates them
+    parsed.pixel_points(1920, 1200) # [(frame_id, x, y), ...] in pixels
+    parsed.drift(tol_px=10)         # action vs. object/centre points consistency
+
+parse_commands(text) gives the same commands as parse(text).commands() without
+building a ParsedOutput, for the service's per-request hot path.
+
+StreamingParser consumes the text chunk by chunk as tokens are generated and
+yields the same result as parse() on the full text.
+"""
+import re
+from dataclasses import dataclass, field
+from math import sqrt
+from typing import NamedTuple
+
+CENTRE_LABEL = "centre of image"
+CENTRE_COORDS = "1 1 500 500"
+ACTION_SENTENCE = "The action to be taken is therefore"
+
+# A (dx, dy) tuple, optionally preceded by the action sentence
+TUPLE_PATTERN = (
+    r"(?P<sentence>" + ACTION_SENTENCE + r"\s*)?"
+    r"\((?P<lpad>\s*)(?P<dx>[+-]?\d+)\s*,\s*(?P<dy>[+-]?\d+)(?P<rpad>\s*)\)"
+)
+TUPLE_REGEX = re.compile(TUPLE_PATTERN)
+# Either a <points>/<tracks> tag, with its label when the closing tag is present,
+# or a (dx, dy) tuple
+OUTPUT_REGEX = re.compile(
+    # The lookahead lets the scan skip plain text without trying each branch
+    r"(?=[<T(])(?:<(?P<tag>(?i:points|tracks))\b(?P<attrs>[^>]*)>(?:(?P<label>.*?)</(?i:points|tracks)>)?"
+    r"|" + TUPLE_PATTERN + ")",
+    re.DOTALL,
+)
+# Fast path for the usual single point, coords="frame idx x y"
+SINGLE_POINT_REGEX = re.compile(r' coords="([0-9]+) ([0-9]+) ([0-9]{3,4}) ([0-9]{3,4})"')
+# coords attribute in the strict form the pointing format uses (scaled by 1000)
+STRICT_COORDS_REGEX = re.compile(r' coords="([0-9\t:;, .]+)"/?$')
+COORDS_REGEX = re.compile(r'coords="([^"]+)"', re.IGNORECASE)
+FRAME_REGEX = re.compile(r"(?:^|\t|:|,|;)([0-9\.]+) ([0-9\. ]+)")
+POINTS_REGEX = re.compile(r"([0-9]+) ([0-9]{3,4}) ([0-9]{3,4})")
+INT_REGEX = re.compile(r"[+-]?\d+")
+# The tuple the service acts on (ParsedOutput.action): the first bare "(dx, dy)"
+ACTION_TUPLE_REGEX = re.compile(r"\((-?\d+)\s*,\s*(-?\d+)\)")
+
+
+class Point(NamedTuple):
+    """One point of a coords attribute, in the model's 0-1000 scale."""
+    frame: str
+    idx: str
+    x: int
+    y: int
+
+
+class Tag(NamedTuple):
+    name: str
+    coords: str | None
+    label: str | None  # None when the closing tag is missing
+
+
+def _tag_points(tag: Tag) -> list[Point]:
+    if tag.coords is None:
+        return []
+    points = []
+    for group in FRAME_REGEX.finditer(tag.coords):
+        for match in POINTS_REGEX.finditer(group.group(2)):
+            points.append(Point(group.group(1), match.group(1), int(match.group(2)), int(match.group(3))))
+    return points
+
+
+@dataclass(slots=True)
+class ParsedOutput:
+    """Everything the analyses need from one model output.
+
+    action is the first (dx, dy) anywhere in the text, tag attributes and labels
+    included (what the service actuates); template_action only counts a tuple inside
+    "The action to be taken is therefore (dx, dy)".
+    object_point and centre_point are the last two numbers of the first non-centre
+    <points> tag and of the "centre of image" tag; has_object is set once a tag
+    other than the centre carries a point in the pointing format (3-4 digit coords).
+    """
+    tags: list[Tag] = field(default_factory=list)
+    points: list[Point] = field(default_factory=list)
+    action: tuple[int, int] | None = None
+    template_action: tuple[int, int] | None = None
+    object_point: tuple[int, int] | None = None
+    centre_point: tuple[int, int] | None = None
+    has_points: bool = False
+    has_object: bool = False
+    has_centre: bool = False
+    exit: bool = False
+
+    def add_tag(self, name: str, attrs: str, label: str | None):
+        if name.lower() == "points":
+            self.has_points = True
+        single = SINGLE_POINT_REGEX.fullmatch(attrs) if name == "points" else None
+        if single is not None:
+            frame, idx, x, y = single.groups()
+            self.tags.append(Tag(name, attrs[9:-1], label))
+            self.points.append(Point(frame, idx, int(x), int(y)))
+            if label is not None:
+                if CENTRE_LABEL not in label.lower():
+                    self.has_object = True
+                if label == CENTRE_LABEL and x == "500" and y == "500" and frame == "1" and idx == "1":
+                    self.has_centre = True
+                if CENTRE_LABEL in label.lower():
+                    self.centre_point = (int(x), int(y))
+                elif self.object_point is None:
+                    self.object_point = (int(x), int(y))
+            return
+        # Only lowercase tags with well-formed coords carry points for pixel_points()
+        strict = STRICT_COORDS_REGEX.search(attrs) if name in ("points", "tracks") else None
+        tag = Tag(name, strict.group(1) if strict else None, label)
+        self.tags.append(tag)
+        points = _tag_points(tag)
+        self.points.extend(points)
+        if points and label is not None and CENTRE_LABEL not in label.lower():
+            self.has_object = True
+        if name.lower() != "points" or label is None:
+            return
+        if name == "points" and label == CENTRE_LABEL and attrs == f' coords="{CENTRE_COORDS}"':
+            self.has_centre = True
+        coords = COORDS_REGEX.search(attrs)
+        nums = INT_REGEX.findall(coords.group(1)) if coords else []
+        if len(nums) < 2:
+            return
+        xy = (int(nums[-2]), int(nums[-1]))
+        if CENTRE_LABEL in label.lower():
+            self.centre_point = xy
+        elif self.object_point is None:
+            self.object_point = xy
+
+    def add_match(self, match: re.Match):
+        tag, attrs, label, sentence, lpad, dx, dy, rpad = match.groups()
+        if tag is None:
+            self.add_tuple(sentence, lpad, dx, dy, rpad)
+            return
+        self.add_tag(tag, attrs, label)
+        # An action written inside a tag (e.g. the whole sentence as the label) still counts
+        for inner in (attrs, label):
+            if inner and "(" in inner:
+                for tuple_match in TUPLE_REGEX.finditer(inner):
+                    self.add_tuple(*tuple_match.groups())
+
+    def add_tuple(self, sentence, lpad, dx, dy, rpad):
+        if sentence is not None and self.template_action is None:
+            self.template_action = (int(dx), int(dy))
+        # The service only acts on a bare "(dx, dy)" without padding or explicit plus signs
+        if (self.action is None and not lpad and not rpad
+                and dx[0] != "+" and dy[0] != "+"):
+            self.action = (int(dx), int(dy))
+
+    @property
+    def well_formed(self) -> bool:
+        """An object point, the canonical centre tag and the template action are all present (or "exit")."""
+        return self.exit or (self.has_object and self.has_centre and self.template_action is not None)
+
+    def commands(self) -> dict:
+        """Keyboard commands: positive dx moves left, positive dy moves up."""
+        return _commands(self.exit, self.action)
+
+    def pixel_points(self, image_w, image_h, extract_ids=False) -> list[tuple]:
+        """Points rescaled to pixels as (frame_id, x, y), or (frame_id, idx, x, y).
+
+        image_w/image_h may be per-frame lists for multi-image outputs; points
+        outside the image are dropped.
+        """
+        per_frame = isinstance(image_w, (list, tuple)) and isinstance(image_h, (list, tuple))
+        result = []
+        for point in self.points:
+            frame_id = int(point.frame) if per_frame else float(point.frame)
+            w, h = (image_w[frame_id - 1], image_h[frame_id - 1]) if per_frame else (image_w, image_h)
+            x, y = point.x / 1000 * w, point.y / 1000 * h
+            if 0 <= x <= w and 0 <= y <= h:
+                result.append((frame_id, point.idx, int(x), int(y)) if extract_ids else (frame_id, int(x), int(y)))
+        return result
+
+    def drift(self, tol_px=5) -> dict:
+        """Compare the template action with the move that puts the centre on the object."""
+        result = {
+            "obj_point": self.object_point,
+            "centre_point": self.centre_point,
+            "action": self.template_action,
+            "diff_vec": None,
+            "diff_norm": None,
+            "is_consistent": False,
+        }
+        if not (self.object_point and self.centre_point and self.template_action):
+            return result
+        diff_x = (self.centre_point[0] - self.object_point[0]) - self.template_action[0]
+        diff_y = (self.centre_point[1] - self.object_point[1]) - self.template_action[1]
+        diff_norm = sqrt(diff_x ** 2 + diff_y ** 2)
+        result["diff_vec"] = (diff_x, diff_y)
+        result["diff_norm"] = diff_norm
+        result["is_consistent"] = diff_norm <= tol_px
+        return result
+
+
+def _commands(exit: bool, action: tuple | None) -> dict:
+    commands = {"up": 0, "down": 0, "left": 0, "right": 0, "exit": 0}
+    if exit:
+        commands["exit"] = 1
+        return commands
+    if action is not None:
+        dx, dy = action
+        if dx > 0:
+            commands["left"] = dx
+        elif dx < 0:
+            commands["right"] = -dx
+        if dy > 0:
+            commands["up"] = dy
+        elif dy < 0:
+            commands["down"] = -dy
+    return commands
+
+
+def parse_commands(text: str) -> dict:
+    """parse(text).commands() from one regex search, without collecting tags or points."""
+    if text.strip().lower() == "exit":
+        return _commands(True, None)
+    match = ACTION_TUPLE_REGEX.search(text)
+    return _commands(False, (int(match.group(1)), int(match.group(2))) if match else None)
+
+
+def parse(text: str) -> ParsedOutput:
+    """Parse a complete model output in one pass."""
+    parsed = ParsedOutput()
+    if text.strip().lower() == "exit":
+        parsed.exit = True
+        return parsed
+    for match in OUTPUT_REGEX.finditer(text):
+        parsed.add_match(match)
+    return parsed
+
+
+class StreamingParser:
+    """
+    Incremental parse() for text arriving in chunks (e.g. streamed tokens).
+
+    Matches are committed as soon as they are complete: a (dx, dy) tuple at its ")",
+    a tag at its closing tag. An unclosed tag holds back everything after it until
+    it closes or close() is called, so the final result always equals parse(text).
+
+        parser = StreamingParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+            if parser.result.action is not None:
+                ...                     # act before generation finishes
+        parsed = parser.close()
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.result = ParsedOutput()
+
+    def feed(self, chunk: str) -> ParsedOutput:
+        self.buffer += chunk
+        while True:
+            match = OUTPUT_REGEX.search(self.buffer, self.pos)
+            if match is None or (match.group("tag") is not None and match.group("label") is None):
+                # Nothing complete yet, or a tag still waiting for its closing tag
+                break
+            self.result.add_match(match)
+            self.pos = match.end()
+        return self.result
+
+    def close(self) -> ParsedOutput:
+        if self.buffer.strip().lower() == "exit":
+            self.result = ParsedOutput(exit=True)
+            return self.result
+        for match in OUTPUT_REGEX.finditer(self.buffer, self.pos):
+            self.result.add_match(match)
+        self.pos = len(self.buffer)
+        return self.result
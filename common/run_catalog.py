@@ -0,0 +1,220 @@
+"""SQLite index of evaluation runs, their iterations and frame files.
+
+Every run gets its own run_id and screenshot subdirectory, so successive or
+concurrent runs never overwrite each other's frames. The next iteration number
+is an atomic counter on the run row (no directory scan on resume), and each
+iteration stores the byte offset of its metadata.jsonl record so analyses can
+jump straight to it:
+
+    catalog = RunCatalog(SCREENSHOTS_DIR / "runs.sqlite")
+    run_id = catalog.latest_run() or catalog.start_run(prompt=...)
+    iteration = catalog.next_iteration(run_id)
+    catalog.record_frame(run_id, iteration, "before", f"{run_id}/before_0001.png")
+    catalog.record_iteration(run_id, iteration, metadata, offset)
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    prompt TEXT,
+    adapter TEXT,
+    metadata_file TEXT,
+    last_iteration INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    iteration INTEGER NOT NULL,
+    timestamp TEXT,
+    request_id TEXT,
+    metadata_offset INTEGER,
+    PRIMARY KEY (run_id, iteration)
+);
+CREATE TABLE IF NOT EXISTS frames (
+    path TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    iteration INTEGER NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS frames_by_iteration ON frames (run_id, iteration);
+CREATE INDEX IF NOT EXISTS runs_by_start ON runs (started_at);
+"""
+LEGACY_FRAME_REGEX = re.compile(r"^(before|after)_(\d+)\.png$")
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class RunCatalog:
+    """
+    Thin wrapper around one SQLite file. Usable from several threads and processes:
+    WAL mode lets readers run alongside the writer, and the iteration counter is
+    incremented inside an immediate transaction.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ------------- runs -------------
+
+    def start_run(self, run_id=None, prompt=None, adapter=None, metadata_file=None, last_iteration=0) -> str:
+        run_id = run_id or new_run_id()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO runs (run_id, started_at, prompt, adapter, metadata_file, last_iteration) VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, datetime.now().isoformat(), prompt, adapter, metadata_file, last_iteration),
+            )
+        return run_id
+
+    def finish_run(self, run_id, status="finished"):
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status = ? WHERE run_id = ?", (status, run_id))
+
+    def latest_run(self, status="active") -> str | None:
+        row = self.conn.execute(
+            "SELECT run_id FROM runs WHERE status = ? ORDER BY started_at DESC LIMIT 1", (status,)
+        ).fetchone()
+        return row["run_id"] if row else None
+
+    def run(self, run_id) -> dict | None:
+        row = self.conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def runs(self) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT r.*, (SELECT COUNT(*) FROM iterations i WHERE i.run_id = r.run_id) AS iterations "
+            "FROM runs r ORDER BY started_at"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_iteration(self, run_id) -> int:
+        row = self.conn.execute("SELECT last_iteration FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown run {run_id}")
+        return row["last_iteration"]
+
+    def next_iteration(self, run_id) -> int:
+        """Reserve the next iteration number of a run (atomic across processes)."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("UPDATE runs SET last_iteration = last_iteration + 1 WHERE run_id = ?", (run_id,))
+                row = self.conn.execute("SELECT last_iteration FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            raise KeyError(f"Unknown run {run_id}")
+        return row["last_iteration"]
+
+    # ------------- iterations and frames -------------
+
+    def record_frame(self, run_id, iteration, kind, path):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO frames (path, run_id, iteration, kind) VALUES (?, ?, ?, ?)",
+                (str(path), run_id, iteration, kind),
+            )
+
+    def record_iteration(self, run_id, iteration, metadata: dict, metadata_offset=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO iterations (run_id, iteration, timestamp, request_id, metadata_offset) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, iteration, metadata.get("timestamp"), metadata.get("request_id"), metadata_offset),
+            )
+
+    def iterations(self, run_id, start=None, end=None) -> list[dict]:
+        """Iterations of a run (optionally start <= iteration <= end) with their frame paths."""
+        query = (
+            "SELECT i.*, r.metadata_file, "
+            "(SELECT path FROM frames f WHERE f.run_id = i.run_id AND f.iteration = i.iteration AND f.kind = 'before') AS before_screenshot, "
+            "(SELECT path FROM frames f WHERE f.run_id = i.run_id AND f.iteration = i.iteration AND f.kind = 'after') AS after_screenshot "
+            "FROM iterations i JOIN runs r USING (run_id) WHERE i.run_id = ?"
+        )
+        params = [run_id]
+        if start is not None:
+            query += " AND i.iteration >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND i.iteration <= ?"
+            params.append(end)
+        rows = self.conn.execute(query + " ORDER BY i.iteration", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def frame(self, path) -> dict | None:
+        row = self.conn.execute("SELECT * FROM frames WHERE path = ?", (str(path),)).fetchone()
+        return dict(row) if row else None
+
+    def read_metadata(self, run_id, iteration) -> dict | None:
+        """The metadata.jsonl record of one iteration, read by byte offset."""
+        rows = self.iterations(run_id, iteration, iteration)
+        if not rows or rows[0]["metadata_offset"] is None or not rows[0]["metadata_file"]:
+            return None
+        with open(rows[0]["metadata_file"], "rb") as f:
+            f.seek(rows[0]["metadata_offset"])
+            return json.loads(f.readline())
+
+    # ------------- migration -------------
+
+    def adopt_legacy_dir(self, screenshots_dir, metadata_file=None) -> str | None:
+        """
+        Register frames saved before runs existed (before_XXXX.png in the top-level
+        directory) as one "legacy" run, so numbering of old and new frames never
+        collides. Scans the directory once; later starts find the run in the index.
+        """
+        if self.conn.execute("SELECT 1 FROM runs WHERE run_id = 'legacy'").fetchone():
+            return "legacy"
+        frames = []
+        for name in os.listdir(screenshots_dir):
+            match = LEGACY_FRAME_REGEX.match(name)
+            if match:
+                frames.append((name, int(match.group(2)), match.group(1)))
+        if not frames:
+            return None
+        last = max(iteration for _, iteration, _ in frames)
+        self.start_run("legacy", metadata_file=str(metadata_file) if metadata_file else None, last_iteration=last)
+        self.finish_run("legacy")
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO frames (path, run_id, iteration, kind) VALUES (?, 'legacy', ?, ?)", frames
+            )
+            if metadata_file and Path(metadata_file).exists():
+                with open(metadata_file, "rb") as f:
+                    offset = f.tell()
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            record = None
+                        if record and record.get("iteration") is not None and not record.get("run_id"):
+                            self.conn.execute(
+                                "INSERT OR REPLACE INTO iterations (run_id, iteration, timestamp, request_id, metadata_offset) "
+                                "VALUES ('legacy', ?, ?, ?, ?)",
+                                (record["iteration"], record.get("timestamp"), record.get("request_id"), offset),
+                            )
+                        offset += len(line)
+            self.conn.execute("COMMIT")
+        return "legacy"
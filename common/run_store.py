@@ -0,0 +1,255 @@
+"""Columnar (Parquet) store for agent iterations, alongside metadata.jsonl.
+
+Each metadata record becomes one row with the model output already parsed into
+typed columns (points, template action, object/centre points, drift, commands)
+and the timings flattened, so analyses query columns instead of re-parsing JSON:
+
+    table = load_table("vla_evaluation/store", columns=["iteration", "drift_px"])
+    drifted = filter_drift(table, min_px=50)
+
+Rows are buffered and written as one Parquet file per row group under the store
+directory. Every file is complete on its own, so a crash loses at most the
+unflushed buffer. pyarrow is optional; it is only imported when a store is used.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from common.molmo_parsing import parse
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = None
+
+COMMAND_KEYS = ("up", "down", "left", "right", "exit")
+DEFAULT_ROW_GROUP_SIZE = 1024
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The columnar run store needs pyarrow: uv pip install pyarrow")
+
+
+def schema():
+    _require_pyarrow()
+    point = pa.struct([("frame", pa.float32()), ("idx", pa.int32()), ("x", pa.int32()), ("y", pa.int32())])
+    stages = pa.map_(pa.string(), pa.float64())
+    return pa.schema([
+        ("run_id", pa.string()),
+        ("iteration", pa.int64()),
+        ("timestamp", pa.string()),
+        ("request_id", pa.string()),
+        ("before_screenshot", pa.string()),
+        ("after_screenshot", pa.string()),
+        ("prompt", pa.string()),
+        ("adapter", pa.string()),
+        ("vla_output", pa.string()),
+        # parsed model output
+        ("has_points", pa.bool_()),
+        ("has_action", pa.bool_()),
+        ("has_centre", pa.bool_()),
+        ("points", pa.list_(point)),
+        ("obj_x", pa.int32()),
+        ("obj_y", pa.int32()),
+        ("ctr_x", pa.int32()),
+        ("ctr_y", pa.int32()),
+        ("action_dx", pa.int32()),
+        ("action_dy", pa.int32()),
+        ("drift_px", pa.float64()),
+        # recorded commands and actuation
+        *[(f"cmd_{key}", pa.int32()) for key in COMMAND_KEYS],
+        ("executed_durations", pa.string()),  # JSON; shape depends on the actuator
+        # timings
+        ("total_ms", pa.float64()),
+        ("stages_ms", stages),
+        ("server_total_ms", pa.float64()),
+        ("server_stages_ms", stages),
+        ("server_generated_tokens", pa.int32()),
+        ("server_tokens_per_s", pa.float64()),
+    ])
+
+
+def record_to_row(record: dict, run_id: str | None = None) -> dict:
+    """Flatten one metadata.jsonl record into a row of the store schema."""
+    text = record.get("vla_output") or ""
+    parsed = parse(text)
+    drift = parsed.drift()
+    commands = record.get("commands") or {}
+    timings = record.get("timings") or {}
+    server = timings.get("server") or {}
+    obj = parsed.object_point or (None, None)
+    ctr = parsed.centre_point or (None, None)
+    action = parsed.template_action or (None, None)
+    return {
+        "run_id": run_id or record.get("run_id"),
+        "iteration": record.get("iteration"),
+        "timestamp": record.get("timestamp"),
+        "request_id": record.get("request_id"),
+        "before_screenshot": record.get("before_screenshot"),
+        "after_screenshot": record.get("after_screenshot"),
+        "prompt": record.get("prompt"),
+        "adapter": record.get("adapter"),
+        "vla_output": text,
+        "has_points": parsed.has_points,
+        "has_action": parsed.template_action is not None,
+        "has_centre": parsed.has_centre,
+        "points": [
+            {"frame": float(p.frame), "idx": int(p.idx), "x": p.x, "y": p.y} for p in parsed.points
+        ],
+        "obj_x": obj[0],
+        "obj_y": obj[1],
+        "ctr_x": ctr[0],
+        "ctr_y": ctr[1],
+        "action_dx": action[0],
+        "action_dy": action[1],
+        "drift_px": drift["diff_norm"],
+        **{f"cmd_{key}": commands.get(key, 0) for key in COMMAND_KEYS},
+        "executed_durations": json.dumps(record.get("executed_durations")) if record.get("executed_durations") is not None else None,
+        "total_ms": timings.get("total_ms"),
+        "stages_ms": list((timings.get("stages_ms") or {}).items()),
+        "server_total_ms": server.get("total_ms"),
+        "server_stages_ms": list((server.get("stages_ms") or {}).items()),
+        "server_generated_tokens": server.get("generated_tokens"),
+        "server_tokens_per_s": server.get("tokens_per_s"),
+    }
+
+
+class ColumnarRunWriter:
+    """
+    Buffers rows and writes a Parquet file per row group into a store directory.
+
+    append() is cheap; the buffer is written when it reaches row_group_size rows,
+    when flush_interval_s has passed since the last write, and on flush()/close().
+    Safe to call from several threads.
+    """
+
+    def __init__(self, store_dir, run_id=None, row_group_size=DEFAULT_ROW_GROUP_SIZE, flush_interval_s=None):
+        _require_pyarrow()
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id
+        self.row_group_size = row_group_size
+        self.flush_interval_s = flush_interval_s
+        self.last_write = time.monotonic()
+        self.schema = schema()
+        self.rows = []
+        self.lock = threading.Lock()
+        # Unique per writer so concurrent writers and restarts never clash
+        self.prefix = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.sequence = itertools.count()
+
+    def append(self, record: dict):
+        row = record_to_row(record, self.run_id)
+        with self.lock:
+            self.rows.append(row)
+            overdue = self.flush_interval_s is not None and time.monotonic() - self.last_write >= self.flush_interval_s
+            if len(self.rows) >= self.row_group_size or overdue:
+                self._write_locked()
+
+    def flush(self):
+        with self.lock:
+            self._write_locked()
+
+    def _write_locked(self):
+        self.last_write = time.monotonic()
+        if not self.rows:
+            return
+        table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        path = self.store_dir / f"{self.prefix}-{next(self.sequence):05d}.parquet"
+        # Write under a hidden temporary name so readers never see a half-written file
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def delete_runs(store_dir, run_ids) -> int:
+    """
+    Remove the rows of run_ids from a store (None matches rows without a run id),
+    rewriting the part files that hold any; returns the number of rows removed.
+    """
+    _require_pyarrow()
+    run_ids = set(run_ids)
+    value_set = pa.array(sorted(r for r in run_ids if r is not None), pa.string())
+    removed = 0
+    for part in sorted(Path(store_dir).glob("*.parquet")):
+        ids = pq.read_table(part, columns=["run_id"])["run_id"]
+        mask = pc.fill_null(pc.is_in(ids, value_set=value_set), False)
+        if None in run_ids:
+            mask = pc.or_(mask, pc.is_null(ids))
+        count = pc.sum(mask).as_py() or 0
+        if not count:
+            continue
+        removed += count
+        kept = pq.read_table(part).filter(pc.invert(mask))
+        if kept.num_rows:
+            tmp_path = part.with_name(f".{part.name}.tmp")
+            pq.write_table(kept, tmp_path, compression="zstd")
+            os.replace(tmp_path, part)
+        else:
+            part.unlink()
+    return removed
+
+
+def convert_jsonl(jsonl_path, store_dir, run_id=None, row_group_size=65_536) -> tuple:
+    """
+    Write every record of a metadata.jsonl to a store, replacing the rows the store
+    already holds for the same runs (converting twice, or a run the live writer
+    recorded, leaves one row per record). Returns (rows written, rows replaced).
+    """
+    records = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    replaced = delete_runs(store_dir, {run_id or record.get("run_id") for record in records}) if records else 0
+    writer = ColumnarRunWriter(store_dir, run_id=run_id, row_group_size=row_group_size)
+    for record in records:
+        writer.append(record)
+    writer.close()
+    return len(records), replaced
+
+
+def load_table(store_dir, columns=None, filter=None):
+    """Read a store (or selected columns of it) as one pyarrow Table."""
+    _require_pyarrow()
+    dataset = ds.dataset(str(store_dir), format="parquet", schema=schema())
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def compact(store_dir, row_group_size=65_536):
+    """Rewrite many small part files as one file with large row groups."""
+    parts = sorted(Path(store_dir).glob("*.parquet"))
+    table = ds.dataset([str(part) for part in parts], format="parquet", schema=schema()).to_table()
+    out = Path(store_dir) / f"compacted-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet"
+    tmp_path = out.with_name(f".{out.name}.tmp")
+    pq.write_table(table, tmp_path, compression="zstd", row_group_size=row_group_size)
+    os.replace(tmp_path, out)
+    for part in parts:
+        part.unlink()
+    return out
+
+
+def drift_filter(min_px):
+    """Dataset filter for rows whose action is more than min_px off the points."""
+    _require_pyarrow()
+    return pc.field("drift_px") > min_px
+
+
+def filter_drift(table, min_px):
+    return table.filter(pc.greater(table["drift_px"], min_px))
@@ -0,0 +1,37 @@
+import math
+
+
+def percentile(values, q: float) -> float | None:
+    """Return the q-th percentile (0-100) of values using linear interpolation.
+
+    Returns None for an empty sequence.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return float(ordered[0])
+    rank = (len(ordered) - 1) * (q / 100.0)
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return float(ordered[lower])
+    weight = rank - lower
+    return ordered[lower] * (1 - weight) + ordered[upper] * weight
+
+
+def summarize(values, percentiles=(50, 90, 99)) -> dict:
+    """Summarise a list of numbers as count, mean, percentiles and max.
+
+    Example:
+        summarize([10, 20, 30]) -> {"count": 3, "mean": 20.0, "p50": 20.0, ...}
+    """
+    values = list(values)
+    summary = {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+    }
+    for q in percentiles:
+        summary[f"p{q}"] = percentile(values, q)
+    summary["max"] = max(values) if values else None
+    return summary
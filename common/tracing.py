@@ -0,0 +1,150 @@
+"""Ring-buffer span recorder exportable to Chrome/Perfetto trace JSON.
+
+Usable from both the client and the service. When disabled, span() returns a shared
+no-op context manager so instrumented code costs one attribute check per stage.
+
+    tracer = recorder_from_env("fps-agent")     # enabled with VLA_TRACE=1
+    with tracer.span("capture", track="capture"):
+        ...
+    json.dump(tracer.export_chrome(), f)        # open in ui.perfetto.dev or chrome://tracing
+
+Timestamps are wall-clock microseconds (derived from perf_counter) so traces from the
+client and the service can be merged onto a single timeline with utils/merge_traces.py.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULT_CAPACITY = 100_000
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "cat", "track", "async_id", "args", "start")
+
+    def __init__(self, recorder, name, cat, track, async_id, args):
+        self.recorder = recorder
+        self.name = name
+        self.cat = cat
+        self.track = track
+        self.async_id = async_id
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.complete(
+            self.name, self.start, time.perf_counter(), self.cat, self.track, self.async_id, **self.args
+        )
+        return False
+
+
+class TraceRecorder:
+    """Records completed spans into a bounded deque; the oldest spans are dropped first.
+
+    - track: name of the timeline row; defaults to the calling thread
+    - async_id: records the span as a nestable async event keyed by id (e.g. a request
+      ID), so concurrent requests get their own rows without allocating a track each
+    """
+
+    def __init__(self, process_name: str, capacity: int = DEFAULT_CAPACITY, enabled: bool = False):
+        self.process_name = process_name
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)
+        self.pid = os.getpid()
+        self.tracks = {}
+        self._track_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # perf_counter() + offset = seconds since the epoch
+        self._epoch_offset = time.time() - time.perf_counter()
+
+    def span(self, name: str, cat: str = "stage", track: str | None = None, async_id=None, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, track, async_id, args)
+
+    def complete(self, name: str, start: float, end: float, cat: str = "stage",
+                 track: str | None = None, async_id=None, **args):
+        """Record a span measured with time.perf_counter() timestamps."""
+        if not self.enabled:
+            return
+        tid = self._track_id(track) if track is not None else threading.get_native_id()
+        self.events.append((name, cat, start, end, tid, async_id, args or None))
+
+    def instant(self, name: str, cat: str = "event", track: str | None = None, **args):
+        now = time.perf_counter()
+        self.complete(name, now, now, cat, track, **args)
+
+    def _track_id(self, track: str) -> int:
+        tid = self.tracks.get(track)
+        if tid is None:
+            with self._lock:
+                tid = self.tracks.setdefault(track, next(self._track_ids))
+        return tid
+
+    def clear(self):
+        self.events.clear()
+
+    def _us(self, t: float) -> float:
+        return round((t + self._epoch_offset) * 1e6, 3)
+
+    def export_chrome(self) -> dict:
+        """Return the recorded spans in Chrome trace event format."""
+        trace = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                  "args": {"name": self.process_name}}]
+        for track, tid in list(self.tracks.items()):
+            trace.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": track}})
+
+        for name, cat, start, end, tid, async_id, args in list(self.events):
+            if async_id is None:
+                event = {"name": name, "cat": cat, "ph": "X", "ts": self._us(start),
+                         "dur": round((end - start) * 1e6, 3), "pid": self.pid, "tid": tid}
+                if args:
+                    event["args"] = args
+                trace.append(event)
+            else:
+                begin = {"name": name, "cat": cat, "ph": "b", "id": str(async_id),
+                         "ts": self._us(start), "pid": self.pid, "tid": tid}
+                if args:
+                    begin["args"] = args
+                trace.append(begin)
+                trace.append({"name": name, "cat": cat, "ph": "e", "id": str(async_id),
+                              "ts": self._us(end), "pid": self.pid, "tid": tid})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def recorder_from_env(process_name: str) -> TraceRecorder:
+    """Create a recorder configured by VLA_TRACE=1 and VLA_TRACE_CAPACITY."""
+    return TraceRecorder(
+        process_name,
+        capacity=int(os.environ.get("VLA_TRACE_CAPACITY", DEFAULT_CAPACITY)),
+        enabled=os.environ.get("VLA_TRACE", "0") == "1",
+    )
+
+
+if __name__ == "__main__":
+    # Overhead of an instrumented stage with tracing disabled and enabled
+    for enabled in (False, True):
+        recorder = TraceRecorder("bench", enabled=enabled)
+        n = 200_000
+        start = time.perf_counter()
+        for _ in range(n):
+            with recorder.span("stage", track="bench"):
+                pass
+        print(f"enabled={enabled}: {(time.perf_counter() - start) / n * 1e9:.0f} ns per span")
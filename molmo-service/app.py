@@ -1,53 +1,119 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 import uvicorn
-import torch
-from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig
 from PIL import Image
-import io
 import json
-import re
-from peft import PeftModel
+import os
+import asyncio
+import threading
+import time
+import uuid
+import sys
+import logging
+from pathlib import Path
+from metrics import REGISTRY, RequestTimings, TOKEN_BUCKETS, RATE_BUCKETS
+from constrained import template_grammar
+from response_cache import ResponseCache, request_key
+from scheduler import Dropped, GenerationScheduler, until_dropped
+from preprocess import PrefetchSlot, Preprocessor
+from image_decode import decode_pair
 
-app = FastAPI()
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import parse, parse_commands
+from common.tracing import recorder_from_env
 
-# Load Molmo2-4B on startup
-print("Loading Molmo2-4B model...")
-
-nf4_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.float16,
-    llm_int8_skip_modules=[
-        # Module names can also be relative like "ff_norm" which would apply to all such layers
-        "model.vision_backbone", "model.transformer.ff_out", "model.transformer.ln_f"
-    ]
-)
+logger = logging.getLogger(__name__)
+
+app = FastAPI()
+tracer = recorder_from_env("molmo-service")
 
-model_id="allenai/Molmo2-4B"
+# MOLMO_BACKEND=stub serves canned, templated answers without loading any weights,
+# for CPU-only benchmarking and testing of everything around the model
+BACKEND = os.environ.get("MOLMO_BACKEND", "molmo")
+if BACKEND == "stub":
+    import stub_backend as backend
+else:
+    import molmo_backend as backend
+DEFAULT_ADAPTER = backend.DEFAULT_ADAPTER
+ADAPTERS = backend.ADAPTERS
+# MOLMO_CONSTRAINED=1 constrains decoding to the output template unless a request
+# sets constrained=false (see constrained.py)
+CONSTRAINED_DEFAULT = os.environ.get("MOLMO_CONSTRAINED", "0") == "1"
+# MOLMO_SPECULATIVE=1 drafts tokens from the prompt and recent answers unless a
+# request sets speculative=false (see speculative.py)
+SPECULATIVE_DEFAULT = os.environ.get("MOLMO_SPECULATIVE", "0") == "1"
 
-# load the processor
-processor = AutoProcessor.from_pretrained(
-    model_id,
-    trust_remote_code=True,
-    dtype=torch.float16,
-    device_map="auto",
-    token=True
+# Identical requests share one generate and completed responses are replayed
+# (MOLMO_CACHE_SIZE, MOLMO_CACHE_TTL_S; see response_cache.py)
+response_cache = ResponseCache(
+    int(os.environ.get("MOLMO_CACHE_SIZE", "256")), float(os.environ.get("MOLMO_CACHE_TTL_S", "300"))
 )
 
-# load the model
-model = AutoModelForImageTextToText.from_pretrained(
-    model_id,
-    trust_remote_code=True,
-    dtype=torch.float16,
-    device_map="auto",
-    quantization_config=nf4_config,
-    token=True
+# Only one generate runs on the accelerator at a time; requests waiting for it
+# are counted so clients and the orchestrator can apply backpressure. Queued
+# requests past their deadline, or superseded by a newer frame of the same
+# session, are dropped before they reach the model (see scheduler.py).
+# MOLMO_DEADLINE_MS applies to requests that do not send deadline_ms.
+DEFAULT_DEADLINE_MS = float(os.environ.get("MOLMO_DEADLINE_MS", "0")) or None
+queue_depth = 0
+# Requests being analyzed, by request_id, so /cancel can stop them. A client that
+# disconnects is noticed within DISCONNECT_POLL_S; either way a running generate
+# stops at the next token.
+active_requests = {}
+DISCONNECT_POLL_S = 0.1
+# Image decode and chat template run in a pool, up to MOLMO_PREFETCH requests
+# ahead of the model (see preprocess.py)
+preprocessor = Preprocessor(
+    int(os.environ.get("MOLMO_PREPROCESS_WORKERS", "2")), int(os.environ.get("MOLMO_PREFETCH", "2"))
 )
 
-model = PeftModel.from_pretrained(model, "checkpoint-3000")
+# Metrics exposed on /metrics
+REQUESTS = REGISTRY.counter("molmo_requests_total", "Analyze requests by final status", ["status"])
+STAGE_SECONDS = REGISTRY.histogram("molmo_stage_seconds", "Time spent in each request stage", ["stage"])
+PROMPT_TOKENS = REGISTRY.histogram("molmo_prompt_tokens", "Prompt tokens per request, including vision tokens", buckets=TOKEN_BUCKETS)
+VISION_TOKENS = REGISTRY.histogram("molmo_vision_tokens", "Image patch tokens per request", buckets=TOKEN_BUCKETS)
+GENERATED_TOKENS = REGISTRY.histogram("molmo_generated_tokens", "Generated tokens per request", buckets=TOKEN_BUCKETS)
+TOKENS_PER_SECOND = REGISTRY.histogram("molmo_decode_tokens_per_second", "Decode throughput per request", buckets=RATE_BUCKETS)
+QUEUE_DEPTH = REGISTRY.gauge("molmo_queue_depth", "Requests being prepared for, waiting for or running generate")
+PEAK_MEMORY = REGISTRY.gauge("molmo_peak_memory_bytes", "Peak memory of the last request (accelerator, or process RSS on CPU)", ["device"])
+OUTPUTS = REGISTRY.counter("molmo_outputs_total", "Model outputs by decoding mode and whether they follow the template", ["constrained", "well_formed"])
+DRAFT_ACCEPTANCE = REGISTRY.histogram("molmo_draft_acceptance_ratio", "Share of drafted tokens accepted per speculative request", buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+CACHE_REQUESTS = REGISTRY.counter("molmo_response_cache_total", "Analyze requests by response cache outcome", ["result"])
+CACHE_ENTRIES = REGISTRY.gauge("molmo_response_cache_entries", "Completed responses held in the response cache")
+DROPPED = REGISTRY.counter("molmo_scheduler_dropped_total", "Queued requests dropped before generate", ["reason"])
+QUEUE_AGE = REGISTRY.histogram("molmo_queue_age_seconds", "Time queued for the model, by what happened next", ["outcome"])
+ACCELERATOR_BUSY = REGISTRY.counter("molmo_accelerator_busy_seconds_total", "Time the accelerator spent in generate (rate() gives utilisation)")
+MEMORY_STATS = REGISTRY.gauge("molmo_memory_stat", "Input buffer pool and CUDA allocator counters of the backend", ["stat"])
+CANCELLED = REGISTRY.counter("molmo_cancelled_total", "Requests cancelled by their client, by what they were doing", ["stage"])
+INSTRUMENTATION_SECONDS = REGISTRY.counter("molmo_instrumentation_seconds_total", "Time spent recording these metrics")
 
-print("Model loaded successfully!")
+def _on_drop(reason: str, queued_s: float):
+    DROPPED.inc(reason=reason)
+    QUEUE_AGE.observe(queued_s, outcome=reason)
+
+scheduler = GenerationScheduler(
+    on_drop=_on_drop, on_start=lambda queued_s: QUEUE_AGE.observe(queued_s, outcome="started")
+)
+
+def record_request_metrics(timings: RequestTimings):
+    """Record a finished request's timings into the histograms."""
+    start = time.perf_counter()
+    for stage, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    values = timings.values
+    if "prompt_tokens" in values:
+        PROMPT_TOKENS.observe(values["prompt_tokens"])
+    if values.get("vision_tokens") is not None:
+        VISION_TOKENS.observe(values["vision_tokens"])
+    if "generated_tokens" in values:
+        GENERATED_TOKENS.observe(values["generated_tokens"])
+    if values.get("tokens_per_s"):
+        TOKENS_PER_SECOND.observe(values["tokens_per_s"])
+    if values.get("acceptance_rate") is not None:
+        DRAFT_ACCEPTANCE.observe(values["acceptance_rate"])
+    if "peak_memory_bytes" in values:
+        PEAK_MEMORY.set(values["peak_memory_bytes"], device=values["device"])
+    INSTRUMENTATION_SECONDS.inc(time.perf_counter() - start)
 
 def parse_molmo_output(text: str) -> dict:
     """Parse Molmo output to extract movement commands from new format.
@@ -56,128 +122,351 @@ def parse_molmo_output(text: str) -> dict:
     The closest person in the image is at <points coords="...">closest person</points> 
     while the centre of the image is at <points coords="...">centre of image</points>. 
     The action to be taken is therefore (dx, dy)
+
+    A positive dx moves left and a positive dy moves up (see common/molmo_parsing.py).
+    Only the action and exit are needed here, so the full parse is skipped.
     """
-    commands = {
-        "up": 0,      # up arrow (negative dy)
-        "down": 0,    # down arrow (positive dy)
-        "left": 0,    # left arrow (negative dx)
-        "right": 0,   # right arrow (positive dx)
-        "exit": 0,
-        "raw_output": text
-    }
-    
-    text_lower = text.lower()
-    
-    # Check for exit condition
-    if "exit" in text_lower and text_lower.strip() == "exit":
-        commands["exit"] = 1
-        return commands
-    
-    # Extract action vector (dx, dy) from format: (value, value)
-    action_pattern = r'\((-?\d+)\s*,\s*(-?\d+)\)'
-    action_match = re.search(action_pattern, text)
-    
-    if action_match:
-        dx = int(action_match.group(1))
-        dy = int(action_match.group(2))
-        
-        print(f"Extracted action vector: dx={dx}, dy={dy}")
-        
-        # Convert action vector to keyboard commands
-        # Remember: left/up is positive, right/down is negative
-        # dx: positive = move left, negative = move right
-        # dy: positive = move up, negative = move down
-        
-        # Horizontal movement (dx)
-        if dx > 0:
-            commands["left"] = abs(dx)
-        elif dx < 0:
-            commands["right"] = abs(dx)
-        
-        # Vertical movement (dy)
-        if dy > 0:
-            commands["up"] = abs(dy)
-        elif dy < 0:
-            commands["down"] = abs(dy)
-    
+    commands = parse_commands(text)
+    logger.debug("Extracted commands: %s", commands)
+    commands["raw_output"] = text
     return commands
 
-async def stream_molmo_response(image_bytes: bytes, prompt: str, previous_bytes: bytes = None):
-    """Stream Molmo2-4B response."""
+def build_messages(prompt: str, image: Image.Image, previous_image: Image.Image = None) -> list:
+    """Chat messages for one frame, optionally preceded by the previous frame."""
+    content = [{"type": "text", "text": prompt}]
+    if previous_image is not None:
+        content.append({"type": "image", "image": previous_image})
+    content.append({"type": "image", "image": image})
+    return [{"role": "user", "content": content}]
+
+def run_generation(inputs: dict, adapter: str, timings: RequestTimings, grammar: tuple = None,
+                   speculative: bool = False, cancel: threading.Event = None) -> str:
+    """Run the backend's generate on the accelerator track (called in a worker thread)."""
+    start = time.perf_counter()
     try:
-        # Load image
-        if previous_bytes:
-            previous_image = Image.open(io.BytesIO(previous_bytes)).convert("RGB")
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # Prepare messages
-        if previous_bytes:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image", "image": previous_image},
-                        {"type": "image", "image": image}
-                    ]
-                }
-            ]
+        with tracer.span("generate", cat="accelerator", track="accelerator", request_id=timings.trace_id):
+            return backend.generate_text(inputs, adapter, timings, grammar, speculative, cancel)
+    finally:
+        ACCELERATOR_BUSY.inc(time.perf_counter() - start)
+
+def prepare_request(image_bytes: bytes, previous_bytes: bytes, prompt: str, timings: RequestTimings) -> dict:
+    """Decode the images and apply the chat template (runs in the preprocessing pool)."""
+    # Load images (both frames at once, at most at the size the processor uses)
+    with timings.stage("image_decode"):
+        image, previous_image, timings.values["image_decoder"] = decode_pair(image_bytes, previous_bytes, backend.DECODE_SIZE)
+
+    # Prepare messages
+    messages = build_messages(prompt, image, previous_image)
+
+    # Apply chat template (image cropping, normalisation and tokenization)
+    with timings.stage("chat_template"):
+        return backend.prepare_inputs(messages)
+
+async def generate_response(
+    image_bytes: bytes,
+    prompt: str,
+    previous_bytes: bytes,
+    adapter: str,
+    constrained: bool,
+    speculative: bool,
+    timings: RequestTimings,
+    session_id: str = None,
+    deadline: float = None
+) -> str:
+    """Preprocess ahead of the model, then generate (one request's model work).
+
+    The request joins the scheduler's queue before preprocessing. deadline is a
+    time.monotonic() value; raises scheduler.Dropped when the request expires before
+    it reaches the model, or is superseded by a newer frame of its session (see
+    scheduler.py). If cancelled while generating, the generate is stopped at the
+    next token and the model is released once it has.
+    """
+    global queue_depth
+    stage = "preprocessing"
+    ticket = scheduler.enqueue(session_id, deadline, ready=False)
+    queue_depth += 1
+    QUEUE_DEPTH.set(queue_depth)
+    prefetch = inputs = generation = None
+    try:
+        try:
+            wait_start = time.perf_counter()
+            prefetch = await until_dropped(ticket, preprocessor.acquire(), discard=PrefetchSlot.release)
+            timings.record("prefetch_wait", wait_start, time.perf_counter())
+            scheduler.mark_preparing(ticket)
+            inputs = await until_dropped(
+                ticket, preprocessor.run(prepare_request, image_bytes, previous_bytes, prompt, timings),
+                discard=backend.discard_inputs, cancel=False
+            )
+            wait_start = time.perf_counter()
+            stage = "queued"
+            scheduler.mark_ready(ticket)
+            await scheduler.wait(ticket)
+        except BaseException:
+            scheduler.abandon(ticket)
+            raise
+        try:
+            prefetch.release()
+            timings.record("queue_wait", wait_start, time.perf_counter())
+            stage = "generating"
+            # Generate in a worker thread so the event loop keeps accepting requests
+            cancel = threading.Event()
+            generation = asyncio.ensure_future(asyncio.to_thread(
+                run_generation, inputs, adapter, timings, template_grammar(prompt) if constrained else None,
+                speculative, cancel
+            ))
+            try:
+                generated_text = await asyncio.shield(generation)
+            except asyncio.CancelledError:
+                # The thread cannot be interrupted: stop it at the next token, and keep
+                # the slot until it has stopped so the next request gets the whole model
+                cancel.set()
+                await asyncio.gather(generation, return_exceptions=True)
+                raise
+        finally:
+            scheduler.release()
+    except asyncio.CancelledError:
+        CANCELLED.inc(stage=stage)
+        raise
+    finally:
+        queue_depth -= 1
+        QUEUE_DEPTH.set(queue_depth)
+        if prefetch is not None:
+            prefetch.release()
+        if inputs is not None and generation is None:
+            # Dropped or cancelled after preprocessing: generate_text would have released them
+            backend.discard_inputs(inputs)
+    OUTPUTS.inc(constrained=str(constrained).lower(), well_formed=str(parse(generated_text).well_formed).lower())
+    return generated_text
+
+async def run_cached(key: str, compute) -> tuple:
+    """
+    response_cache.run(key, compute), except that a request which joined a computation
+    dropped by the scheduler runs compute itself: the drop came from the first
+    request's session or deadline, which are not part of the key.
+    """
+    joined = response_cache.in_flight(key)
+    try:
+        return await response_cache.run(key, compute)
+    except Dropped:
+        if not joined:
+            raise
+    return await compute(), False
+
+class Cancelled(Exception):
+    """The request was cancelled by /cancel or its client went away."""
+
+async def wait_for_job(job: asyncio.Future, request_id: str, request: Request = None):
+    """
+    Await a request's work, registered under request_id for /cancel and cancelled
+    when the client disconnects. Raises Cancelled in either case.
+    """
+    active_requests[request_id] = job
+    watcher = asyncio.create_task(watch_disconnect(request, job)) if request is not None else None
+    try:
+        # Shielded: the server may cancel the stream repeatedly while it is torn
+        # down, but the work is cancelled once and left to wind down
+        return await asyncio.shield(job)
+    except asyncio.CancelledError:
+        if job.cancelled():
+            raise Cancelled()
+        job.cancel()  # the stream itself is being torn down
+        raise
+    finally:
+        if active_requests.get(request_id) is job:
+            del active_requests[request_id]
+        if watcher is not None:
+            watcher.cancel()
+
+async def watch_disconnect(request: Request, job: asyncio.Future):
+    while not job.done():
+        if await request.is_disconnected():
+            job.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+async def stream_molmo_response(
+    image_bytes: bytes,
+    prompt: str,
+    previous_bytes: bytes = None,
+    adapter: str = None,
+    include_timings: bool = False,
+    request_id: str = None,
+    constrained: bool = None,
+    speculative: bool = None,
+    use_cache: bool = True,
+    session_id: str = None,
+    deadline_ms: float = None,
+    request: Request = None
+):
+    """Stream Molmo2-4B response.
+
+    With include_timings, a final {"status": "timings"} event reports per-stage
+    durations, token counts and peak memory before "complete". The request_id is
+    echoed in the processing and timings events so clients can correlate them.
+    With constrained (default: MOLMO_CONSTRAINED), decoding follows the output template;
+    with speculative (default: MOLMO_SPECULATIVE), drafted tokens are verified in one pass.
+    Unless use_cache is False, a cached response is replayed and a request identical
+    to one being generated waits for its result (the timings' "cache" value says which).
+    With a session_id, a newer request of the same session replaces this one while it
+    is queued; with deadline_ms (default: MOLMO_DEADLINE_MS), it is dropped if it has
+    not reached the model that many milliseconds after arriving. Both end the stream
+    with an error event carrying the reason, as does a /cancel of request_id. When
+    request's client disconnects, its work is cancelled too.
+    """
+    adapter = adapter or DEFAULT_ADAPTER
+    constrained = CONSTRAINED_DEFAULT if constrained is None else constrained
+    speculative = SPECULATIVE_DEFAULT if speculative is None else speculative
+    timings = RequestTimings(tracer, request_id)
+    deadline_ms = deadline_ms or DEFAULT_DEADLINE_MS
+    deadline = None
+    if deadline_ms:
+        deadline = time.monotonic() + deadline_ms / 1000.0
+    try:
+        if adapter not in ADAPTERS:
+            raise ValueError(f"Unknown adapter '{adapter}', available: {sorted(ADAPTERS)}")
+
+        key = events = job = None
+        if use_cache:
+            with timings.stage("cache_lookup"):
+                key = request_key(image_bytes, prompt, adapter, constrained, previous_bytes)
+                events = response_cache.get(key)
+
+        # Yield progress update
+        yield json.dumps({"status": "processing", "message": f"Analyzing screenshot with {backend.MODEL_NAME}...", "request_id": request_id}) + "\n"
+
+        if events is not None:
+            timings.values["cache"] = "hit"
         else:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image", "image": image}
-                    ]
-                }
+            compute = lambda: generate_response(
+                image_bytes, prompt, previous_bytes, adapter, constrained, speculative, timings, session_id, deadline
+            )
+            wait_start = time.perf_counter()
+            if key is None:
+                timings.values["cache"] = "bypass"
+                job = asyncio.ensure_future(compute())
+            else:
+                job = asyncio.ensure_future(run_cached(key, compute))
+            generated_text = await wait_for_job(job, request_id, request)
+            if key is not None:
+                generated_text, coalesced = generated_text
+                timings.values["cache"] = "coalesced" if coalesced else "miss"
+                if coalesced:
+                    timings.record("coalesce_wait", wait_start, time.perf_counter())
+
+            # Parse into commands
+            with timings.stage("parse"):
+                commands = parse_molmo_output(generated_text)
+            events = [
+                json.dumps({"status": "model_output", "text": generated_text}) + "\n",
+                json.dumps({"status": "commands", "data": commands}) + "\n",
             ]
-        
-        # Yield progress update
-        yield json.dumps({"status": "processing", "message": "Analyzing screenshot with Molmo2-4B..."}) + "\n"
-        
-        # Apply chat template
-        inputs = processor.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-            return_dict=True
-        )
-        
-        inputs = {k: v.to(model.device) for k, v in inputs.items()}
-        # Generate with streaming (token-by-token)
-        with torch.inference_mode():
-            generated_ids = model.generate(**inputs, max_new_tokens=256)
-        
-        # Only get generated tokens
-        generated_tokens = generated_ids[0, inputs['input_ids'].size(1):]
-        generated_text = processor.tokenizer.decode(generated_tokens, skip_special_tokens=True)
-        
-        # Yield model output
-        yield json.dumps({"status": "model_output", "text": generated_text}) + "\n"
-        
-        # Parse into commands
-        commands = parse_molmo_output(generated_text)
-        yield json.dumps({"status": "commands", "data": commands}) + "\n"
+            if key is not None and timings.values["cache"] == "miss":
+                response_cache.put(key, events)
+                CACHE_ENTRIES.set(len(response_cache))
+        CACHE_REQUESTS.inc(result=timings.values["cache"])
+
+        # Yield model output, then the commands parsed from it
+        for event in events:
+            yield event
+
+        record_request_metrics(timings)
+        REQUESTS.inc(status="complete")
+        tracer.complete("analyze", timings.start, time.perf_counter(), "request", async_id=request_id)
+        if include_timings:
+            yield json.dumps({"status": "timings", "request_id": request_id, "data": timings.as_dict()}) + "\n"
         
         yield json.dumps({"status": "complete"}) + "\n"
         
+    except asyncio.CancelledError:
+        # The server tore the stream down because the client went away; the work
+        # winds down in its own task, so record its stages once that has finished
+        if job is not None and not job.done():
+            job.add_done_callback(lambda _: record_request_metrics(timings))
+        else:
+            record_request_metrics(timings)
+        REQUESTS.inc(status="cancelled")
+        raise
+    except Cancelled:
+        # Stages already run (e.g. a partial decode) still count as time spent
+        record_request_metrics(timings)
+        REQUESTS.inc(status="cancelled")
+        yield json.dumps({"status": "error", "message": "Request cancelled", "reason": "cancelled", "request_id": request_id}) + "\n"
+    except Dropped as e:
+        REQUESTS.inc(status=e.reason)
+        yield json.dumps({"status": "error", "message": str(e), "reason": e.reason, "request_id": request_id}) + "\n"
     except Exception as e:
+        REQUESTS.inc(status="error")
         yield json.dumps({"status": "error", "message": str(e)}) + "\n"
 
 @app.post("/analyze")
-async def analyze_screenshot(file: UploadFile = File(...), prompt: str = Form("Center the crosshair on the target")):
-    """Analyze screenshot and return streaming Molmo response."""
+async def analyze_screenshot(
+    request: Request,
+    file: UploadFile = File(...),
+    prompt: str = Form("Center the crosshair on the target"),
+    adapter: str = Form(None),
+    include_timings: bool = Form(False),
+    request_id: str = Form(None),
+    constrained: bool = Form(None),
+    speculative: bool = Form(None),
+    cache: bool = Form(True),
+    session_id: str = Form(None),
+    deadline_ms: float = Form(None)
+):
+    """Analyze screenshot and return streaming Molmo response (cache=false skips the response cache)."""
     image_bytes = await file.read()
+    request_id = request_id or uuid.uuid4().hex
     return StreamingResponse(
-        stream_molmo_response(image_bytes, prompt),
-        media_type="application/x-ndjson"
+        stream_molmo_response(
+            image_bytes, prompt, adapter=adapter, include_timings=include_timings, request_id=request_id,
+            constrained=constrained, speculative=speculative, use_cache=cache,
+            session_id=session_id, deadline_ms=deadline_ms, request=request
+        ),
+        media_type="application/x-ndjson",
+        headers={"X-Request-ID": request_id}
     )
 
+@app.post("/cancel")
+async def cancel(request_id: str = Form(...)):
+    """Cancel an in-flight analyze request: it leaves the queue, or its generate stops at the next token."""
+    job = active_requests.get(request_id)
+    if job is None:
+        return {"status": "not_found", "request_id": request_id}
+    job.cancel()
+    return {"status": "cancelled", "request_id": request_id}
+
+@app.get("/trace")
+async def trace(clear: bool = False):
+    """Dump recorded spans as Chrome/Perfetto trace JSON (enable with VLA_TRACE=1 or /trace/enable)."""
+    trace_json = tracer.export_chrome()
+    if clear:
+        tracer.clear()
+    return JSONResponse(trace_json)
+
+@app.post("/trace/enable")
+async def trace_enable(enabled: bool = True):
+    tracer.enabled = enabled
+    return {"status": "ok", "tracing": tracer.enabled, "spans": len(tracer.events)}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the service metrics."""
+    for stat, value in backend.memory_stats().items():
+        MEMORY_STATS.set(value, stat=stat)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model": "Molmo2-4B"}
+    return {
+        "status": "ok",
+        "model": backend.MODEL_NAME,
+        "inference_mode": backend.INFERENCE_MODE,
+        "adapters": sorted(ADAPTERS),
+        "queue_depth": queue_depth,
+        "cached_responses": len(response_cache),
+        "queued": len(scheduler),
+        "oldest_queued_s": round(scheduler.oldest_age_s(), 3),
+        "dropped": scheduler.dropped
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
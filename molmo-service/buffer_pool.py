@@ -0,0 +1,259 @@
+"""Reusable pinned host and device buffers for the host-to-device copy.
+
+A request's inputs (several MB of pixel values for two screenshots, plus token ids
+and image masks) used to be new tensors copied to the device synchronously. Their
+shapes barely change between requests, so BufferPool keeps released buffers
+keyed by (shape, dtype) and hands them out again:
+
+- pin() copies host inputs into pooled pinned buffers (in the preprocessing pool);
+- to_device() copies them into pooled device buffers on a separate copy stream
+  with non_blocking and returns a Lease at once, so the host can do other work
+  while the copy runs; lease.wait() orders the compute stream after the copy;
+- lease.release() gives both sets of buffers back once generate is done;
+- discard() gives back the pinned buffers of inputs that never reach the device
+  (a request dropped or cancelled after preprocessing).
+
+Each side keeps at most max_cached_bytes of free buffers, evicting the least
+recently used shapes. stats() reports hits, misses, evictions and bytes cached
+and in use, plus the CUDA caching allocator's counters. For a CPU device, or when
+CUDA is unavailable, the pool passes through: pin() returns its inputs and
+to_device() moves them with .to(), which is a no-op for CPU tensors.
+
+    python molmo-service/buffer_pool.py   # self-check, and a copy benchmark on CUDA
+"""
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _nbytes(tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+class _Buffers:
+    """Free buffers of one kind (pinned host or device), keyed by shape and dtype."""
+
+    def __init__(self, allocate, max_cached_bytes: int):
+        self.allocate = allocate
+        self.max_cached_bytes = max_cached_bytes
+        self.free = OrderedDict()  # (shape, dtype) -> [tensor], least recently used first
+        self.cached_bytes = 0
+        self.in_use_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def take(self, shape: tuple, dtype):
+        free = self.free.get((shape, dtype))
+        if free:
+            buffer = free.pop()
+            if not free:
+                del self.free[(shape, dtype)]
+            self.cached_bytes -= _nbytes(buffer)
+            self.hits += 1
+        else:
+            buffer = self.allocate(shape, dtype)
+            self.misses += 1
+        self.in_use_bytes += _nbytes(buffer)
+        return buffer
+
+    def give(self, buffer):
+        size = _nbytes(buffer)
+        self.in_use_bytes -= size
+        key = (tuple(buffer.shape), buffer.dtype)
+        self.free.setdefault(key, []).append(buffer)
+        self.free.move_to_end(key)
+        self.cached_bytes += size
+        while self.cached_bytes > self.max_cached_bytes:
+            oldest, buffers = next(iter(self.free.items()))
+            evicted = buffers.pop(0)
+            if not buffers:
+                del self.free[oldest]
+            self.cached_bytes -= _nbytes(evicted)
+            self.evictions += 1
+
+    def stats(self, prefix: str) -> dict:
+        return {
+            f"{prefix}_hits": self.hits,
+            f"{prefix}_misses": self.misses,
+            f"{prefix}_evictions": self.evictions,
+            f"{prefix}_cached_bytes": self.cached_bytes,
+            f"{prefix}_in_use_bytes": self.in_use_bytes,
+        }
+
+
+class Pinned(dict):
+    """Inputs whose tensors sit in pooled pinned buffers (returned by Lease.release or BufferPool.discard)."""
+
+    def __init__(self, inputs: dict, pooled: list):
+        super().__init__(inputs)
+        self.pooled = pooled
+
+    def take(self) -> list:
+        """The pooled buffers, handed over once (to a lease, or back to the pool)."""
+        pooled, self.pooled = self.pooled, []
+        return pooled
+
+
+class Lease:
+    """Inputs on the device, holding their pooled buffers until released."""
+
+    def __init__(self, pool, inputs: dict, host: list, device: list, event=None):
+        self.pool = pool
+        self.inputs = inputs
+        self.host = host
+        self.device = device
+        self.event = event
+        self.released = False
+
+    def wait(self):
+        """Order the current stream after the copy (the host does not block)."""
+        if self.event is not None:
+            torch.cuda.current_stream(self.pool.device).wait_event(self.event)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        if self.event is not None:
+            # The pinned buffers may be refilled as soon as they are back in the pool
+            self.event.synchronize()
+        self.pool._give(self.host, self.device)
+
+
+class BufferPool:
+    def __init__(self, device, max_cached_bytes: int = 256 * 2**20):
+        self.device = torch.device(device)
+        self.enabled = self.device.type == "cuda" and torch.cuda.is_available()
+        self.lock = threading.Lock()  # pin() runs in the preprocessing threads
+        self.host = _Buffers(lambda shape, dtype: torch.empty(shape, dtype=dtype, pin_memory=True), max_cached_bytes)
+        self.device_buffers = _Buffers(lambda shape, dtype: torch.empty(shape, dtype=dtype, device=self.device), max_cached_bytes)
+        self.copy_stream = torch.cuda.Stream(self.device) if self.enabled else None
+
+    def pin(self, inputs: dict) -> dict:
+        """Copy host tensors into pooled pinned buffers (pass-through without CUDA)."""
+        if not self.enabled:
+            return inputs
+        tensors = {k: v for k, v in inputs.items() if isinstance(v, torch.Tensor) and v.device.type == "cpu"}
+        with self.lock:
+            buffers = {k: self.host.take(tuple(v.shape), v.dtype) for k, v in tensors.items()}
+        for k, buffer in buffers.items():
+            buffer.copy_(tensors[k])
+        return Pinned({**inputs, **buffers}, list(buffers.values()))
+
+    def to_device(self, inputs: dict) -> Lease:
+        """Start copying inputs into pooled device buffers; call wait() on the lease before using them."""
+        if not self.enabled:
+            return Lease(self, {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}, [], [])
+        tensors = {k: v for k, v in inputs.items() if isinstance(v, torch.Tensor)}
+        with self.lock:
+            buffers = {k: self.device_buffers.take(tuple(v.shape), v.dtype) for k, v in tensors.items()}
+        # Released device buffers may still be read by work queued on the compute stream
+        self.copy_stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.copy_stream):
+            for k, buffer in buffers.items():
+                buffer.copy_(tensors[k], non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(self.copy_stream)
+        host = inputs.take() if isinstance(inputs, Pinned) else []
+        return Lease(self, {**inputs, **buffers}, host, list(buffers.values()), event)
+
+    def discard(self, inputs: dict):
+        """Give back the pinned buffers of inputs that will not be copied to the device."""
+        if isinstance(inputs, Pinned):
+            self._give(inputs.take(), [])
+
+    def _give(self, host: list, device: list):
+        with self.lock:
+            for buffer in host:
+                self.host.give(buffer)
+            for buffer in device:
+                self.device_buffers.give(buffer)
+
+    def stats(self) -> dict:
+        """Pool counters and, on CUDA, the caching allocator's; all numeric."""
+        with self.lock:
+            stats = {**self.host.stats("host"), **self.device_buffers.stats("device")}
+        if self.enabled:
+            allocator = torch.cuda.memory_stats(self.device)
+            stats.update({
+                "allocator_allocated_bytes": allocator.get("allocated_bytes.all.current", 0),
+                "allocator_reserved_bytes": allocator.get("reserved_bytes.all.current", 0),
+                "allocator_allocations": allocator.get("allocation.all.allocated", 0),
+                "allocator_alloc_retries": allocator.get("num_alloc_retries", 0),
+                "allocator_ooms": allocator.get("num_ooms", 0),
+            })
+        return stats
+
+
+if __name__ == "__main__":
+    # Pass-through on CPU, reuse and eviction with a fake allocator, then on CUDA
+    # the per-request copy time of fresh synchronous copies against the pool
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Buffer pool self-check and host-to-device copy benchmark.")
+    parser.add_argument("--size", default="1920x1080", help="Frame size of the benchmark's pixel values")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    cpu = BufferPool("cpu")
+    inputs = {"input_ids": torch.ones(1, 700, dtype=torch.long), "pixel_values": torch.rand(2, 3, 378, 378), "image_sizes": [(1920, 1080)]}
+    assert cpu.pin(inputs) is inputs
+    lease = cpu.to_device(inputs)
+    assert torch.equal(lease.inputs["pixel_values"], inputs["pixel_values"]) and lease.inputs["image_sizes"] == [(1920, 1080)]
+    lease.release()
+    lease.release()
+    cpu.discard(inputs)
+
+    buffers = _Buffers(lambda shape, dtype: torch.empty(shape, dtype=dtype), max_cached_bytes=2 * 4 * 1000)
+    first = buffers.take((1000,), torch.float32)
+    buffers.give(first)
+    assert buffers.take((1000,), torch.float32) is first and (buffers.hits, buffers.misses) == (1, 1)
+    others = [buffers.take((1000,), torch.float32) for _ in range(2)] + [buffers.take((10,), torch.float32)]
+    for buffer in [first] + others:
+        buffers.give(buffer)
+    assert buffers.cached_bytes <= buffers.max_cached_bytes and buffers.evictions == 2 and buffers.in_use_bytes == 0
+    # Inputs dropped before their copy give their pinned buffers back, once
+    pool = BufferPool("cpu")
+    pool.host = _Buffers(lambda shape, dtype: torch.empty(shape, dtype=dtype), max_cached_bytes=2**20)
+    pinned = Pinned(inputs, [pool.host.take((1000,), torch.float32)])
+    pool.discard(pinned)
+    pool.discard(pinned)
+    assert pool.host.in_use_bytes == 0 and pool.host.cached_bytes == 4000
+    print("CPU pass-through and pool accounting: ok")
+
+    if not torch.cuda.is_available():
+        print("CUDA unavailable: skipping the copy benchmark")
+    else:
+        width, height = (int(v) for v in args.size.split("x"))
+        device = torch.device("cuda")
+        # Roughly the processor's output for two frames: crops of 378x378 plus token ids
+        crops = 2 * (1 + (width // 378 + 1) * (height // 378 + 1))
+        host = {"input_ids": torch.ones(1, 2000, dtype=torch.long), "pixel_values": torch.rand(crops, 3, 378, 378, dtype=torch.float16)}
+        busy = torch.rand(2048, 2048, device=device, dtype=torch.float16)
+
+        def fresh():
+            {k: v.to(device) for k, v in host.items()}
+            torch.cuda.synchronize()
+            (busy @ busy).sum()
+            torch.cuda.synchronize()
+
+        pool = BufferPool(device)
+
+        def pooled():
+            lease = pool.to_device(pool.pin(host))
+            # Host-side work while the copy runs, as when building the logits processors
+            (busy @ busy).sum()
+            lease.wait()
+            torch.cuda.synchronize()
+            lease.release()
+
+        print(f"{crops} crops, {sum(_nbytes(v) for v in host.values()) / 2**20:.1f} MB per request")
+        for label, step in (("fresh + sync", fresh), ("pooled", pooled)):
+            step()
+            torch.cuda.synchronize()
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                step()
+            print(f"{label:<14}{(time.perf_counter() - start) * 1000.0 / args.requests:8.2f} ms/request")
+        print({k: v for k, v in pool.stats().items() if v})
@@ -0,0 +1,181 @@
+"""Static KV cache and compiled decode step for generate().
+
+Prompts barely change shape between requests (one or two screenshots at the
+client's resolution plus a fixed prompt), so a cache allocated once at the size
+of that workload can be reused for every request, and the one-token decode step
+can be compiled against it:
+
+    eager     generate() as is: the cache grows every step, eager kernels
+    static    one preallocated StaticCache, reset between requests
+    compiled  static, plus torch.compile of the model's forward for decode steps
+              (prefill, whose length varies, stays eager)
+
+StaticDecoder.fits() decides per call; batches, prompts longer than the cache and
+assisted decoding fall back to eager. warm_up() runs at startup so compilation
+happens before the first request. Benchmark on a small CPU model:
+
+    python molmo-service/compiled.py --model HuggingFaceTB/SmolLM2-135M
+"""
+import inspect
+import logging
+import time
+
+import torch
+from transformers import StaticCache
+
+logger = logging.getLogger(__name__)
+
+MODES = ("eager", "static", "compiled")
+CACHE_ROUNDING = 256  # cache lengths are rounded up to this many tokens
+
+
+def cache_length(prompt_tokens: int, max_new_tokens: int, margin: float = 1.1) -> int:
+    """Cache length for prompts of about this size, with some margin, rounded up."""
+    needed = int(prompt_tokens * margin) + max_new_tokens
+    return -(-needed // CACHE_ROUNDING) * CACHE_ROUNDING
+
+
+def make_static_cache(model, max_cache_len: int):
+    """A batch-1 StaticCache for model (the constructor's arguments differ between transformers versions)."""
+    config = model.config.get_text_config() if hasattr(model.config, "get_text_config") else model.config
+    available = {
+        "config": config, "max_batch_size": 1, "batch_size": 1, "max_cache_len": max_cache_len,
+        "device": model.device, "dtype": model.dtype,
+    }
+    accepted = inspect.signature(StaticCache.__init__).parameters
+    return StaticCache(**{k: v for k, v in available.items() if k in accepted})
+
+
+class StaticDecoder:
+    """Runs generate() on one preallocated static cache, optionally with a compiled decode step."""
+
+    def __init__(self, model, max_cache_len: int, compile: bool = True, compile_mode: str = "reduce-overhead"):
+        self.model = model
+        self.max_cache_len = max_cache_len
+        self.mode = "compiled" if compile else "static"
+        self.cache = make_static_cache(model, max_cache_len)
+        self.calls = 0
+        self.fallbacks = 0
+        self.patched = compile
+        if compile:
+            eager_forward = model.forward
+            compiled_forward = torch.compile(eager_forward, mode=compile_mode, fullgraph=False, dynamic=False)
+
+            def forward(*args, **kwargs):
+                # Only one-token steps on the static cache are compiled; eager fallbacks stay eager
+                input_ids = kwargs.get("input_ids", args[0] if args else None)
+                if kwargs.get("past_key_values") is self.cache and input_ids is not None and input_ids.shape[1] == 1:
+                    return compiled_forward(*args, **kwargs)
+                return eager_forward(*args, **kwargs)
+
+            model.forward = forward
+
+    def fits(self, inputs: dict, max_new_tokens: int, **generate_kwargs) -> bool:
+        input_ids = inputs["input_ids"]
+        return (
+            input_ids.size(0) == 1
+            and input_ids.size(1) + max_new_tokens <= self.max_cache_len
+            and not generate_kwargs.get("prompt_lookup_num_tokens")
+        )
+
+    def generate(self, inputs: dict, max_new_tokens: int, **generate_kwargs):
+        """generate() on the static cache when the call fits it, otherwise eager."""
+        if not self.fits(inputs, max_new_tokens, **generate_kwargs):
+            self.fallbacks += 1
+            return self.model.generate(**inputs, max_new_tokens=max_new_tokens, **generate_kwargs)
+        self.calls += 1
+        self.cache.reset()
+        return self.model.generate(
+            **inputs, max_new_tokens=max_new_tokens, past_key_values=self.cache, **generate_kwargs
+        )
+
+    def warm_up(self, inputs: dict, max_new_tokens: int, runs: int = 2, **generate_kwargs) -> float:
+        """Run a few generates so compilation and allocation happen now; returns the seconds taken."""
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.generate(inputs, max_new_tokens, **generate_kwargs)
+        self.calls = self.fallbacks = 0
+        return time.perf_counter() - start
+
+    def close(self):
+        """Restore the model's eager forward."""
+        if self.patched:
+            del self.model.forward
+            self.patched = False
+
+
+if __name__ == "__main__":
+    # Per-token decode latency of each mode on a small causal LM, for a workload
+    # shaped prompt and for a longer one that falls back to eager
+    import argparse
+
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers.generation.streamers import BaseStreamer
+
+    parser = argparse.ArgumentParser(description="Per-token latency of eager, static and compiled decoding.")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-135M")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--prompt-tokens", type=int, default=300, help="Prompt length of the regular workload")
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    class StepTimer(BaseStreamer):
+        """Time between the first new token and the last one."""
+
+        def __init__(self):
+            self.calls = 0
+            self.first = self.last = None
+            self.tokens = 0
+
+        def put(self, value):
+            self.calls += 1
+            if self.calls == 1:
+                return  # the prompt
+            self.last = time.perf_counter()
+            if self.first is None:
+                self.first = self.last
+            else:
+                self.tokens += value.numel()
+
+        def end(self):
+            pass
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    filler = "The blue soldier is at the left of the image while the centre of the image is in the middle. "
+    ids = tokenizer(filler * (args.prompt_tokens * 3 // len(tokenizer(filler)["input_ids"]) + 1), return_tensors="pt")["input_ids"]
+    prompts = {
+        "workload": ids[:, :args.prompt_tokens],
+        "longer (fallback)": ids[:, :args.prompt_tokens * 3],
+    }
+    kwargs = {"do_sample": False, "min_new_tokens": args.new_tokens, "pad_token_id": tokenizer.eos_token_id}
+
+    print(f"{args.model} on {args.device}, {args.new_tokens} new tokens")
+    print(f"{'mode':<10}{'prompt':<20}{'ms/token':>10}{'p90':>8}{'total ms':>10}{'warm-up s':>11}")
+    for mode in args.modes.split(","):
+        model = AutoModelForCausalLM.from_pretrained(args.model, dtype=torch.float32).to(args.device).eval()
+        decoder = None
+        warm_up_s = 0.0
+        with torch.inference_mode():
+            if mode != "eager":
+                decoder = StaticDecoder(model, cache_length(args.prompt_tokens, args.new_tokens), compile=mode == "compiled")
+                inputs = {"input_ids": prompts["workload"].to(args.device)}
+                warm_up_s = decoder.warm_up(inputs, args.new_tokens, **kwargs)
+            for label, prompt_ids in prompts.items():
+                inputs = {"input_ids": prompt_ids.to(args.device)}
+                per_token, totals = [], []
+                for _ in range(args.repeats):
+                    timer = StepTimer()
+                    start = time.perf_counter()
+                    if decoder:
+                        decoder.generate(inputs, args.new_tokens, streamer=timer, **kwargs)
+                    else:
+                        model.generate(**inputs, max_new_tokens=args.new_tokens, streamer=timer, **kwargs)
+                    totals.append((time.perf_counter() - start) * 1000.0)
+                    per_token.append((timer.last - timer.first) * 1000.0 / max(timer.tokens, 1))
+                per_token.sort()
+                print(f"{mode:<10}{label:<20}{per_token[len(per_token) // 2]:>10.2f}"
+                      f"{per_token[int(len(per_token) * 0.9)]:>8.2f}{sorted(totals)[len(totals) // 2]:>10.1f}{warm_up_s:>11.1f}")
+        if decoder:
+            print(f"{'':<10}static cache calls {decoder.calls}, eager fallbacks {decoder.fallbacks}")
@@ -0,0 +1,292 @@
+"""Grammar-constrained decoding for the fine-tuned output template.
+
+The template is a sequence of segments: literal text, integers and free text
+(only when the target cannot be read from the prompt), plus the bare "exit" answer:
+
+    The <target> in the image is at <points coords="F I X Y"><target></points> while the
+    centre of the image is at <points coords="1 1 500 500">centre of image</points>.
+    The action to be taken is therefore (DX, DY)
+
+A character-level automaton follows the template. TemplateConstraint lifts it to
+tokens: for an automaton state it lists the token ids whose text the automaton
+accepts (plus EOS where the answer may end), so a logits processor can mask
+everything else and the output is well formed by construction. Allowed sets
+are cached per state; the template has a few hundred states, so after the
+first request every step is a dictionary lookup.
+
+With force_literals, inside fixed text only the longest matching token is
+allowed, so boilerplate is emitted in as few steps as possible and never sampled.
+This module has no torch dependency; molmo_backend.py wraps it in a LogitsProcessor.
+"""
+import re
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import ACTION_SENTENCE, CENTRE_COORDS, CENTRE_LABEL, parse
+
+TARGET_REGEX = re.compile(r"Point to the (.+?) and determine", re.IGNORECASE)
+DIGITS = frozenset("0123456789")
+
+
+class Literal(NamedTuple):
+    text: str
+
+
+class Integer(NamedTuple):
+    min_digits: int
+    max_digits: int
+    signed: bool = False
+
+
+class Coordinate(NamedTuple):
+    """A point coordinate on the 0-1000 scale: three digits (000-999) or 1000, as the parsers expect."""
+
+
+class FreeText(NamedTuple):
+    stop: str  # ends before this character; the next segment must start with it
+
+
+@lru_cache(maxsize=64)
+def template_grammar(prompt: str) -> tuple:
+    """Alternatives (tuples of segments) the answer to this prompt may follow."""
+    match = TARGET_REGEX.search(prompt)
+    label = Literal(match.group(1)) if match else FreeText("<")
+    template = (
+        Literal("The "), label, Literal(' in the image is at <points coords="'),
+        Integer(1, 2), Literal(" "), Integer(1, 2), Literal(" "), Coordinate(), Literal(" "), Coordinate(),
+        Literal('">'), label,
+        Literal(f'</points> while the centre of the image is at <points coords="{CENTRE_COORDS}">'
+                f"{CENTRE_LABEL}</points>. {ACTION_SENTENCE} ("),
+        Integer(1, 4, signed=True), Literal(", "), Integer(1, 4, signed=True), Literal(")"),
+    )
+    return (_merge_literals(template), (Literal("exit"),))
+
+
+def _merge_literals(segments):
+    merged = []
+    for segment in segments:
+        if isinstance(segment, Literal) and merged and isinstance(merged[-1], Literal):
+            merged[-1] = Literal(merged[-1].text + segment.text)
+        else:
+            merged.append(segment)
+    return tuple(merged)
+
+
+class TemplateAutomaton:
+    """
+    Nondeterministic automaton over characters. A state is a frozenset of
+    (alternative, segment, position) tuples; position counts characters of a
+    literal, digits of an integer (-1 after a lone minus sign), digits of a
+    coordinate (plus 10 while they are a prefix of "1000") or 0/1 for free text
+    (empty / non-empty).
+    """
+
+    def __init__(self, grammar: tuple):
+        self.grammar = grammar
+        self.initial = frozenset((alt, 0, 0) for alt in range(len(grammar)))
+        self._step_cache = {}
+
+    def _step_one(self, alt, seg, pos, ch):
+        segments = self.grammar[alt]
+        if seg == len(segments):
+            return None
+        segment = segments[seg]
+        if isinstance(segment, Literal):
+            if segment.text[pos] != ch:
+                return None
+            return (alt, seg + 1, 0) if pos + 1 == len(segment.text) else (alt, seg, pos + 1)
+        if isinstance(segment, Integer):
+            if ch in DIGITS and max(pos, 0) < segment.max_digits:
+                return (alt, seg, max(pos, 0) + 1)
+            if ch == "-" and segment.signed and pos == 0:
+                return (alt, seg, -1)
+            if pos >= segment.min_digits:
+                return self._step_one(alt, seg + 1, 0, ch)
+            return None
+        if isinstance(segment, Coordinate):
+            digits, prefix = pos % 10, pos >= 10 or pos == 0
+            if ch in DIGITS and digits < 3:
+                return (alt, seg, digits + 1 + (10 if prefix and ch == "1000"[digits] else 0))
+            if ch == "0" and digits == 3 and prefix:
+                return (alt, seg, 4)  # 1000
+            if digits >= 3:
+                return self._step_one(alt, seg + 1, 0, ch)
+            return None
+        # FreeText
+        if ch != segment.stop:
+            return (alt, seg, 1)
+        if pos:
+            return self._step_one(alt, seg + 1, 0, ch)
+        return None
+
+    def step(self, state: frozenset, ch: str) -> frozenset:
+        key = (state, ch)
+        result = self._step_cache.get(key)
+        if result is None:
+            result = frozenset(
+                nxt for alt, seg, pos in state
+                if (nxt := self._step_one(alt, seg, pos, ch)) is not None
+            )
+            self._step_cache[key] = result
+        return result
+
+    def feed(self, state: frozenset, text: str) -> frozenset:
+        for ch in text:
+            if not state:
+                break
+            state = self.step(state, ch)
+        return state
+
+    def can_end(self, state: frozenset) -> bool:
+        for alt, seg, pos in state:
+            segments = self.grammar[alt]
+            if seg == len(segments):
+                return True
+            # A trailing integer may end once it has enough digits
+            if seg == len(segments) - 1 and isinstance(segments[seg], Integer) and pos >= segments[seg].min_digits:
+                return True
+        return False
+
+    def literal_remainder(self, state: frozenset) -> str | None:
+        """The rest of the literal when the state is inside exactly one literal."""
+        if len(state) != 1:
+            return None
+        alt, seg, pos = next(iter(state))
+        segments = self.grammar[alt]
+        if seg < len(segments) and isinstance(segments[seg], Literal):
+            return segments[seg].text[pos:]
+        return None
+
+
+class TokenIndex:
+    """
+    Decoded text of every token, bucketed by first and second character so a
+    state only examines tokens that can start with the characters it accepts.
+    Built once per tokenizer.
+    """
+
+    def __init__(self, token_texts: list, eos_ids):
+        self.texts = token_texts
+        self.eos_ids = tuple(eos_ids)
+        self.buckets = {}  # first char -> {rest's first char or "": [ids]}
+        for token_id, text in enumerate(token_texts):
+            if not text:
+                continue
+            self.buckets.setdefault(text[0], {}).setdefault(text[1:2], []).append(token_id)
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer):
+        """Token texts via the tokenizer's decode; special and partial-UTF-8 tokens are left out."""
+        special = set(tokenizer.all_special_ids)
+        texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))], clean_up_tokenization_spaces=False)
+        texts = [None if i in special or "�" in text else text for i, text in enumerate(texts)]
+        eos = tokenizer.eos_token_id
+        return cls(texts, eos if isinstance(eos, (list, tuple)) else [eos])
+
+
+class TemplateConstraint:
+    """Allowed next tokens for each automaton state of one grammar."""
+
+    def __init__(self, grammar: tuple, index: TokenIndex, force_literals: bool = True):
+        self.automaton = TemplateAutomaton(grammar)
+        self.index = index
+        self.force_literals = force_literals
+        self.initial = self.automaton.initial
+        self._allowed = {}
+        self._advance = {}
+
+    def advance(self, state: frozenset, token_id: int) -> frozenset:
+        key = (state, token_id)
+        result = self._advance.get(key)
+        if result is None:
+            text = self.index.texts[token_id] if token_id < len(self.index.texts) else None
+            result = self.automaton.feed(state, text) if text else frozenset()
+            self._advance[key] = result
+        return result
+
+    def allowed(self, state: frozenset) -> tuple:
+        """Token ids allowed in this state (EOS only once the state is dead or complete)."""
+        result = self._allowed.get(state)
+        if result is None:
+            result = self._compute(state)
+            self._allowed[state] = result
+        return result
+
+    def _compute(self, state):
+        automaton, texts = self.automaton, self.index.texts
+        ids = []
+        for first, by_second in self.index.buckets.items():
+            after_first = automaton.step(state, first)
+            if not after_first:
+                continue
+            for second, bucket in by_second.items():
+                after_second = automaton.step(after_first, second) if second else after_first
+                if not after_second:
+                    continue
+                for token_id in bucket:
+                    if len(texts[token_id]) <= 2 or automaton.feed(after_second, texts[token_id][2:]):
+                        ids.append(token_id)
+
+        remainder = automaton.literal_remainder(state) if self.force_literals else None
+        if remainder is not None and ids:
+            # Inside fixed text keep only the longest token that stays within it; tokens
+            # running on into the next segment keep their natural tokenization
+            inside = [i for i in ids if len(texts[i]) <= len(remainder)]
+            crossing = [i for i in ids if len(texts[i]) > len(remainder)]
+            ids = ([max(inside, key=lambda i: len(texts[i]))] if inside else []) + crossing
+
+        if automaton.can_end(state) or not state:
+            ids.extend(self.index.eos_ids)
+        return tuple(ids)
+
+
+if __name__ == "__main__":
+    # Cost of the allowed-token sets on a synthetic 150k-token vocabulary, and a
+    # greedy walk that always takes the longest allowed token
+    import random
+    import time
+
+    from stub_backend import stub_answer
+
+    rng = random.Random(0)
+    prompt = "Point to the blue soldier and determine the action to be taken by the camera to align the centre of the image with it."
+    answer = stub_answer(prompt, 1234567)
+    words = re.findall(r"\w+|[^\w\s]+", answer + " the a of in is at while to be taken centre image")
+    vocab = set()
+    for word in words:
+        for prefix in ("", " "):
+            token = prefix + word
+            vocab.update(token[:k] for k in range(1, len(token) + 1))
+    vocab.update(str(n) for n in range(1000))
+    vocab.update(" " + str(n) for n in range(1000))
+    vocab.update(['="', '">', "</", "<", ">", "(", ")", ", ", ".", " (", "-", '"'])
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    while len(vocab) < 150_000:
+        vocab.add(rng.choice(["", " ", "Ġ"]) + "".join(rng.choice(letters) for _ in range(rng.randrange(2, 9))))
+    texts = sorted(vocab) + [None]  # last id: EOS
+    index = TokenIndex(texts, [len(texts) - 1])
+
+    for force in (False, True):
+        constraint = TemplateConstraint(template_grammar(prompt), index, force_literals=force)
+        for attempt in ("cold", "warm"):
+            state, out, steps = constraint.initial, [], 0
+            start = time.perf_counter()
+            while True:
+                allowed = constraint.allowed(state)
+                if not allowed:
+                    break
+                # Follow the reference answer, taking the longest token the constraint allows
+                done = "".join(out)
+                candidates = [i for i in allowed if texts[i] is not None and answer.startswith(done + texts[i])]
+                if not candidates:
+                    break
+                token_id = max(candidates, key=lambda i: len(texts[i]))
+                out.append(texts[token_id])
+                state = constraint.advance(state, token_id)
+                steps += 1
+            elapsed = (time.perf_counter() - start) * 1000.0
+            print(f"force_literals={force!s:<5} {attempt}: {steps} steps, {elapsed / steps:8.3f} ms per step, "
+                  f"well formed {parse(''.join(out)).well_formed}, ends with EOS allowed {index.eos_ids[0] in constraint.allowed(state)}")
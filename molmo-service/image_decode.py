@@ -0,0 +1,169 @@
+"""Decoding of uploaded frames, using the fastest decoder available per format.
+
+    png   OpenCV's decoder when cv2 is installed, otherwise PIL's
+    jpeg  PIL in draft mode, which has libjpeg scale the DCT down by 2, 4 or 8
+          while staying at or above the requested size (OpenCV's reduced decode
+          when cv2 is installed)
+    raw   RAW_MAGIC, width and height (uint32 little endian) and packed RGB
+          pixels: read straight from the upload, nothing to decompress
+          (see encode_raw)
+    other PIL
+
+The size passed to decode() is backend.DECODE_SIZE, set with MOLMO_DECODE_SIZE=WxH
+(off by default); a frame larger than that may be decoded smaller, and is never
+decoded below it. Images already in RGB are not converted (PIL's
+convert copies the whole frame). decode_pair() decodes the current and previous
+frames concurrently; the decoders release the GIL. MOLMO_IMAGE_DECODER=pil
+forces PIL for every format. Benchmark per format and resolution:
+
+    python molmo-service/image_decode.py [--frames DIR]
+"""
+import io
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+RAW_MAGIC = b"RGB8"
+RAW_HEADER = struct.Struct("<4sII")
+USE_OPENCV = cv2 is not None and os.environ.get("MOLMO_IMAGE_DECODER", "auto") != "pil"
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="decode")
+
+
+def sniff(data: bytes) -> str:
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:4] == RAW_MAGIC:
+        return "raw"
+    return "other"
+
+
+def encode_raw(image: Image.Image) -> bytes:
+    """A frame in the raw format, for clients on a fast link that skip encoding."""
+    image = image.convert("RGB")
+    return RAW_HEADER.pack(RAW_MAGIC, *image.size) + image.tobytes()
+
+
+def _rgb(image: Image.Image) -> Image.Image:
+    image.load()
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def _reduction(size: tuple, target: tuple) -> int:
+    """Largest of 1, 2, 4, 8 that keeps size at or above target on both axes."""
+    factor = 1
+    while factor < 8 and size[0] // (factor * 2) >= target[0] and size[1] // (factor * 2) >= target[1]:
+        factor *= 2
+    return factor
+
+
+def _decode_raw(data: bytes) -> Image.Image:
+    _, width, height = RAW_HEADER.unpack_from(data)
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 3, offset=RAW_HEADER.size)
+    return Image.frombuffer("RGB", (width, height), pixels, "raw", "RGB", 0, 1)
+
+
+def _decode_opencv(data: bytes, reduction: int) -> Image.Image:
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags[reduction])
+    if array is None:
+        raise ValueError("OpenCV could not decode the image")
+    return Image.fromarray(cv2.cvtColor(array, cv2.COLOR_BGR2RGB))
+
+
+def decode(data: bytes, size: tuple = None) -> tuple:
+    """(RGB image, decoder used) for an uploaded frame; size is the largest useful size, if known."""
+    kind = sniff(data)
+    if kind == "raw":
+        return _decode_raw(data), "raw"
+    image = Image.open(io.BytesIO(data))
+    reduction = _reduction(image.size, size) if size else 1
+    if kind == "jpeg" and USE_OPENCV:
+        return _decode_opencv(data, reduction), f"jpeg:opencv/{reduction}"
+    if kind == "jpeg":
+        if reduction > 1:
+            image.draft("RGB", (image.size[0] // reduction, image.size[1] // reduction))
+        return _rgb(image), f"jpeg:pil/{reduction}"
+    if kind == "png" and USE_OPENCV and image.mode in ("RGB", "RGBA", "P", "L"):
+        return _decode_opencv(data, 1), "png:opencv"
+    return _rgb(image), f"{kind}:pil"
+
+
+def decode_pair(data: bytes, previous: bytes = None, size: tuple = None) -> tuple:
+    """(image, previous image or None, decoder used) with both frames decoded concurrently."""
+    pending = _pool.submit(decode, previous, size) if previous else None
+    image, decoder = decode(data, size)
+    previous_image = pending.result()[0] if pending else None
+    return image, previous_image, decoder
+
+
+if __name__ == "__main__":
+    # Decode time per format, resolution and decoder, and the pair of frames a
+    # request carries decoded one after the other against concurrently
+    import argparse
+    import statistics
+    import time
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Benchmark frame decoding per format and resolution.")
+    parser.add_argument("--frames", help="Directory of recorded screenshots (default: synthetic frames)")
+    parser.add_argument("--sizes", default="1280x720,1920x1080,1920x1200,2560x1440")
+    parser.add_argument("--target", default=None, help="Decode size to request, e.g. 960x540 (default: full size)")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    def synthetic(size):
+        # Flat HUD-like areas, gradients and a noisy region, so PNG compresses like a game frame
+        width, height = size
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        array = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2], axis=-1)
+        rng = np.random.default_rng(0)
+        region = (slice(height // 3, 2 * height // 3), slice(width // 4, 3 * width // 4))
+        array[region] += rng.normal(0, 25, array[region].shape)
+        array[:height // 10] = 40
+        return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+
+    if args.frames:
+        source = Image.open(sorted(p for p in Path(args.frames).iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))[0]).convert("RGB")
+    sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes.split(",")]
+    target = tuple(int(v) for v in args.target.split("x")) if args.target else None
+
+    def timed(fn):
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000.0)
+        return statistics.median(times)
+
+    def baseline(data):
+        return Image.open(io.BytesIO(data)).convert("RGB")
+
+    print(f"OpenCV {'available' if cv2 is not None else 'not installed'}; requested size {target or 'full'}; median of {args.repeats}")
+    print(f"{'size':<11}{'format':<7}{'KB':>7}{'open+convert ms':>17}{'decode ms':>11}  decoder")
+    for size in sizes:
+        image = source.resize(size) if args.frames else synthetic(size)
+        encoded = {}
+        for name, fmt in (("png", "PNG"), ("jpeg", "JPEG")):
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt, quality=90)
+            encoded[name] = buffer.getvalue()
+        encoded["raw"] = encode_raw(image)
+        for name, data in encoded.items():
+            base_ms = timed(lambda: baseline(data)) if name != "raw" else float("nan")
+            fast_ms = timed(lambda: decode(data, target))
+            print(f"{'%dx%d' % size:<11}{name:<7}{len(data) / 1024:>7.0f}{base_ms:>17.2f}{fast_ms:>11.2f}  {decode(data, target)[1]}")
+        data = encoded["png"]
+        sequential = timed(lambda: (decode(data, target), decode(data, target)))
+        concurrent = timed(lambda: decode_pair(data, data, target))
+        print(f"{'':<11}two PNG frames: one after the other {sequential:.2f} ms, concurrently {concurrent:.2f} ms ({os.cpu_count()} CPUs)")
@@ -0,0 +1,221 @@
+"""Minimal Prometheus-style metrics for the Molmo service.
+
+Counters, gauges and histograms are kept in-process and rendered in the Prometheus
+text exposition format by the /metrics endpoint. Only the standard library is used so
+the cost of recording stays small and measurable:
+
+    python molmo-service/metrics.py     # prints the per-call instrumentation overhead
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from sub-millisecond stages up to a full slow generate
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra=None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_max(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def _render_sample(self, key, state) -> list[str]:
+        lines = []
+        cumulative = 0
+        for i, bound in enumerate(self.buckets):
+            cumulative += state[i]
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+        lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class RequestTimings:
+    """Stage durations and counts for one request.
+
+    Stages are timed with perf_counter; the caller records them into histograms once
+    the request is finished so the hot path only does a dict update per stage. With a
+    tracer, each stage is also recorded as a span under trace_id.
+    """
+
+    def __init__(self, tracer=None, trace_id=None):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+        self.tracer = tracer
+        self.trace_id = trace_id
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name: str, start: float, end: float):
+        """Record a stage measured with time.perf_counter() timestamps."""
+        self.stages[name] = self.stages.get(name, 0.0) + (end - start)
+        if self.tracer is not None and self.tracer.enabled:
+            self.tracer.complete(name, start, end, "request", async_id=self.trace_id)
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000.0, 2),
+            "stages_ms": {name: round(seconds * 1000.0, 2) for name, seconds in self.stages.items()},
+            **self.values,
+        }
+
+
+def measure_overhead(iterations: int = 100_000) -> dict:
+    """Measure the cost of timing one stage and recording it into a histogram."""
+    registry = Registry()
+    histogram = registry.histogram("bench_stage_seconds", "benchmark", ["stage"])
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        timings = RequestTimings()
+        with timings.stage("decode"):
+            pass
+        for name, seconds in timings.stages.items():
+            histogram.observe(seconds, stage=name)
+    per_stage_ns = (time.perf_counter() - start) / iterations * 1e9
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.render()
+    render_us = (time.perf_counter() - start) / 100 * 1e6
+    return {"per_stage_ns": per_stage_ns, "render_us": render_us}
+
+
+if __name__ == "__main__":
+    result = measure_overhead()
+    print(f"Timing + recording one stage: {result['per_stage_ns']:.0f} ns")
+    print(f"Rendering /metrics:           {result['render_us']:.0f} us")
+    # A request records ~10 stages and takes hundreds of milliseconds
+    print(f"Overhead for 10 stages on a 500 ms request: {result['per_stage_ns'] * 10 / 5e8 * 100:.5f}%")
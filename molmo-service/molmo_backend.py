@@ -0,0 +1,406 @@
+"""Molmo2-4B backend: loads the model and LoRA adaptors and runs generate.
+
+The service, offline tools and the CPU-only stub (stub_backend.py) share this interface:
+    MODEL_NAME, DEFAULT_ADAPTER, ADAPTERS, INFERENCE_MODE
+    DECODE_SIZE -> size uploads may be decoded down to (MOLMO_DECODE_SIZE), or None (image_decode.py)
+    prepare_inputs(messages) -> inputs on the host
+    generate_text(inputs, adapter, timings, grammar=None, speculative=False, cancel=None) -> generated text
+    discard_inputs(inputs) -> frees prepared inputs that will not be generated from
+    prepare_batch(messages_batch) -> padded inputs for several conversations
+    generate_batch(inputs, adapter, timings, grammars=None, cancels=None) -> generated texts
+    memory_stats() -> input buffer pool and allocator counters
+
+cancel (a threading.Event, one per row for batches) stops generation at the next
+token boundary once set; the text generated so far is returned.
+
+A grammar (constrained.template_grammar) restricts decoding to the output template.
+With speculative, drafts from the prompt and recent answers are verified in one
+forward pass per step (speculative.py). MOLMO_INFERENCE_MODE=static|compiled runs
+single-request generates on a preallocated static KV cache, with a compiled decode
+step in compiled mode (compiled.py); the cache is sized by a warm-up at startup.
+Inputs are prepared in pooled pinned buffers and copied asynchronously into pooled
+device buffers (buffer_pool.py, MOLMO_BUFFER_POOL_MB of free buffers per side).
+"""
+import logging
+import os
+import time
+import resource
+import torch
+from transformers import (
+    AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig, LogitsProcessor, LogitsProcessorList,
+    StoppingCriteria, StoppingCriteriaList
+)
+from transformers.generation.streamers import BaseStreamer
+from peft import PeftModel
+from PIL import Image
+from metrics import RequestTimings
+from constrained import TemplateConstraint, TokenIndex
+from buffer_pool import BufferPool
+from compiled import MODES, StaticDecoder, cache_length
+from speculative import NUM_DRAFT, NgramCandidateGenerator, NgramDrafter, OutputCache, use_drafter
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "Molmo2-4B"
+
+# Load Molmo2-4B on startup
+print("Loading Molmo2-4B model...")
+
+nf4_config = BitsAndBytesConfig(
+    load_in_4bit=True,
+    bnb_4bit_quant_type="nf4",
+    bnb_4bit_compute_dtype=torch.float16,
+    llm_int8_skip_modules=[
+        # Module names can also be relative like "ff_norm" which would apply to all such layers
+        "model.vision_backbone", "model.transformer.ff_out", "model.transformer.ln_f"
+    ]
+)
+
+model_id="allenai/Molmo2-4B"
+
+# load the processor
+processor = AutoProcessor.from_pretrained(
+    model_id,
+    trust_remote_code=True,
+    dtype=torch.float16,
+    device_map="auto",
+    token=True
+)
+
+# load the model
+model = AutoModelForImageTextToText.from_pretrained(
+    model_id,
+    trust_remote_code=True,
+    dtype=torch.float16,
+    device_map="auto",
+    quantization_config=nf4_config,
+    token=True
+)
+
+# LoRA adaptors selectable per request with the "adapter" form field.
+# Extra adaptors can be registered with MOLMO_ADAPTERS="name=path,name2=path2"
+DEFAULT_ADAPTER = "default"
+ADAPTERS = {DEFAULT_ADAPTER: "checkpoint-3000"}
+for entry in filter(None, os.environ.get("MOLMO_ADAPTERS", "").split(",")):
+    name, path = entry.split("=", 1)
+    ADAPTERS[name.strip()] = path.strip()
+
+model = PeftModel.from_pretrained(model, ADAPTERS[DEFAULT_ADAPTER], adapter_name=DEFAULT_ADAPTER)
+for name, path in ADAPTERS.items():
+    if name != DEFAULT_ADAPTER:
+        print(f"Loading adapter {name} from {path}")
+        model.load_adapter(path, adapter_name=name)
+
+print("Model loaded successfully!")
+
+MAX_NEW_TOKENS = 256
+INFERENCE_MODE = os.environ.get("MOLMO_INFERENCE_MODE", "eager")
+if INFERENCE_MODE not in MODES:
+    raise ValueError(f"MOLMO_INFERENCE_MODE must be one of {MODES}, got {INFERENCE_MODE!r}")
+# Screenshot size used for the warm-up, i.e. the client's capture resolution
+WARMUP_SIZE = tuple(int(v) for v in os.environ.get("MOLMO_WARMUP_SIZE", "1920x1080").split("x"))
+static_decoder = None
+buffer_pool = BufferPool(model.device, int(os.environ.get("MOLMO_BUFFER_POOL_MB", "256")) * 2**20)
+
+# Uploads larger than MOLMO_DECODE_SIZE=WxH may be decoded at a reduced size. Opt-in:
+# max_crops bounds the number of crops, not crops per side, so the processor's
+# settings give no per-axis size below which detail is certainly resized away
+DECODE_SIZE = tuple(int(v) for v in os.environ["MOLMO_DECODE_SIZE"].split("x")) if os.environ.get("MOLMO_DECODE_SIZE") else None
+
+IMAGE_PATCH_TOKEN = "<im_patch>"
+image_patch_token_id = processor.tokenizer.convert_tokens_to_ids(IMAGE_PATCH_TOKEN)
+if image_patch_token_id == processor.tokenizer.unk_token_id:
+    image_patch_token_id = None
+
+class TimingStreamer(BaseStreamer):
+    """Records when generate emits its first new token to split prefill from decode."""
+
+    def __init__(self):
+        self.prompt_seen = False
+        self.first_token_time = None
+        self.tokens = 0
+
+    def put(self, value):
+        # The first call carries the prompt, every later call one new token
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.tokens += value.numel()
+
+    def end(self):
+        pass
+
+class CancelCriteria(StoppingCriteria):
+    """Finishes each row whose cancel event is set; generate stops once every row has finished."""
+
+    def __init__(self, events: list):
+        self.events = events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([event is not None and event.is_set() for event in self.events], device=input_ids.device)
+
+def cancel_kwargs(events: list) -> dict:
+    if not any(events):
+        return {}
+    return {"stopping_criteria": StoppingCriteriaList([CancelCriteria(events)])}
+
+token_index = None  # built on the first constrained request
+constraints = {}  # grammar -> TemplateConstraint, keeps each grammar's allowed-token cache
+allowed_tensors = {}  # (grammar, state) -> allowed token ids on the model's device
+
+def get_constraint(grammar: tuple) -> TemplateConstraint:
+    global token_index
+    if token_index is None:
+        token_index = TokenIndex.from_tokenizer(processor.tokenizer)
+    constraint = constraints.get(grammar)
+    if constraint is None:
+        constraint = constraints[grammar] = TemplateConstraint(grammar, token_index)
+    return constraint
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token the template does not allow next, row by row (rows without a
+    constraint are left free). Each row keeps the automaton state after every
+    generated token, so assisted decoding may score drafted positions and roll
+    back rejected ones.
+    """
+
+    def __init__(self, row_constraints: list, prompt_length: int):
+        self.constraints = row_constraints
+        self.tokens = [[] for _ in row_constraints]
+        self.states = [[constraint.initial] if constraint else None for constraint in row_constraints]
+        self.prompt_length = prompt_length
+        self.forced_tokens = 0
+
+    def _state(self, row: int, generated: list):
+        constraint, tokens, states = self.constraints[row], self.tokens[row], self.states[row]
+        common = 0
+        while common < len(tokens) and common < len(generated) and tokens[common] == generated[common]:
+            common += 1
+        del tokens[common:], states[common + 1:]
+        for token_id in generated[common:]:
+            tokens.append(token_id)
+            states.append(constraint.advance(states[-1], token_id))
+        return states[-1]
+
+    def __call__(self, input_ids, scores):
+        generated = input_ids[:, self.prompt_length:].tolist()
+        bias = torch.full_like(scores, float("-inf"))
+        for row, constraint in enumerate(self.constraints):
+            if constraint is None:
+                bias[row] = 0
+                continue
+            state = self._state(row, generated[row])
+            key = (constraint.automaton.grammar, state)
+            allowed = allowed_tensors.get(key)
+            if allowed is None:
+                allowed = allowed_tensors[key] = torch.tensor(constraint.allowed(state), device=scores.device, dtype=torch.long)
+            bias[row, allowed] = 0
+            self.forced_tokens += allowed.numel() == 1
+        return scores + bias
+
+def grammar_kwargs(grammars: list, inputs: dict, timings: RequestTimings) -> tuple:
+    """generate() keyword arguments for per-row grammars (None: unconstrained)."""
+    if not any(grammars):
+        return {}, None
+    with timings.stage("grammar_compile"):
+        row_constraints = [get_constraint(grammar) if grammar else None for grammar in grammars]
+    grammar_processor = GrammarLogitsProcessor(row_constraints, inputs['input_ids'].size(1))
+    return {"logits_processor": LogitsProcessorList([grammar_processor])}, grammar_processor
+
+output_caches = {}  # adapter -> OutputCache of its recent answers, drafted from
+speculative_supported = None  # whether this model's generate accepts assisted decoding, checked at load
+
+def speculative_generate(inputs: dict, adapter: str, cache: OutputCache = None, **kwargs):
+    """generate() with prompt-lookup drafting; returns the output ids and the drafter."""
+    cache = cache if cache is not None else output_caches.setdefault(adapter, OutputCache())
+    prompt_length = inputs['input_ids'].size(1)
+    drafter = NgramDrafter(inputs['input_ids'][0].tolist(), cache)
+    generator = NgramCandidateGenerator(drafter, prompt_length, prompt_length + kwargs["max_new_tokens"])
+    with use_drafter(model.get_base_model(), generator):
+        generated_ids = model.generate(**inputs, prompt_lookup_num_tokens=NUM_DRAFT, do_sample=False, **kwargs)
+    cache.add(generated_ids[0, prompt_length:].tolist())
+    return generated_ids, drafter
+
+def check_speculative() -> bool:
+    """Try assisted decoding once on a small image prompt (the answer is not kept)."""
+    image = Image.new("RGB", (64, 64), (90, 110, 90))
+    inputs = prepare_inputs([{"role": "user", "content": [{"type": "text", "text": "Describe the image."}, {"type": "image", "image": image}]}])
+    lease = buffer_pool.to_device(inputs)
+    try:
+        lease.wait()
+        with torch.inference_mode():
+            speculative_generate(lease.inputs, None, OutputCache(), max_new_tokens=4)
+    except (ValueError, NotImplementedError) as e:
+        logger.warning("Assisted decoding unavailable, speculative requests decode without drafts: %s", e)
+        return False
+    finally:
+        lease.release()
+    return True
+
+def prepare_inputs(messages: list) -> dict:
+    """Apply the chat template (image cropping, normalisation and tokenization).
+
+    On CUDA the tensors are copied into pooled pinned buffers here, in the
+    preprocessing pool, so the copy to the device can run asynchronously.
+    """
+    inputs = processor.apply_chat_template(
+        messages,
+        tokenize=True,
+        add_generation_prompt=True,
+        return_tensors="pt",
+        return_dict=True
+    )
+    return buffer_pool.pin(inputs)
+
+def generate_text(inputs: dict, adapter: str, timings: RequestTimings, grammar: tuple | None = None,
+                  speculative: bool = False, cancel=None) -> str:
+    """Run model.generate for prepared inputs with the given adapter active."""
+    on_cuda = model.device.type == "cuda"
+    if on_cuda:
+        torch.cuda.reset_peak_memory_stats(model.device)
+
+    # The copy runs on its own stream while the adapter and logits processors are set up
+    with timings.stage("h2d_copy"):
+        lease = buffer_pool.to_device(inputs)
+    try:
+        return generate_on_device(lease, adapter, timings, grammar, speculative, cancel)
+    finally:
+        lease.release()
+
+def discard_inputs(inputs: dict):
+    """Return the pinned buffers of inputs dropped before generate_text."""
+    buffer_pool.discard(inputs)
+
+def generate_on_device(lease, adapter: str, timings: RequestTimings, grammar: tuple | None,
+                       speculative: bool, cancel) -> str:
+    """generate_text on a buffer_pool.Lease of the inputs."""
+    inputs = lease.inputs
+    on_cuda = model.device.type == "cuda"
+    model.set_adapter(adapter)
+    generate_kwargs, grammar_processor = grammar_kwargs([grammar], inputs, timings)
+    generate_kwargs.update(cancel_kwargs([cancel]))
+    lease.wait()
+    streamer = TimingStreamer()
+    drafter = None
+    inference_mode = "eager"
+    start = time.perf_counter()
+    with torch.inference_mode():
+        if speculative and speculative_supported:
+            try:
+                generated_ids, drafter = speculative_generate(inputs, adapter, max_new_tokens=MAX_NEW_TOKENS, streamer=streamer, **generate_kwargs)
+            except (ValueError, NotImplementedError) as e:
+                # This request only: decode it again without drafts, timed from scratch
+                logger.warning("Assisted decoding failed, decoding this request without drafts: %s", e)
+                timings.record("speculative_failed", start, time.perf_counter())
+                generate_kwargs, grammar_processor = grammar_kwargs([grammar], inputs, timings)
+                generate_kwargs.update(cancel_kwargs([cancel]))
+                streamer = TimingStreamer()
+                start = time.perf_counter()
+                generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS, streamer=streamer, **generate_kwargs)
+        elif static_decoder is not None and static_decoder.fits(inputs, MAX_NEW_TOKENS):
+            inference_mode = static_decoder.mode
+            generated_ids = static_decoder.generate(inputs, MAX_NEW_TOKENS, streamer=streamer, **generate_kwargs)
+        else:
+            generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS, streamer=streamer, **generate_kwargs)
+    end = time.perf_counter()
+    first_token_time = streamer.first_token_time or end
+    timings.record("prefill", start, first_token_time)
+    timings.record("decode", first_token_time, end)
+
+    # Only get generated tokens
+    with timings.stage("token_decode"):
+        generated_tokens = generated_ids[0, inputs['input_ids'].size(1):]
+        generated_text = processor.tokenizer.decode(generated_tokens, skip_special_tokens=True)
+
+    input_ids = inputs['input_ids']
+    decode_seconds = end - first_token_time
+    timings.values.update({
+        "prompt_tokens": input_ids.size(1),
+        "vision_tokens": int((input_ids == image_patch_token_id).sum()) if image_patch_token_id is not None else None,
+        "generated_tokens": len(generated_tokens),
+        # The first token comes out of prefill, the rest out of the decode steps
+        "tokens_per_s": round((len(generated_tokens) - 1) / decode_seconds, 2) if decode_seconds > 0 else None,
+        "device": model.device.type,
+        "constrained": grammar is not None,
+        "forced_tokens": grammar_processor.forced_tokens if grammar_processor else None,
+        "speculative": drafter is not None,
+        "inference_mode": inference_mode,
+        "cancelled": cancel is not None and cancel.is_set(),
+        **(drafter.stats() if drafter else {}),
+        "peak_memory_bytes": (
+            torch.cuda.max_memory_allocated(model.device) if on_cuda
+            else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        ),
+    })
+    return generated_text
+
+def warm_up():
+    """Size the static cache from a two-frame prompt at WARMUP_SIZE and compile before the first request."""
+    global static_decoder, INFERENCE_MODE
+    image = Image.new("RGB", WARMUP_SIZE, (90, 110, 90))
+    prompt = "Point to the blue soldier and determine the action to be taken by the camera to align the centre of the image with it."
+    content = [{"type": "text", "text": prompt}, {"type": "image", "image": image}]
+    shapes = [prepare_inputs([{"role": "user", "content": content + [{"type": "image", "image": image}]}]),
+              prepare_inputs([{"role": "user", "content": content}])]
+    max_cache_len = int(os.environ.get("MOLMO_STATIC_CACHE_LEN", 0)) or cache_length(shapes[0]["input_ids"].size(1), MAX_NEW_TOKENS)
+    print(f"Preparing {INFERENCE_MODE} inference: static cache of {max_cache_len} tokens")
+    try:
+        static_decoder = StaticDecoder(model.get_base_model(), max_cache_len, compile=INFERENCE_MODE == "compiled")
+        seconds = 0.0
+        with torch.inference_mode():
+            for inputs in shapes:
+                lease = buffer_pool.to_device(inputs)
+                lease.wait()
+                seconds += static_decoder.warm_up(lease.inputs, MAX_NEW_TOKENS)
+                lease.release()
+        print(f"Warm-up done in {seconds:.1f}s")
+    except Exception as e:
+        # e.g. a model or quantization the static cache or compiler does not support
+        logger.warning("%s inference unavailable, using eager: %s", INFERENCE_MODE, e)
+        if static_decoder is not None:
+            static_decoder.close()
+        static_decoder, INFERENCE_MODE = None, "eager"
+
+def prepare_batch(messages_batch: list) -> dict:
+    """Apply the chat template to several conversations, left-padded for generation."""
+    processor.tokenizer.padding_side = "left"
+    return buffer_pool.pin(processor.apply_chat_template(
+        messages_batch,
+        tokenize=True,
+        add_generation_prompt=True,
+        return_tensors="pt",
+        return_dict=True,
+        padding=True
+    ))
+
+def generate_batch(inputs: dict, adapter: str, timings: RequestTimings, grammars: list | None = None,
+                   cancels: list | None = None) -> list[str]:
+    """Run one batched model.generate and decode each row's new tokens (cancelled rows stop early)."""
+    with timings.stage("h2d_copy"):
+        lease = buffer_pool.to_device(inputs)
+    try:
+        inputs = lease.inputs
+        model.set_adapter(adapter)
+        generate_kwargs, _ = grammar_kwargs(grammars or [], inputs, timings)
+        generate_kwargs.update(cancel_kwargs(cancels or []))
+        lease.wait()
+        with timings.stage("generate"):
+            with torch.inference_mode():
+                generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS, **generate_kwargs)
+
+        with timings.stage("token_decode"):
+            generated_tokens = generated_ids[:, inputs['input_ids'].size(1):]
+            return processor.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+    finally:
+        lease.release()
+
+def memory_stats() -> dict:
+    """Input buffer pool and CUDA allocator counters (see buffer_pool.py)."""
+    return buffer_pool.stats()
+
+speculative_supported = check_speculative()
+if INFERENCE_MODE != "eager":
+    warm_up()
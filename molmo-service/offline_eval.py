@@ -0,0 +1,284 @@
+"""Offline evaluation: run recorded frames through the model without the HTTP service.
+
+The model is loaded once and frames are fed through it in batches while a
+prefetching loader decodes images and applies the chat template for the next
+batches. Output is metadata.jsonl-compatible, so the utils/list_* analyses and
+utils/plot_points_screenshots.py work on it unchanged.
+
+    # every before_XXXX.png in a run directory
+    python molmo-service/offline_eval.py --input vla_evaluation --out eval/metadata.jsonl --adapter default
+    # the frames (and prompts) of a previous run
+    python molmo-service/offline_eval.py --input vla_evaluation/metadata.jsonl --out eval/metadata.jsonl
+    # four processes, one per GPU, merged into eval/metadata.jsonl at the end
+    python molmo-service/offline_eval.py --input vla_evaluation --out eval/metadata.jsonl --num-shards 4 --devices 0,1,2,3
+
+Re-running the same command resumes: frames already in the output are skipped.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image
+
+DEFAULT_TARGET = "blue soldier"
+FRAME_NUMBER_REGEX = re.compile(r"_(\d+)\.\w+$")
+
+
+@dataclass
+class EvalItem:
+    iteration: int
+    image_name: str  # as stored in before_screenshot, relative to images_dir
+    prompt: str
+
+
+def load_items(source: Path, images_dir: Path, prompt: str | None, target: str) -> list[EvalItem]:
+    """Frames to evaluate from a screenshot directory or a previous metadata.jsonl."""
+    default_prompt = prompt or f"Point to the {target} and determine the action to be taken by the camera to align the centre of the image with it."
+    items = []
+    if source.is_dir():
+        # Frames are either in the directory itself or in per-run subdirectories
+        for path in sorted(source.rglob("before_*.png")):
+            match = FRAME_NUMBER_REGEX.search(path.name)
+            iteration = int(match.group(1)) if match else len(items) + 1
+            items.append(EvalItem(iteration, path.relative_to(source).as_posix(), default_prompt))
+        return items
+
+    with source.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            name = data.get("before_screenshot")
+            if not name or not (images_dir / name).exists():
+                print(f"Skipping iteration {data.get('iteration')}: screenshot {name} not found")
+                continue
+            # An explicit --prompt overrides the prompts the frames were recorded with
+            items.append(EvalItem(data.get("iteration", len(items) + 1), name, prompt or data.get("prompt") or default_prompt))
+    return items
+
+
+def shard_path(out: Path, shard: int, num_shards: int) -> Path:
+    if num_shards == 1:
+        return out
+    return out.with_name(f"{out.stem}.shard{shard}of{num_shards}{out.suffix}")
+
+
+def read_records(path: Path) -> list[dict]:
+    """Records of an output file, ignoring a line truncated by an interrupted run."""
+    records = []
+    if not path.exists():
+        return records
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def completed_frames(path: Path) -> set[str]:
+    return {r["before_screenshot"] for r in read_records(path) if r.get("before_screenshot")}
+
+
+class PrefetchLoader:
+    """
+    Yields (batch, images, inputs) with up to `depth` batches prepared ahead.
+
+    Images are decoded on a thread pool; the chat template runs on one background
+    thread so the tokenizer is never used concurrently.
+    """
+
+    def __init__(self, items, images_dir, batch_size, depth, workers, build_messages, prepare_batch):
+        self.batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        self.images_dir = images_dir
+        self.depth = depth
+        self.build_messages = build_messages
+        self.prepare_batch = prepare_batch
+        self.decode_pool = ThreadPoolExecutor(max_workers=workers)
+        self.prepare_pool = ThreadPoolExecutor(max_workers=1)
+
+    def load_image(self, item: EvalItem):
+        try:
+            with Image.open(self.images_dir / item.image_name) as image:
+                return image.convert("RGB")
+        except OSError as e:
+            return e
+
+    def prepare(self, batch, image_futures):
+        images = [future.result() for future in image_futures]
+        messages = [
+            self.build_messages(item.prompt, image)
+            for item, image in zip(batch, images) if not isinstance(image, Exception)
+        ]
+        inputs = self.prepare_batch(messages) if messages else None
+        return images, inputs
+
+    def submit(self, batch):
+        image_futures = [self.decode_pool.submit(self.load_image, item) for item in batch]
+        return self.prepare_pool.submit(self.prepare, batch, image_futures)
+
+    def __iter__(self):
+        pending = deque()
+        batches = iter(self.batches)
+        try:
+            for batch in batches:
+                pending.append((batch, self.submit(batch)))
+                if len(pending) > self.depth:
+                    batch, future = pending.popleft()
+                    yield (batch, *future.result())
+            while pending:
+                batch, future = pending.popleft()
+                yield (batch, *future.result())
+        finally:
+            self.decode_pool.shutdown(wait=False, cancel_futures=True)
+            self.prepare_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_record(item: EvalItem, text: str, commands: dict, args, error: str | None = None) -> dict:
+    record = {
+        "iteration": item.iteration,
+        "timestamp": datetime.now().isoformat(),
+        "before_screenshot": item.image_name,
+        "after_screenshot": None,
+        "prompt": item.prompt,
+        "vla_output": text,
+        "commands": {key: commands.get(key, 0) for key in ("up", "down", "left", "right", "exit")},
+        "executed_durations": {},
+        "source": "offline_eval",
+        "adapter": args.adapter,
+        "constrained": args.constrained,
+        "images_dir": str(args.images_dir),
+    }
+    if error:
+        record["error"] = error
+    return record
+
+
+def run_shard(args):
+    # Imported here so --spawn and merging never load the model
+    from app import backend, build_messages, parse_molmo_output
+    from constrained import template_grammar
+    from metrics import RequestTimings
+
+    adapter = args.adapter or backend.DEFAULT_ADAPTER
+    if adapter not in backend.ADAPTERS:
+        raise SystemExit(f"Unknown adapter '{adapter}'. Available: {sorted(backend.ADAPTERS)}")
+    args.adapter = adapter
+
+    items = load_items(args.input, args.images_dir, args.prompt, args.target)
+    items = items[args.shard::args.num_shards]
+    out = shard_path(args.out, args.shard, args.num_shards)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    done = completed_frames(out)
+    todo = [item for item in items if item.image_name not in done]
+    print(f"Shard {args.shard}/{args.num_shards}: {len(items)} frames, {len(items) - len(todo)} already done, writing {out}")
+
+    loader = PrefetchLoader(todo, args.images_dir, args.batch_size, args.prefetch, args.workers,
+                            build_messages, backend.prepare_batch)
+    evaluated = 0
+    started = time.perf_counter()
+    with out.open("a", encoding="utf-8") as f:
+        for batch, images, inputs in loader:
+            ok = [item for item, image in zip(batch, images) if not isinstance(image, Exception)]
+            texts = []
+            if ok:
+                try:
+                    grammars = [template_grammar(item.prompt) for item in ok] if args.constrained else None
+                    texts = backend.generate_batch(inputs, adapter, RequestTimings(), grammars)
+                except Exception as e:
+                    # e.g. out of memory on a large batch: fall back to one frame at a time
+                    print(f"Batched generate failed ({e}); retrying {len(ok)} frames one by one")
+                    texts = [
+                        backend.generate_text(
+                            backend.prepare_inputs(build_messages(item.prompt, image)), adapter, RequestTimings(),
+                            template_grammar(item.prompt) if args.constrained else None,
+                        )
+                        for item, image in zip(batch, images) if not isinstance(image, Exception)
+                    ]
+            results = iter(texts)
+            for item, image in zip(batch, images):
+                if isinstance(image, Exception):
+                    record = make_record(item, "", {}, args, error=f"{type(image).__name__}: {image}")
+                else:
+                    text = next(results)
+                    record = make_record(item, text, parse_molmo_output(text), args)
+                f.write(json.dumps(record) + "\n")
+            # Flush per batch so an interrupted run resumes after the last complete batch
+            f.flush()
+            evaluated += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"[shard {args.shard}] {evaluated}/{len(todo)} frames, {evaluated / elapsed:.2f} frames/s")
+    return out
+
+
+def merge_shards(out: Path, num_shards: int):
+    """Combine shard outputs into one metadata.jsonl ordered by iteration."""
+    records = []
+    for shard in range(num_shards):
+        records.extend(read_records(shard_path(out, shard, num_shards)))
+    records.sort(key=lambda r: (r.get("iteration", 0), r.get("before_screenshot", "")))
+    with out.open("w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    print(f"Merged {len(records)} records from {num_shards} shards into {out}")
+
+
+def spawn_shards(args, argv):
+    """Run every shard as its own process (one model copy each) and merge the results."""
+    devices = args.devices.split(",") if args.devices else []
+    processes = []
+    for shard in range(args.num_shards):
+        env = dict(os.environ)
+        if devices:
+            env["CUDA_VISIBLE_DEVICES"] = devices[shard % len(devices)]
+        command = [sys.executable, __file__, *argv, "--shard", str(shard)]
+        processes.append(subprocess.Popen(command, env=env))
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise SystemExit(f"Shards {failed} failed; re-run the same command to resume them")
+    merge_shards(args.out, args.num_shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch offline evaluation of recorded frames.")
+    parser.add_argument("--input", type=Path, required=True, help="Screenshot directory or a previous metadata.jsonl")
+    parser.add_argument("--images-dir", type=Path, help="Where before_screenshot files live (default: the input's directory)")
+    parser.add_argument("--out", type=Path, required=True, help="Output metadata.jsonl")
+    parser.add_argument("--adapter", help="LoRA adapter name (default: the backend's default)")
+    parser.add_argument("--target", default=DEFAULT_TARGET)
+    parser.add_argument("--prompt", help="Override the prompt built from --target or recorded in the input")
+    parser.add_argument("--constrained", action="store_true", help="Constrain decoding to the output template")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--prefetch", type=int, default=2, help="Batches prepared ahead of the model")
+    parser.add_argument("--workers", type=int, default=4, help="Image decode threads")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard", type=int, help="Run only this shard; without it, all shards are spawned")
+    parser.add_argument("--devices", help="Comma-separated CUDA devices assigned to spawned shards round-robin")
+    parser.add_argument("--merge-only", action="store_true", help="Only merge existing shard outputs")
+    argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    if args.images_dir is None:
+        args.images_dir = args.input if args.input.is_dir() else args.input.parent
+
+    if args.merge_only:
+        merge_shards(args.out, args.num_shards)
+    elif args.num_shards > 1 and args.shard is None:
+        spawn_shards(args, argv)
+    else:
+        args.shard = args.shard or 0
+        run_shard(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Preprocessing off the event loop, ahead of the accelerator.
+
+Decoding the upload and applying the chat template (cropping, resizing,
+normalisation, tokenization) is CPU work. Run inline, it blocks the event loop and
+leaves the accelerator idle between generates. Preprocessor runs it in a thread
+pool (PIL, NumPy and the tokenizer release the GIL for the heavy parts), so the
+next requests are prepared while the current one generates.
+
+The prefetch depth bounds how many requests may hold prepared inputs (pinned
+host tensors on CUDA) while waiting for the model; a request takes a prefetch
+slot before preprocessing and gives it back once it reaches the model.
+
+    MOLMO_PREPROCESS_WORKERS  pool threads (default 2; 0 preprocesses inline)
+    MOLMO_PREFETCH            requests prepared ahead of the model (default 2)
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PrefetchSlot:
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+class Preprocessor:
+    def __init__(self, workers: int = 2, max_prefetch: int = 2):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess") if workers > 0 else None
+        self.max_prefetch = max_prefetch
+        self.slots = None  # created lazily on the running event loop
+
+    async def acquire(self) -> PrefetchSlot:
+        """Wait until fewer than max_prefetch requests are prepared ahead of the model."""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_prefetch)
+        await self.slots.acquire()
+        return PrefetchSlot(self.slots)
+
+    async def run(self, fn, *args):
+        """fn(*args) in the pool, or inline without workers."""
+        if self.pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
@@ -0,0 +1,88 @@
+"""Coalescing and caching of identical analyze requests.
+
+Replays and client retries often send the same (frame, prompt, adapter) again.
+Requests are keyed by a hash of everything that changes the answer; a request
+whose key is already being generated waits for that computation instead of
+starting another one, and completed responses stay in a bounded LRU cache with
+a TTL, replayed without touching the model:
+
+    MOLMO_CACHE_SIZE   completed responses kept (default 256, 0 disables the cache)
+    MOLMO_CACHE_TTL_S  seconds a response stays valid (default 300)
+
+Greedy decoding makes the answer a function of the key. Speculative decoding
+does not change the answer, so it is not part of the key.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def request_key(image_bytes: bytes, prompt: str, adapter: str, constrained: bool, previous_bytes: bytes = None) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (image_bytes, previous_bytes or b"", prompt.encode(), adapter.encode(), b"1" if constrained else b"0"):
+        # Length-prefixed so different splits of the same bytes never collide
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, ttl_s: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()  # key -> (stored_at, events)
+        self.inflight = {}  # key -> [task computing the response, number of waiters]
+
+    def get(self, key: str):
+        """Cached events for key, or None (expired entries are dropped)."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, events = entry
+        if time.monotonic() - stored_at > self.ttl_s:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return events
+
+    def put(self, key: str, events: list):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic(), events)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self.inflight
+
+    async def run(self, key: str, compute) -> tuple:
+        """
+        Result of compute() for key and whether it was coalesced onto a computation
+        already in flight. The computation is shielded, so one waiter going away
+        does not cancel it for the others; it is cancelled when the last one goes.
+        """
+        entry = self.inflight.get(key)
+        coalesced = entry is not None
+        if entry is None:
+            entry = self.inflight[key] = [asyncio.ensure_future(compute()), 0]
+            entry[0].add_done_callback(lambda done: self._forget(key, done))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task), coalesced
+        except asyncio.CancelledError:
+            if not task.done():
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._forget(key, task)
+                    task.cancel()
+            raise
+
+    def _forget(self, key: str, task):
+        if key in self.inflight and self.inflight[key][0] is task:
+            del self.inflight[key]
+
+    def __len__(self):
+        return len(self.entries)
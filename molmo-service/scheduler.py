@@ -0,0 +1,212 @@
+"""Deadline-aware, latest-frame-wins admission to the model.
+
+Replaces a plain FIFO lock around generate. Each waiter may carry a session id
+(one control loop, e.g. the client's run id) and a deadline:
+
+- when a request of a session arrives while an older request of the same session
+  is still queued, the older one is dropped as superseded: only the newest frame
+  of a control loop is worth running;
+- a queued request whose deadline passes is dropped as expired right away
+  instead of being run late.
+
+Dropped waiters get Dropped(reason) instead of the slot. Requests without a
+session or deadline are served FIFO as before.
+
+A request that still has work to do before it can use the model (preprocessing)
+joins the queue first with enqueue(ready=False) and wraps that work in
+until_dropped(). It expires like any queued request, and is superseded while it
+waits to be prepared; mark_preparing() checks both once more before the work
+starts. Once being prepared it is only superseded when a newer request of its
+session is ready, so a session always keeps a frame on its way to the model. It
+is not granted the model before mark_ready(); ready waiters behind it are served
+in the meantime.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class Dropped(Exception):
+    def __init__(self, reason: str, queued_s: float):
+        super().__init__(f"Request {reason} after {queued_s * 1000.0:.0f} ms in the queue")
+        self.reason = reason
+        self.queued_s = queued_s
+
+
+class _Waiter:
+    __slots__ = ("session_id", "deadline", "enqueued", "sequence", "future", "stage", "timer", "left")
+
+    def __init__(self, session_id, deadline, sequence, future, stage):
+        self.session_id = session_id
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.sequence = sequence
+        self.future = future
+        self.stage = stage  # "waiting" (to be prepared), "preparing" or "ready"
+        self.timer = None
+        self.left = False
+
+
+def _give_up(task: asyncio.Future, discard, cancel: bool):
+    if discard is not None:
+        task.add_done_callback(lambda t: t.cancelled() or t.exception() is not None or discard(t.result()))
+    if cancel:
+        task.cancel()
+
+
+async def until_dropped(waiter: _Waiter, awaitable, discard=None, cancel: bool = True):
+    """
+    Await awaitable unless the waiter is dropped first, then raise Dropped. When the
+    caller gives up (dropped or cancelled), awaitable is cancelled if cancel is set,
+    and a result that still arrives is passed to discard.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        await asyncio.wait((task, waiter.future), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        _give_up(task, discard, cancel)
+        raise
+    if task.done():
+        return task.result()
+    _give_up(task, discard, cancel)
+    return waiter.future.result()  # raises Dropped
+
+
+class GenerationScheduler:
+    def __init__(self, on_drop=None, on_start=None):
+        self.queue = deque()
+        self.sequence = itertools.count()
+        self.busy = False
+        self.on_drop = on_drop  # called with (reason, seconds queued)
+        self.on_start = on_start  # called with seconds queued
+        self.dropped = {"superseded": 0, "expired": 0}
+
+    def __len__(self):
+        return len(self.queue)
+
+    def oldest_age_s(self) -> float:
+        return time.monotonic() - self.queue[0].enqueued if self.queue else 0.0
+
+    def _drop(self, waiter: _Waiter, reason: str):
+        queued_s = time.monotonic() - waiter.enqueued
+        self.dropped[reason] += 1
+        if self.on_drop:
+            self.on_drop(reason, queued_s)
+        if not waiter.future.done():
+            waiter.future.set_exception(Dropped(reason, queued_s))
+
+    def _expire(self, waiter: _Waiter):
+        if waiter in self.queue and not waiter.future.done():
+            self.queue.remove(waiter)
+            self._drop(waiter, "expired")
+
+    def _dispatch(self):
+        """Hand the free slot to the next live ready waiter, dropping expired ones on the way."""
+        now = time.monotonic()
+        while not self.busy:
+            waiter = next((w for w in self.queue if w.stage == "ready" or w.future.done()), None)
+            if waiter is None:
+                break
+            self.queue.remove(waiter)
+            if waiter.future.done():  # cancelled while queued
+                continue
+            if waiter.deadline is not None and now > waiter.deadline:
+                self._drop(waiter, "expired")
+                continue
+            self.busy = True
+            if self.on_start:
+                self.on_start(now - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def _supersede(self, newer: _Waiter):
+        """
+        Drop the session's older waiters that newer replaces: those still waiting to be
+        prepared and, once newer is ready, ready ones. newer itself is dropped when it
+        becomes ready behind a newer ready request.
+        """
+        if newer.session_id is None:
+            return
+        for queued in list(self.queue):
+            if queued is newer or queued.session_id != newer.session_id or queued.future.done():
+                continue
+            if queued.sequence > newer.sequence:
+                if newer.stage == "ready" and queued.stage == "ready":
+                    self.queue.remove(newer)
+                    self._drop(newer, "superseded")
+                    return
+            elif queued.stage == "waiting" or (queued.stage == "ready" and newer.stage == "ready"):
+                self.queue.remove(queued)
+                self._drop(queued, "superseded")
+
+    def enqueue(self, session_id: str = None, deadline: float = None, ready: bool = True) -> _Waiter:
+        """
+        Join the queue, superseding the session's older requests (see _supersede);
+        deadline is a time.monotonic() value. A waiter that is not ready is not
+        granted the model until mark_ready(). Call wait() next, or abandon() to leave.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(session_id, deadline, next(self.sequence), loop.create_future(), "ready" if ready else "waiting")
+        self.queue.append(waiter)
+        self._supersede(waiter)
+        self._dispatch()
+        if deadline is not None and not waiter.future.done():
+            waiter.timer = loop.call_later(max(deadline - time.monotonic(), 0.0), self._expire, waiter)
+        return waiter
+
+    def mark_preparing(self, waiter: _Waiter):
+        """About to prepare the request: raises Dropped if it was superseded or has expired."""
+        if waiter.deadline is not None and time.monotonic() > waiter.deadline:
+            self._expire(waiter)
+        if waiter.future.done():
+            waiter.future.result()
+        waiter.stage = "preparing"
+
+    def mark_ready(self, waiter: _Waiter):
+        if waiter.future.done():
+            return  # dropped while being prepared; wait() raises Dropped
+        waiter.stage = "ready"
+        self._supersede(waiter)
+        self._dispatch()
+
+    async def wait(self, waiter: _Waiter):
+        """Wait for the model. Raises Dropped."""
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self.abandon(waiter)
+            raise
+        finally:
+            if waiter.timer is not None:
+                waiter.timer.cancel()
+
+    def abandon(self, waiter: _Waiter):
+        """Leave the queue before using the model (passing the slot on if it was just granted)."""
+        if waiter.left:
+            return
+        waiter.left = True
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+        if waiter in self.queue:
+            self.queue.remove(waiter)
+            waiter.future.cancel()
+            self._dispatch()  # waiters behind a request that was not ready may be due
+        elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+            self.release()
+
+    async def acquire(self, session_id: str = None, deadline: float = None):
+        """Wait for the model; deadline is a time.monotonic() value. Raises Dropped."""
+        await self.wait(self.enqueue(session_id, deadline))
+
+    def release(self):
+        self.busy = False
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str = None, deadline: float = None):
+        await self.acquire(session_id, deadline)
+        try:
+            yield
+        finally:
+            self.release()
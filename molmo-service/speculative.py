@@ -0,0 +1,249 @@
+"""Prompt-lookup speculative decoding.
+
+Answers follow one template, so most of an answer is text the model has just
+written for the previous frame. NgramDrafter matches the last few generated
+tokens against the prompt, the answer so far and a cache of recent answers
+(OutputCache) and proposes the tokens that followed the match there. generate()
+then scores all drafted tokens in one forward pass and keeps the prefix the model
+agrees with, so greedy output is unchanged and every accepted token saves a
+decode step.
+
+The drafter works on any hashable tokens and has no torch dependency. With
+transformers installed, NgramCandidateGenerator plugs it into generate()'s
+assisted decoding (see use_drafter):
+
+    python molmo-service/speculative.py                              # acceptance on templated answers
+    python molmo-service/speculative.py --model sshleifer/tiny-gpt2  # and greedy vs assisted on a small CPU model
+"""
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import torch
+    from transformers.generation.candidate_generator import CandidateGenerator
+except ImportError:
+    torch = None
+    CandidateGenerator = object
+
+MAX_NGRAM = 4
+NUM_DRAFT = 10
+
+
+class OutputCache:
+    """Token sequences of the most recent answers, newest last."""
+
+    def __init__(self, max_outputs: int = 16):
+        self.outputs = deque(maxlen=max_outputs)
+
+    def add(self, tokens):
+        if tokens:
+            self.outputs.append(tuple(tokens))
+
+    def __len__(self):
+        return len(self.outputs)
+
+
+class NgramDrafter:
+    """
+    Drafts continuations for one answer. The index maps every n-gram (1 to
+    max_ngram tokens) of the prompt and of the cached answers to the position
+    after its latest occurrence, so recent answers win over the prompt; the answer
+    being generated is indexed as it grows and only used when those have no match.
+    """
+
+    def __init__(self, prompt=(), cache: OutputCache = None, max_ngram: int = MAX_NGRAM, num_draft: int = NUM_DRAFT):
+        self.max_ngram = max_ngram
+        self.num_draft = num_draft
+        self.sources = [tuple(prompt)] + (list(cache.outputs) if cache else [])
+        self.index = {}
+        for source_id, tokens in enumerate(self.sources):
+            self._index(self.index, source_id, tokens, 0)
+        self.live = []
+        self.live_index = {}
+        self.drafted = 0
+        self.accepted = 0
+        self.steps = 0
+
+    def _index(self, index, source_id, tokens, start):
+        for end in range(max(start, 1), len(tokens) + 1):
+            for n in range(1, min(self.max_ngram, end) + 1):
+                index[tuple(tokens[end - n:end])] = (source_id, end)
+
+    def extend(self, tokens):
+        """Append newly generated tokens to the answer so far."""
+        start = len(self.live)
+        self.live.extend(tokens)
+        self._index(self.live_index, -1, self.live, start)
+
+    def draft(self, limit: int = None) -> list:
+        """Tokens likely to follow the answer so far (longest matching n-gram wins)."""
+        limit = self.num_draft if limit is None else min(limit, self.num_draft)
+        if not self.live or limit <= 0:
+            return []
+        for n in range(min(self.max_ngram, len(self.live)), 0, -1):
+            key = tuple(self.live[-n:])
+            for index in (self.index, self.live_index):
+                hit = index.get(key)
+                if hit is None:
+                    continue
+                source_id, end = hit
+                tokens = self.live if source_id == -1 else self.sources[source_id]
+                proposal = list(tokens[end:end + limit])
+                if proposal:
+                    return proposal
+        return []
+
+    def record(self, drafted: int, accepted: int):
+        self.steps += 1
+        self.drafted += drafted
+        self.accepted += accepted
+
+    def stats(self) -> dict:
+        return {
+            "draft_tokens": self.drafted,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 3) if self.drafted else None,
+            "verify_steps": self.steps,
+        }
+
+
+def simulate(drafter: NgramDrafter, tokens) -> int:
+    """
+    Replay a known answer through the drafter as greedy verification would and
+    return the number of forward passes needed (the first token comes from prefill).
+    """
+    tokens = list(tokens)
+    if not tokens:
+        return 0
+    drafter.extend(tokens[:1])
+    position, passes = 1, 0
+    while position < len(tokens):
+        proposal = drafter.draft(len(tokens) - position)
+        accepted = 0
+        while accepted < len(proposal) and proposal[accepted] == tokens[position + accepted]:
+            accepted += 1
+        if proposal:
+            drafter.record(len(proposal), accepted)
+        # The verify pass also yields the model's own next token after the accepted prefix
+        step = tokens[position:position + accepted + 1]
+        drafter.extend(step)
+        position += len(step)
+        passes += 1
+    return passes
+
+
+class NgramCandidateGenerator(CandidateGenerator):
+    """Feeds NgramDrafter drafts to generate()'s assisted decoding (batch size 1)."""
+
+    def __init__(self, drafter: NgramDrafter, prompt_length: int, max_length: int):
+        self.drafter = drafter
+        self.prompt_length = prompt_length
+        self.max_length = max_length
+        self.last_draft = 0
+
+    def get_candidates(self, input_ids):
+        generated = input_ids[0, self.prompt_length + len(self.drafter.live):].tolist()
+        self.drafter.extend(generated)
+        proposal = self.drafter.draft(self.max_length - input_ids.size(1) - 1)
+        self.last_draft = len(proposal)
+        if not proposal:
+            return input_ids, None
+        draft = torch.tensor([proposal], dtype=input_ids.dtype, device=input_ids.device)
+        return torch.cat([input_ids, draft], dim=1), None
+
+    def update_candidate_strategy(self, input_ids, scores, num_matches):
+        if self.last_draft:
+            self.drafter.record(self.last_draft, int(num_matches))
+
+
+@contextmanager
+def use_drafter(model, generator: NgramCandidateGenerator):
+    """
+    Make generate(prompt_lookup_num_tokens=...) on this model take its drafts from
+    generator instead of transformers' own prompt lookup, which only searches the prompt.
+    """
+    model._get_candidate_generator = lambda *args, **kwargs: generator
+    try:
+        yield
+    finally:
+        del model._get_candidate_generator
+
+
+if __name__ == "__main__":
+    import argparse
+    import re
+    import sys
+    import time
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from stub_backend import TOKEN_REGEX, stub_answer
+
+    parser = argparse.ArgumentParser(description="Prompt-lookup drafting: acceptance and speed-up.")
+    parser.add_argument("--answers", type=int, default=200, help="Templated answers replayed through the drafter")
+    parser.add_argument("--model", help="Also time greedy against assisted generate on this (small) causal LM")
+    parser.add_argument("--new-tokens", type=int, default=96)
+    args = parser.parse_args()
+
+    prompt = "Point to the blue soldier and determine the action to be taken by the camera to align the centre of the image with it."
+    prompt_tokens = TOKEN_REGEX.findall(prompt)
+    print(f"{'source':<22}{'acceptance':>11}{'tokens':>8}{'passes':>8}{'speed-up':>10}{'draft ms':>10}")
+    for label, cache_size in (("prompt only", 0), ("prompt + 1 answer", 1), ("prompt + 16 answers", 16)):
+        cache = OutputCache(max(cache_size, 1))
+        drafted = accepted = total_tokens = total_passes = 0
+        draft_seconds = 0.0
+        for seed in range(args.answers):
+            tokens = TOKEN_REGEX.findall(stub_answer(prompt, seed * 7919))
+            start = time.perf_counter()
+            drafter = NgramDrafter(prompt_tokens, cache if cache_size else None)
+            passes = simulate(drafter, tokens)
+            draft_seconds += time.perf_counter() - start
+            cache.add(tokens)
+            drafted, accepted = drafted + drafter.drafted, accepted + drafter.accepted
+            total_tokens, total_passes = total_tokens + len(tokens) - 1, total_passes + passes
+        print(f"{label:<22}{accepted / max(drafted, 1):>11.1%}{total_tokens / args.answers:>8.1f}"
+              f"{total_passes / args.answers:>8.1f}{total_tokens / total_passes:>9.2f}x"
+              f"{draft_seconds / args.answers * 1000:>10.3f}")
+
+    if args.model:
+        if torch is None:
+            raise SystemExit("--model needs torch and transformers")
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        lm = AutoModelForCausalLM.from_pretrained(args.model).eval()
+        # A prompt that repeats the template so even an untrained model continues it
+        answers = [stub_answer(prompt, seed) for seed in range(3)]
+        text = prompt + "\n" + "\n".join(answers) + "\n"
+        inputs = tokenizer(text, return_tensors="pt")
+        cache = OutputCache()
+        for answer in answers:
+            cache.add(tokenizer(answer)["input_ids"])
+        kwargs = {"max_new_tokens": args.new_tokens, "do_sample": False, "pad_token_id": tokenizer.eos_token_id}
+
+        def timed(fn, repeats=3):
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                out = fn()
+            return (time.perf_counter() - start) / repeats, out
+
+        with torch.inference_mode():
+            greedy_s, greedy = timed(lambda: lm.generate(**inputs, **kwargs))
+            results = {}
+            for label, with_cache in (("prompt lookup", False), ("prompt + answers", True)):
+                def assisted():
+                    drafter = NgramDrafter(inputs["input_ids"][0].tolist(), cache if with_cache else None)
+                    generator = NgramCandidateGenerator(drafter, inputs["input_ids"].size(1), inputs["input_ids"].size(1) + args.new_tokens)
+                    with use_drafter(lm, generator):
+                        out = lm.generate(**inputs, prompt_lookup_num_tokens=NUM_DRAFT, **kwargs)
+                    results[label] = drafter.stats()
+                    return out
+                results[label + " s"], out = timed(assisted)
+                assert torch.equal(out, greedy), f"{label}: assisted output differs from greedy"
+        n = greedy.size(1) - inputs["input_ids"].size(1)
+        print(f"\n{args.model}: {n} new tokens, greedy {greedy_s / n * 1000:.2f} ms/token")
+        for label in ("prompt lookup", "prompt + answers"):
+            seconds = results[label + " s"]
+            print(f"  {label:<18}{seconds / n * 1000:8.2f} ms/token  speed-up {greedy_s / seconds:5.2f}x  {results[label]}")
+        print(re.sub(r"\s+", " ", tokenizer.decode(greedy[0, inputs['input_ids'].size(1):]))[:120])
@@ -0,0 +1,189 @@
+"""CPU-only stand-in for the Molmo2 backend (MOLMO_BACKEND=stub).
+
+No weights are loaded. Answers follow the fine-tuned output template, with a point
+derived deterministically from the image content, and generation sleeps to emulate
+the accelerator (MOLMO_STUB_PREFILL_MS plus MOLMO_STUB_TOKEN_MS per token);
+preprocessing sleeps MOLMO_STUB_PREPROCESS_MS in place of the processor's CPU work.
+MOLMO_STUB_MALFORMED_RATE makes that share of answers malformed (no points, action
+inside a tag, wrong centre tag, short coordinates), as the real model's sometimes
+are. With a grammar the answer is walked through the template automaton
+(constrained.py) as masked decoding would: the stub's own text is kept while the
+grammar accepts it, and the canonical answer is followed from the first rejected
+character. With speculative, the answer is
+replayed through the prompt-lookup drafter (speculative.py) and decode sleeps once
+per verify pass instead of once per token. This lets
+the service, clients, benchmarks and analysis tools be exercised end to end anywhere.
+"""
+import os
+import re
+import time
+import resource
+import zlib
+from metrics import RequestTimings
+from speculative import NgramDrafter, OutputCache, simulate
+from constrained import TemplateAutomaton
+
+MODEL_NAME = "stub"
+INFERENCE_MODE = "eager"  # nothing to compile
+# No processor to size images for; MOLMO_DECODE_SIZE=WxH exercises reduced decoding
+DECODE_SIZE = tuple(int(v) for v in os.environ["MOLMO_DECODE_SIZE"].split("x")) if os.environ.get("MOLMO_DECODE_SIZE") else None
+DEFAULT_ADAPTER = "default"
+ADAPTERS = {DEFAULT_ADAPTER: "stub"}
+for entry in filter(None, os.environ.get("MOLMO_ADAPTERS", "").split(",")):
+    name, path = entry.split("=", 1)
+    ADAPTERS[name.strip()] = path.strip()
+
+PREFILL_MS = float(os.environ.get("MOLMO_STUB_PREFILL_MS", "50"))
+TOKEN_MS = float(os.environ.get("MOLMO_STUB_TOKEN_MS", "5"))
+PREPROCESS_MS = float(os.environ.get("MOLMO_STUB_PREPROCESS_MS", "30"))
+MALFORMED_RATE = float(os.environ.get("MOLMO_STUB_MALFORMED_RATE", "0"))
+TARGET_REGEX = re.compile(r"Point to the (.+?) and determine", re.IGNORECASE)
+# Rough stand-in for the tokenizer: words, numbers and punctuation
+TOKEN_REGEX = re.compile(r"\w+|[^\w\s]")
+output_caches = {}  # adapter -> OutputCache of recent answers
+automatons = {}  # grammar -> TemplateAutomaton
+
+
+def prepare_inputs(messages: list) -> dict:
+    """Extract the prompt and a content hash of the images instead of tensors."""
+    content = messages[0]["content"]
+    prompt = next(item["text"] for item in content if item["type"] == "text")
+    images = [item["image"] for item in content if item["type"] == "image"]
+    # Hash a thumbnail so the answer depends on the frame without hashing every pixel
+    seed = 0
+    for image in images:
+        seed = zlib.crc32(image.resize((32, 20)).tobytes(), seed)
+    time.sleep(PREPROCESS_MS / 1000.0)
+    return {"prompt": prompt, "seed": seed, "image_sizes": [image.size for image in images]}
+
+
+def stub_answer(prompt: str, seed: int, may_malform: bool = False) -> str:
+    match = TARGET_REGEX.search(prompt)
+    label = match.group(1) if match else "target"
+    x = 100 + seed % 800
+    y = 100 + (seed // 800) % 800
+    if may_malform and (seed % 997) / 997 < MALFORMED_RATE:
+        return [
+            f"The {label} is in the image. The action to be taken is therefore ({500 - x}, {500 - y})",
+            f'The {label} in the image is at <points coords="1 1 {x:03d} {y:03d}">{label}</points> '
+            f'while the centre of the image is at <points coords="1 1 500 500">centre of image ({500 - x}, {500 - y})</points>.',
+            f'The {label} in the image is at <points coords="1 1 {x:03d} {y:03d}">{label}</points> '
+            f'while the centre of the image is at <points coords="1 1 500 480">center of image</points>. '
+            f'The action to be taken is therefore ({500 - x}, {480 - y})',
+            f'The {label} in the image is at <points coords="1 1 {x // 10} {y:03d}">{label}</points> '
+            f'while the centre of the image is at <points coords="1 1 500 500">centre of image</points>. '
+            f'The action to be taken is therefore ({500 - x}, {500 - y})',
+        ][seed % 4]
+    return (
+        f'The {label} in the image is at <points coords="1 1 {x:03d} {y:03d}">{label}</points> '
+        f'while the centre of the image is at <points coords="1 1 500 500">centre of image</points>. '
+        f'The action to be taken is therefore ({500 - x}, {500 - y})'
+    )
+
+
+def constrained_answer(text: str, fallback: str, grammar: tuple) -> str:
+    """
+    text as masked decoding would let it out: characters the grammar rejects are
+    replaced by fallback's from that position on, until the grammar may end.
+    """
+    automaton = automatons.get(grammar)
+    if automaton is None:
+        automaton = automatons[grammar] = TemplateAutomaton(grammar)
+    state, out, source = automaton.initial, [], text
+    while True:
+        i = len(out)
+        candidates = [c for c in (source[i:i + 1], fallback[i:i + 1], (automaton.literal_remainder(state) or "")[:1]) if c]
+        for ch in candidates:
+            following = automaton.step(state, ch)
+            if following:
+                break
+        else:
+            return "".join(out)  # nothing allowed fits: end, as EOS would be allowed or forced
+        if ch != source[i:i + 1]:
+            source = fallback  # the model's text was masked away; continue like the template
+        state = following
+        out.append(ch)
+        if automaton.can_end(state) and not source[i + 1:]:
+            return "".join(out)
+
+
+def generate_text(inputs: dict, adapter: str, timings: RequestTimings, grammar: tuple | None = None,
+                  speculative: bool = False, cancel=None) -> str:
+    """Emulate prefill and token-by-token decode with sleeps; a set cancel event stops at the next step."""
+    text = stub_answer(inputs["prompt"], inputs["seed"], may_malform=True)
+    if grammar is not None:
+        text = constrained_answer(text, stub_answer(inputs["prompt"], inputs["seed"]), grammar)
+    tokens = TOKEN_REGEX.findall(text)
+    n_tokens = len(tokens)
+    drafter = None
+    steps = n_tokens - 1
+    if speculative:
+        cache = output_caches.setdefault(adapter, OutputCache())
+        drafter = NgramDrafter(TOKEN_REGEX.findall(inputs["prompt"]), cache)
+        steps = simulate(drafter, tokens)
+        cache.add(tokens)
+
+    start = time.perf_counter()
+    time.sleep(PREFILL_MS / 1000.0)
+    first_token_time = time.perf_counter()
+    done = 0
+    while done < steps and not (cancel is not None and cancel.is_set()):
+        time.sleep(TOKEN_MS / 1000.0)
+        done += 1
+    end = time.perf_counter()
+    if done < steps:
+        # Cancelled: keep the tokens emitted so far
+        n_tokens = 1 + (n_tokens - 1) * done // steps
+        text = text[:list(TOKEN_REGEX.finditer(text))[n_tokens - 1].end()]
+    timings.record("prefill", start, first_token_time)
+    timings.record("decode", first_token_time, end)
+
+    decode_seconds = end - first_token_time
+    timings.values.update({
+        "prompt_tokens": len(TOKEN_REGEX.findall(inputs["prompt"])),
+        "vision_tokens": None,
+        "generated_tokens": n_tokens,
+        "tokens_per_s": round((n_tokens - 1) / decode_seconds, 2) if decode_seconds > 0 else None,
+        "device": "cpu",
+        "constrained": grammar is not None,
+        "speculative": speculative,
+        "inference_mode": INFERENCE_MODE,
+        "cancelled": done < steps,
+        **(drafter.stats() if drafter else {}),
+        "peak_memory_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+    return text
+
+
+def prepare_batch(messages_batch: list) -> list:
+    return [prepare_inputs(messages) for messages in messages_batch]
+
+
+def generate_batch(inputs: list, adapter: str, timings: RequestTimings, grammars: list | None = None,
+                   cancels: list | None = None) -> list[str]:
+    """
+    Emulate a batched generate: one prefill, then steps until every row has finished
+    its answer or been cancelled (cancelled rows return an empty answer).
+    """
+    grammars = grammars or [None] * len(inputs)
+    cancels = cancels or [None] * len(inputs)
+    texts = [
+        constrained_answer(stub_answer(item["prompt"], item["seed"], may_malform=True), stub_answer(item["prompt"], item["seed"]), grammar)
+        if grammar is not None else stub_answer(item["prompt"], item["seed"], may_malform=True)
+        for item, grammar in zip(inputs, grammars)
+    ]
+    lengths = [len(TOKEN_REGEX.findall(text)) for text in texts]
+    with timings.stage("generate"):
+        time.sleep(PREFILL_MS / 1000.0)
+        step = 1
+        while any(length > step and not (cancel is not None and cancel.is_set()) for length, cancel in zip(lengths, cancels)):
+            time.sleep(TOKEN_MS / 1000.0)
+            step += 1
+    return ["" if cancel is not None and cancel.is_set() else text for text, cancel in zip(texts, cancels)]
+
+
+def discard_inputs(inputs: dict):
+    pass  # nothing pooled
+
+def memory_stats() -> dict:
+    return {}  # no accelerator buffers to pool
@@ -1,23 +1,300 @@
-import requests
+"""Drive many agent sessions concurrently against one Molmo service.
 
-# Health check
-response = requests.get("http://localhost:8001/health")
-print(response.json())
+Each session runs its own loop from a single asyncio controller:
+  - "client" sessions call /run_iteration on an FPS agent client (capture, analyze, actuate)
+  - "replay" sessions send frames from a directory straight to the service's /analyze
 
-# Get agent status
-response = requests.get("http://localhost:8001/status")
-print(response.json())
-"""
-# Run single iteration
-response = requests.post(
-    "http://localhost:8001/run_iteration",
-    data={"prompt": "Center the crosshair on the nearest enemy. Be brief."}
-)
-print(response.json())
+Sessions have their own target, prompt, adapter and rate limit. All sessions pause
+while the service queue depth (reported by its /health endpoint) is at or above
+--max-queue-depth, and a live report of iterations/s and latency percentiles is
+printed every --report-interval seconds.
+
+Usage:
+    python orchestrator/orchestrator.py                          # one client session on :8001
+    python orchestrator/orchestrator.py --sessions sessions.json --duration 600 --report report.json
+
+sessions.json is a list of objects with the SessionConfig fields, e.g.
+    [{"name": "yamato", "mode": "replay", "target": "Battleship Yamato",
+      "frames_dir": "vla_evaluation", "adapter": "default", "max_rate_hz": 2}]
 """
-# Infinite loop (iterations=0)
-response = requests.post(
-    "http://localhost:8001/start_loop",
-    data={"iterations": 100, "delay_ms": 3000}
-)
-print(response.json())
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.stats import summarize
+
+# Configuration
+MOLMO_SERVER_URL = "http://localhost:8000"
+CLIENT_URL = "http://localhost:8001"
+REPORT_INTERVAL_S = 5.0
+MAX_QUEUE_DEPTH = 4
+QUEUE_POLL_INTERVAL_S = 0.5
+LATENCY_WINDOW = 1000
+FRAME_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+
+def default_prompt(target: str) -> str:
+    return f"Point to the {target} and determine the action to be taken by the camera to align the centre of the image with it."
+
+
+@dataclass
+class SessionConfig:
+    name: str
+    mode: str = "client"            # "client" or "replay"
+    url: str | None = None          # FPS agent client for "client", Molmo service for "replay"
+    target: str = "blue soldier"
+    prompt: str | None = None       # defaults to the standard pointing prompt for target
+    adapter: str | None = None      # LoRA adapter name registered in the service
+    frames_dir: str | None = None   # frames replayed by "replay" sessions
+    iterations: int = 0             # 0 = run until --duration elapses or interrupted
+    max_rate_hz: float = 0.0        # 0 = unthrottled
+
+    def __post_init__(self):
+        if self.mode not in ("client", "replay"):
+            raise ValueError(f"Session {self.name}: unknown mode '{self.mode}'")
+        if self.mode == "replay" and not self.frames_dir:
+            raise ValueError(f"Session {self.name}: replay sessions need frames_dir")
+        if self.url is None:
+            self.url = CLIENT_URL if self.mode == "client" else MOLMO_SERVER_URL
+        if self.prompt is None:
+            self.prompt = default_prompt(self.target)
+
+
+@dataclass
+class SessionStats:
+    completed: int = 0
+    errors: int = 0
+    latencies_ms: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    finish_times: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def record(self, latency_ms: float, ok: bool):
+        if ok:
+            self.completed += 1
+            self.latencies_ms.append(latency_ms)
+            self.finish_times.append(time.monotonic())
+        else:
+            self.errors += 1
+
+    def rate(self, window_s: float) -> float:
+        """Iterations per second over the last window_s seconds."""
+        cutoff = time.monotonic() - window_s
+        return sum(1 for t in self.finish_times if t >= cutoff) / window_s
+
+
+class QueueMonitor:
+    """Polls the service queue depth and blocks sessions while it is too deep."""
+
+    def __init__(self, service_url: str, max_depth: int):
+        self.service_url = service_url
+        self.max_depth = max_depth
+        self.depth = None
+        self.capacity = asyncio.Event()
+        self.capacity.set()
+
+    async def run(self, client: httpx.AsyncClient):
+        while True:
+            try:
+                response = await client.get(f"{self.service_url}/health", timeout=5.0)
+                self.depth = response.json().get("queue_depth")
+            except (httpx.HTTPError, ValueError):
+                # Never stall the campaign because the health check is unavailable
+                self.depth = None
+            if self.depth is not None and self.max_depth > 0 and self.depth >= self.max_depth:
+                self.capacity.clear()
+            else:
+                self.capacity.set()
+            await asyncio.sleep(QUEUE_POLL_INTERVAL_S)
+
+    async def wait_for_capacity(self):
+        await self.capacity.wait()
+
+
+class AgentSession:
+    def __init__(self, config: SessionConfig, monitor: QueueMonitor):
+        self.config = config
+        self.monitor = monitor
+        self.stats = SessionStats()
+        self.frames = []
+        if config.mode == "replay":
+            self.frames = sorted(
+                p for p in Path(config.frames_dir).iterdir()
+                if p.suffix.lower() in FRAME_EXTENSIONS
+            )
+            if not self.frames:
+                raise ValueError(f"Session {config.name}: no frames found in {config.frames_dir}")
+
+    async def run(self, client: httpx.AsyncClient):
+        interval = 1.0 / self.config.max_rate_hz if self.config.max_rate_hz > 0 else 0.0
+        next_start = time.monotonic()
+        iteration = 0
+        while self.config.iterations == 0 or iteration < self.config.iterations:
+            # Per-session rate limit
+            delay = next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Global backpressure on the service queue
+            await self.monitor.wait_for_capacity()
+            next_start = time.monotonic() + interval
+
+            start = time.perf_counter()
+            try:
+                if self.config.mode == "client":
+                    ok = await self.run_client_iteration(client)
+                else:
+                    ok = await self.run_replay_iteration(client, iteration)
+            except (httpx.HTTPError, ValueError) as e:
+                # ValueError covers a malformed JSON body or NDJSON line: one failed iteration
+                print(f"[{self.config.name}] iteration {iteration} failed: {e}")
+                ok = False
+            self.stats.record((time.perf_counter() - start) * 1000.0, ok)
+            iteration += 1
+
+    async def run_client_iteration(self, client: httpx.AsyncClient) -> bool:
+        params = {"prompt": self.config.prompt}
+        if self.config.adapter:
+            params["adapter"] = self.config.adapter
+        response = await client.post(f"{self.config.url}/run_iteration", params=params)
+        return response.status_code == 200 and response.json().get("status") == "success"
+
+    async def run_replay_iteration(self, client: httpx.AsyncClient, iteration: int) -> bool:
+        frame = self.frames[iteration % len(self.frames)]
+        content_type = "image/jpeg" if frame.suffix.lower() in (".jpg", ".jpeg") else "image/png"
+        files = {"file": (frame.name, frame.read_bytes(), content_type)}
+        data = {"prompt": self.config.prompt}
+        if self.config.adapter:
+            data["adapter"] = self.config.adapter
+
+        ok = False
+        async with client.stream("POST", f"{self.config.url}/analyze", files=files, data=data) as response:
+            if response.status_code != 200:
+                return False
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                status = json.loads(line).get("status")
+                if status == "error":
+                    return False
+                if status == "complete":
+                    ok = True
+        return ok
+
+
+def build_report(sessions: list[AgentSession], elapsed_s: float, window_s: float) -> dict:
+    report = {"elapsed_s": round(elapsed_s, 1), "sessions": {}}
+    all_latencies = []
+    for session in sessions:
+        stats = session.stats
+        all_latencies.extend(stats.latencies_ms)
+        report["sessions"][session.config.name] = {
+            "completed": stats.completed,
+            "errors": stats.errors,
+            "iterations_per_s": stats.rate(window_s),
+            "latency_ms": summarize(stats.latencies_ms),
+        }
+    report["total"] = {
+        "completed": sum(s.stats.completed for s in sessions),
+        "errors": sum(s.stats.errors for s in sessions),
+        "iterations_per_s": sum(s.stats.rate(window_s) for s in sessions),
+        "latency_ms": summarize(all_latencies),
+    }
+    return report
+
+
+def format_ms(value) -> str:
+    return f"{value:8.0f}" if value is not None else f"{'-':>8}"
+
+
+def print_report(report: dict, queue_depth):
+    print(f"\n[{report['elapsed_s']:.0f}s] service queue depth: {queue_depth if queue_depth is not None else '?'}")
+    print(f"{'session':<20}{'done':>8}{'err':>6}{'it/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    rows = list(report["sessions"].items()) + [("TOTAL", report["total"])]
+    for name, row in rows:
+        latency = row["latency_ms"]
+        print(
+            f"{name:<20}{row['completed']:>8}{row['errors']:>6}{row['iterations_per_s']:>8.2f}"
+            f" {format_ms(latency['p50'])} {format_ms(latency['p90'])} {format_ms(latency['p99'])}"
+        )
+
+
+async def run_campaign(sessions: list[AgentSession], monitor: QueueMonitor,
+                       duration_s: float, report_interval_s: float) -> dict:
+    start = time.monotonic()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_interval_s)
+            print_report(build_report(sessions, time.monotonic() - start, report_interval_s), monitor.depth)
+
+    # Client iterations include actuation and settle time, so allow long requests
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        background = [asyncio.create_task(monitor.run(client)), asyncio.create_task(reporter())]
+        workers = [asyncio.create_task(session.run(client)) for session in sessions]
+        try:
+            await asyncio.wait_for(asyncio.gather(*workers), timeout=duration_s or None)
+        except asyncio.TimeoutError:
+            print(f"\nDuration of {duration_s}s reached, stopping sessions")
+        except asyncio.CancelledError:
+            print("\nInterrupted, stopping sessions")
+        finally:
+            for task in workers + background:
+                task.cancel()
+            await asyncio.gather(*workers, *background, return_exceptions=True)
+
+    elapsed = time.monotonic() - start
+    report = build_report(sessions, elapsed, elapsed)
+    print_report(report, monitor.depth)
+    return report
+
+
+def load_sessions(path: str | None) -> list[SessionConfig]:
+    if path is None:
+        return [SessionConfig(name="agent", iterations=100)]
+    allowed = {f.name for f in fields(SessionConfig)}
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    configs = []
+    for entry in entries:
+        unknown = set(entry) - allowed
+        if unknown:
+            raise ValueError(f"Unknown session fields {sorted(unknown)} in {path}")
+        configs.append(SessionConfig(**entry))
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many agent sessions concurrently against the Molmo service.")
+    parser.add_argument("--sessions", help="JSON file with a list of session configs (default: one client session)")
+    parser.add_argument("--service-url", default=MOLMO_SERVER_URL, help="Molmo service polled for queue depth")
+    parser.add_argument("--max-queue-depth", type=int, default=MAX_QUEUE_DEPTH,
+                        help="Pause all sessions while the service queue is this deep (0 disables)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Stop after this many seconds (0 = no limit)")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL_S)
+    parser.add_argument("--report", help="Write the final aggregated report to this JSON file")
+    args = parser.parse_args()
+
+    monitor = QueueMonitor(args.service_url, args.max_queue_depth)
+    sessions = [AgentSession(config, monitor) for config in load_sessions(args.sessions)]
+    start = time.monotonic()
+    try:
+        report = asyncio.run(run_campaign(sessions, monitor, args.duration, args.report_interval))
+    except KeyboardInterrupt:
+        # Interrupted before the campaign could report: report what was recorded so far
+        elapsed = time.monotonic() - start
+        report = build_report(sessions, elapsed, elapsed)
+        print_report(report, monitor.depth)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
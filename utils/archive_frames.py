@@ -0,0 +1,117 @@
+"""Pack screenshot folders into a deduplicated frame archive and read from it.
+
+    python utils/archive_frames.py import vla_evaluation vla_evaluation.frames --codec webp-lossless
+    python utils/archive_frames.py info vla_evaluation.frames
+    python utils/archive_frames.py extract vla_evaluation.frames 20260301-101500-ab12cd/before_0042.png out.png
+    python utils/archive_frames.py bench vla_evaluation vla_evaluation.frames --reads 200
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.frame_archive import CODECS, FrameArchive, import_png_dir
+
+
+def cmd_import(args):
+    start = time.perf_counter()
+    result = import_png_dir(args.frames_dir, args.archive, args.codec, args.quality, args.workers)
+    elapsed = time.perf_counter() - start
+    archive = FrameArchive(args.archive)
+    stats = archive.stats()
+    print(
+        f"Imported {result['files']} files ({result['source_bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s: "
+        f"{result['new_images']} new images, {result['deduplicated']} duplicates"
+    )
+    print(f"Archive: {stats['frames']} frames, {stats['unique_images']} images, {stats['stored_bytes'] / 1e6:.1f} MB")
+
+
+def cmd_info(args):
+    archive = FrameArchive(args.archive)
+    for key, value in archive.stats().items():
+        print(f"{key:<14}{value}")
+    for run in archive.runs:
+        print(f"  run {run or '(top level)'}")
+
+
+def cmd_extract(args):
+    archive = FrameArchive(args.archive)
+    archive.read_name(args.name).save(args.out)
+    print(f"Wrote {args.out}")
+
+
+def cmd_bench(args):
+    """Random-access reads of the same frames from the PNG folder and from the archive."""
+    frames_dir = Path(args.frames_dir)
+    archive = FrameArchive(args.archive)
+    rng = random.Random(0)
+    names = [name for name in archive.names if (frames_dir / name).exists()]
+    if not names:
+        raise SystemExit(f"No frames of {args.archive} found under {frames_dir}")
+    sample = [rng.choice(names) for _ in range(args.reads)]
+    rows = [archive.row_of_name(name) for name in sample]
+
+    def png_bytes():
+        return sum(len((frames_dir / name).read_bytes()) for name in sample)
+
+    def archive_bytes():
+        return sum(len(bytes(archive.read_bytes(row))) for row in rows)
+
+    def png_decode():
+        for name in sample:
+            with Image.open(frames_dir / name) as image:
+                image.load()
+
+    def archive_decode():
+        for row in rows:
+            archive.read_row(row)
+
+    print(f"{len(sample)} random reads of {len(names)} frames ({archive.stats()['codec']} archive)")
+    for label, fn in (("PNG files, bytes", png_bytes), ("archive, bytes", archive_bytes),
+                      ("PNG files, decoded", png_decode), ("archive, decoded", archive_decode)):
+        fn()  # warm the page cache so both sides read from memory
+        start = time.perf_counter()
+        total = fn()
+        elapsed = time.perf_counter() - start
+        throughput = f"{total / elapsed / 1e6:8.1f} MB/s" if total else ""
+        print(f"{label:<20}{len(sample) / elapsed:10.1f} frames/s {throughput}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicated archive of evaluation screenshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = sub.add_parser("import", help="Add a folder of before_/after_ PNGs to an archive")
+    import_parser.add_argument("frames_dir")
+    import_parser.add_argument("archive")
+    import_parser.add_argument("--codec", choices=CODECS, default="png", help="png keeps the original files' bytes")
+    import_parser.add_argument("--quality", type=int, default=90, help="Quality of the lossy codecs")
+    import_parser.add_argument("--workers", type=int, default=4, help="Decode, hash and encode threads")
+    import_parser.set_defaults(func=cmd_import)
+
+    info = sub.add_parser("info", help="Frame, image and run counts")
+    info.add_argument("archive")
+    info.set_defaults(func=cmd_info)
+
+    extract = sub.add_parser("extract", help="Write one frame out as an image file")
+    extract.add_argument("archive")
+    extract.add_argument("name", help="Frame name as saved, e.g. run_id/before_0001.png")
+    extract.add_argument("out")
+    extract.set_defaults(func=cmd_extract)
+
+    bench = sub.add_parser("bench", help="Read throughput of the archive against the PNG folder")
+    bench.add_argument("frames_dir")
+    bench.add_argument("archive")
+    bench.add_argument("--reads", type=int, default=200)
+    bench.set_defaults(func=cmd_bench)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
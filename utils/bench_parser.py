@@ -0,0 +1,213 @@
+"""Equivalence check and micro-benchmark for common/molmo_parsing.py.
+
+The legacy parsers below are frozen copies of the functions the shared parser
+replaced (app.parse_molmo_output, extract_multi_image_points from utils/test.py
+and plot_points_screenshots.py, list_distance_drift.py and the string checks in
+list_no_points.py, list_no_actions.py and list_wrong_centres.py). Every synthetic
+output is parsed both ways, whole and streamed in random chunks, and must agree.
+
+    python utils/bench_parser.py --records 200000
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from math import sqrt
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import StreamingParser, parse, parse_commands
+
+IMAGE_W, IMAGE_H = 1920, 1200
+
+# ------------- legacy parsers -------------
+
+COORD_REGEX = re.compile(rf"<(?:points|tracks).*? coords=\"([0-9\t:;, .]+)\"/?>")
+FRAME_REGEX = re.compile(rf"(?:^|\t|:|,|;)([0-9\.]+) ([0-9\. ]+)")
+POINTS_REGEX = re.compile(r"([0-9]+) ([0-9]{3,4}) ([0-9]{3,4})")
+POINTS_HTML_REGEX = re.compile(r'<points[^>]*coords="([^"]+)"[^>]*>(.*?)</points>', re.IGNORECASE | re.DOTALL)
+ACTION_REGEX = re.compile(r"The action to be taken is therefore\s*\(\s*([+-]?\d+)\s*,\s*([+-]?\d+)\s*\)")
+
+
+def legacy_commands(text):
+    commands = {"up": 0, "down": 0, "left": 0, "right": 0, "exit": 0}
+    text_lower = text.lower()
+    if "exit" in text_lower and text_lower.strip() == "exit":
+        commands["exit"] = 1
+        return commands
+    action_match = re.search(r'\((-?\d+)\s*,\s*(-?\d+)\)', text)
+    if action_match:
+        dx, dy = int(action_match.group(1)), int(action_match.group(2))
+        if dx > 0:
+            commands["left"] = abs(dx)
+        elif dx < 0:
+            commands["right"] = abs(dx)
+        if dy > 0:
+            commands["up"] = abs(dy)
+        elif dy < 0:
+            commands["down"] = abs(dy)
+    return commands
+
+
+def legacy_points(text, image_w, image_h):
+    all_points = []
+    for coord in COORD_REGEX.finditer(text):
+        for point_grp in FRAME_REGEX.finditer(coord.group(1)):
+            frame_id = float(point_grp.group(1))
+            for points in POINTS_REGEX.finditer(point_grp.group(2)):
+                x, y = float(points.group(2)) / 1000 * image_w, float(points.group(3)) / 1000 * image_h
+                if 0 <= x <= image_w and 0 <= y <= image_h:
+                    all_points.append((frame_id, int(x), int(y)))
+    return all_points
+
+
+def legacy_drift(text, tol_px):
+    obj_point = centre_point = None
+    for coords_str, inner_text in POINTS_HTML_REGEX.findall(text):
+        nums = [int(n) for n in re.findall(r"[+-]?\d+", coords_str)]
+        if len(nums) < 2:
+            continue
+        if "centre of image" in inner_text.lower():
+            centre_point = (nums[-2], nums[-1])
+        elif obj_point is None:
+            obj_point = (nums[-2], nums[-1])
+    m = ACTION_REGEX.search(text)
+    action = (int(m.group(1)), int(m.group(2))) if m else None
+    result = {"obj_point": obj_point, "centre_point": centre_point, "action": action,
+              "diff_vec": None, "diff_norm": None, "is_consistent": False}
+    if obj_point and centre_point and action:
+        diff_x = (centre_point[0] - obj_point[0]) - action[0]
+        diff_y = (centre_point[1] - obj_point[1]) - action[1]
+        result["diff_vec"] = (diff_x, diff_y)
+        result["diff_norm"] = sqrt(diff_x ** 2 + diff_y ** 2)
+        result["is_consistent"] = result["diff_norm"] <= tol_px
+    return result
+
+
+def legacy_all(text):
+    return {
+        "commands": legacy_commands(text),
+        "points": legacy_points(text, IMAGE_W, IMAGE_H),
+        "drift": legacy_drift(text, 10),
+        "has_points": "<points" in text,
+        "has_action": ACTION_REGEX.search(text) is not None,
+        "has_centre": '<points coords="1 1 500 500">centre of image</points>' in text,
+    }
+
+
+def shared_all(parsed):
+    return {
+        "commands": parsed.commands(),
+        "points": parsed.pixel_points(IMAGE_W, IMAGE_H),
+        "drift": parsed.drift(10),
+        "has_points": parsed.has_points,
+        "has_action": parsed.template_action is not None,
+        "has_centre": parsed.has_centre,
+    }
+
+
+# ------------- synthetic corpus -------------
+
+LABELS = ["blue soldier", "closest person", "red tank", "man"]
+
+
+def synthetic_output(rng):
+    """A model output in the fine-tuned template, with the failure modes seen in runs."""
+    label = rng.choice(LABELS)
+    x, y = rng.randint(0, 999), rng.randint(0, 999)
+    dx, dy = 500 - x + rng.choice([0, 0, 0, 3, -40]), 500 - y
+    obj = f'<points coords="1 1 {x:03d} {y:03d}">{label}</points>'
+    if rng.random() < 0.1:
+        obj = f'<points coords="1 1 {x:03d} {y:03d};2 1 {rng.randint(100, 999)} {rng.randint(100, 999)}">{label}</points>'
+    centre = rng.choice([
+        '<points coords="1 1 500 500">centre of image</points>',
+        '<points coords="1 1 500 500">centre of image</points>',
+        '<points coords="1 1 512 488">Centre of Image</points>',
+        "the middle",
+    ])
+    action = rng.choice([
+        f"The action to be taken is therefore ({dx}, {dy})",
+        f"The action to be taken is therefore ({dx}, {dy})",
+        f"The action to be taken is therefore ( {dx}, {dy} )",
+        f"The action to be taken is therefore (+{abs(dx)}, {dy})",
+        f"move by ({dx},{dy})",
+        "",
+    ])
+    kind = rng.random()
+    if kind < 0.02:
+        return rng.choice(["exit", " EXIT\n", "exit now"])
+    if kind < 0.07:
+        return f"The {label} is not visible. {action}"
+    if kind < 0.1:
+        return f"The {label} is at <tracks coords=\"1 1 {x:03d} {y:03d}\">{label}</tracks>. {action}"
+    if kind < 0.14:
+        # The action (or another tuple) written inside the tag, before or instead of the sentence
+        inside = rng.choice([action, f"{label} ({dx}, {dy})", f"{label} ( {dx}, {dy} )"])
+        after = rng.choice(["", f" then ({dy}, {dx})", f". {action}"])
+        return f"The {label} is at <points coords=\"1 1 {x:03d} {y:03d}\">{inside}</points>{after}"
+    return f"The {label} in the image is at {obj} while the centre of the image is at {centre}. {action}"
+
+
+def chunks(text, rng):
+    pos = 0
+    while pos < len(text):
+        step = rng.randint(1, 6)
+        yield text[pos:pos + step]
+        pos += step
+
+
+def check_equivalence(corpus, seed=0):
+    rng = random.Random(seed)
+    mismatches = 0
+    for text in corpus:
+        expected = legacy_all(text)
+        streaming = StreamingParser()
+        for chunk in chunks(text, rng):
+            streaming.feed(chunk)
+        if parse_commands(text) != expected["commands"]:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH (parse_commands) {text!r}: {expected['commands']} != {parse_commands(text)}")
+        for how, parsed in (("parse", parse(text)), ("stream", streaming.close())):
+            got = shared_all(parsed)
+            if got != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    diff = {k: (expected[k], got[k]) for k in expected if expected[k] != got[k]}
+                    print(f"MISMATCH ({how}) {text!r}: {diff}")
+    return mismatches
+
+
+def bench(label, fn, corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        fn(text)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34}{elapsed / len(corpus) * 1e6:8.2f} us/output  {len(corpus) / elapsed:12.0f} outputs/s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the shared Molmo output parser.")
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--check", type=int, default=20_000, help="Outputs checked for equivalence")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [synthetic_output(rng) for _ in range(args.records)]
+
+    mismatches = check_equivalence(corpus[:args.check], args.seed)
+    print(f"equivalence: {min(args.check, len(corpus))} outputs, {mismatches} mismatches")
+
+    legacy = bench("legacy (all analyses)", legacy_all, corpus)
+    shared = bench("shared parse + all analyses", lambda text: shared_all(parse(text)), corpus)
+    bench("shared parse only", parse, corpus)
+    legacy_service = bench("legacy service commands", legacy_commands, corpus)
+    bench("shared parse + commands", lambda text: parse(text).commands(), corpus)
+    service = bench("parse_commands (service path)", parse_commands, corpus)
+    # The shared parser consolidates the analyses; it is not meant to be faster than
+    # the regexes it replaced, so report both ratios rather than one "speedup"
+    print(f"time relative to legacy (lower is faster): all analyses {shared / legacy:.2f}x, service commands {service / legacy_service:.2f}x")
+    sys.exit(1 if mismatches else 0)
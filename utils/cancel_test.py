@@ -0,0 +1,139 @@
+"""Check that cancelled requests stop using the model, against the stub backend.
+
+Starts the service with MOLMO_BACKEND=stub and slow decoding, then for a client
+that disconnects mid-generate and for an explicit /cancel:
+  - the request after it must get the model right away instead of waiting for
+    the abandoned generate to finish;
+  - the decode time the service spent on the cancelled request must stop short
+    of a full answer.
+
+    python utils/cancel_test.py
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+SERVICE_DIR = Path(__file__).resolve().parents[1] / "molmo-service"
+TOKEN_MS = 40  # stub decode step; a full answer takes about 60 steps (2.4 s)
+CANCEL_AFTER_S = 0.4
+PROMPT = "Point to the blue soldier and determine the action to be taken by the camera to align the centre of the image with it."
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def frame(shade: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 200), (shade, 80, 120)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def form(request_id: str) -> dict:
+    return {"prompt": PROMPT, "include_timings": "true", "request_id": request_id, "cache": "false"}
+
+
+async def metric(client: httpx.AsyncClient, name: str) -> float:
+    text = (await client.get("/metrics")).text
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+async def analyze(client: httpx.AsyncClient, shade: int, request_id: str) -> list:
+    files = {"file": ("frame.png", frame(shade), "image/png")}
+    events = []
+    async with client.stream("POST", "/analyze", files=files, data=form(request_id)) as response:
+        async for line in response.aiter_lines():
+            if line.strip():
+                events.append(json.loads(line))
+    return events
+
+
+async def abandoned(client: httpx.AsyncClient, shade: int, request_id: str, how: str) -> list:
+    """Start a request and give up on it after CANCEL_AFTER_S, by disconnecting or with /cancel."""
+    files = {"file": ("frame.png", frame(shade), "image/png")}
+    events = []
+    async with httpx.AsyncClient(base_url=client.base_url, timeout=30) as own:
+        async with own.stream("POST", "/analyze", files=files, data=form(request_id)) as response:
+            lines = response.aiter_lines()
+            events.append(json.loads(await anext(lines)))  # processing
+            await asyncio.sleep(CANCEL_AFTER_S)
+            if how == "disconnect":
+                return events  # leaving the block closes the connection
+            await client.post("/cancel", data={"request_id": request_id})
+            async for line in lines:
+                if line.strip():
+                    events.append(json.loads(line))
+    return events
+
+
+async def check(client: httpx.AsyncClient, how: str, shade: int) -> bool:
+    decode_before = await metric(client, 'molmo_stage_seconds_sum{stage="decode"}')
+    first = asyncio.create_task(abandoned(client, shade, f"{how}-first", how))
+    await asyncio.sleep(0.1)
+    # Queued behind the first request while it generates
+    second = await analyze(client, shade + 1, f"{how}-second")
+    first_events = await first
+    await asyncio.sleep(0.2)
+    decode_total = await metric(client, 'molmo_stage_seconds_sum{stage="decode"}') - decode_before
+    timings = next(e["data"] for e in second if e["status"] == "timings")
+    queue_wait_s = timings["stages_ms"]["queue_wait"] / 1000.0
+    first_decode_s = decode_total - timings["stages_ms"]["decode"] / 1000.0
+    full_decode_s = (timings["generated_tokens"] - 1) * TOKEN_MS / 1000.0
+
+    checks = {
+        "second request got the model within 0.5 s": queue_wait_s < 0.5,
+        "cancelled request decoded for less than half an answer": first_decode_s < full_decode_s / 2,
+        "second request completed": second[-1]["status"] == "complete",
+    }
+    if how == "cancel":
+        checks["cancelled stream ended with reason cancelled"] = first_events[-1].get("reason") == "cancelled"
+    print(f"{how}: second request queued {queue_wait_s:.2f}s, cancelled request decoded "
+          f"{first_decode_s:.2f}s of a {full_decode_s:.2f}s answer")
+    for label, ok in checks.items():
+        print(f"  {'PASS' if ok else 'FAIL'}  {label}")
+    return all(checks.values())
+
+
+async def main(url: str) -> bool:
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        ok = True
+        for i, how in enumerate(("disconnect", "cancel")):
+            ok &= await check(client, how, 40 * i)
+        cancelled = (await client.get("/metrics")).text
+        print("\n".join(line for line in cancelled.splitlines() if line.startswith("molmo_cancelled_total")))
+        return ok
+
+
+if __name__ == "__main__":
+    port = free_port()
+    env = {**os.environ, "MOLMO_BACKEND": "stub", "MOLMO_STUB_TOKEN_MS": str(TOKEN_MS)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{url}/health")
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        passed = asyncio.run(main(url))
+    finally:
+        server.terminate()
+        server.wait()
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.stats import summarize
+
+
+def load_stage_timings(jsonl_path, last=None):
+    """
+    Collect per-stage durations (ms) from the "timings" field of metadata.jsonl.
+
+    Client stages are keyed by name (before_grab, analyze, actuation, ...),
+    server stages are prefixed with "server." (server.prefill, server.decode, ...).
+    Records written before timing was recorded are skipped. The server's decode
+    rate is not a duration and is collected separately.
+
+    Returns (stages, rates, n_records) where stages = {stage_name: [ms, ...]} and
+    rates = {"server.tokens_per_s": [tokens/s, ...]}.
+    """
+    jsonl_path = Path(jsonl_path)
+    records = []
+
+    with jsonl_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            data = json.loads(line)
+            timings = data.get("timings")
+            if timings:
+                records.append(timings)
+
+    if last:
+        records = records[-last:]
+
+    stages, rates = {}, {}
+    for timings in records:
+        stages.setdefault("total", []).append(timings.get("total_ms", 0.0))
+        for name, ms in timings.get("stages_ms", {}).items():
+            stages.setdefault(name, []).append(ms)
+
+        server = timings.get("server") or {}
+        if "total_ms" in server:
+            stages.setdefault("server.total", []).append(server["total_ms"])
+        for name, ms in server.get("stages_ms", {}).items():
+            stages.setdefault(f"server.{name}", []).append(ms)
+        if server.get("tokens_per_s") is not None:
+            rates.setdefault("server.tokens_per_s", []).append(server["tokens_per_s"])
+
+    return stages, rates, len(records)
+
+
+def print_stage_table(stages, rates, n_records):
+    print(f"{n_records} iterations with timings\n")
+    for label, series in (("stage (ms)", stages), ("rate (tokens/s)", rates)):
+        if not series:
+            continue
+        print(f"{label:<28}{'n':>6}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+        for name, values in series.items():
+            s = summarize(values)
+            print(
+                f"{name:<28}{s['count']:>6}{s['mean']:>10.1f}{s['p50']:>10.1f}"
+                f"{s['p90']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage iteration timing percentiles (ms) and decode rates for an evaluation run.")
+    parser.add_argument("jsonl_path", nargs="?", default="vla_evaluation/metadata.jsonl")
+    parser.add_argument("--last", type=int, help="Only use the last N iterations")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    stages, rates, n_records = load_stage_timings(args.jsonl_path, args.last)
+    if args.json:
+        print(json.dumps({name: summarize(values) for name, values in {**stages, **rates}.items()}, indent=2))
+    else:
+        print_stage_table(stages, rates, n_records)
@@ -1,5 +1,6 @@
-import json
-from pathlib import Path
+import sys
+
+from vla_analytics import RunAnalytics
 
 def list_examples_without_centre(jsonl_path):
     """
@@ -7,38 +8,18 @@ def list_examples_without_centre(jsonl_path):
     a 'centre of the image is at ...' description.
     Each element has: iteration, before_screenshot, vla_output.
     """
-    jsonl_path = Path(jsonl_path)
-    missing = []
-
-    with jsonl_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-
-            data = json.loads(line)
-            vla_out = data.get("vla_output", "") or ""
-            before_name = data.get("before_screenshot")
-            iteration = data.get("iteration")
-
-            # Heuristic: examples that *have* the centre description
-            # typically contain this phrase.[file:1]
-            has_centre = '<points coords="1 1 500 500">centre of image</points>' in vla_out
-
-            if not has_centre:
-                missing.append(
-                    {
-                        "iteration": iteration,
-                        "before_screenshot": before_name,
-                        "vla_output": vla_out,
-                    }
-                )
-
-    return missing
-
-jsonl_path = "vla_evaluation/metadata.jsonl"
-no_centre = list_examples_without_centre(jsonl_path)
-
-# Print a quick summary
-for ex in no_centre:
-    print(ex["before_screenshot"], "->", ex["vla_output"])
+    analytics = RunAnalytics.scan(jsonl_path)
+    return [
+        {
+            "iteration": data.get("iteration"),
+            "before_screenshot": data.get("before_screenshot"),
+            "vla_output": data.get("vla_output", "") or "",
+        }
+        for data in analytics.records(analytics.wrong_centre)
+    ]
+
+
+if __name__ == "__main__":
+    jsonl_path = sys.argv[1] if len(sys.argv) > 1 else "vla_evaluation/metadata.jsonl"
+    for ex in list_examples_without_centre(jsonl_path):
+        print(ex["before_screenshot"], "->", ex["vla_output"])
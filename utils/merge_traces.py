@@ -0,0 +1,53 @@
+import argparse
+import json
+import urllib.request
+
+
+def load_trace(source):
+    """Load a Chrome trace from a JSON file or a /trace endpoint URL."""
+    if source.startswith(("http://", "https://")):
+        with urllib.request.urlopen(source, timeout=30) as response:
+            return json.load(response)
+    with open(source, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge_traces(traces):
+    """
+    Merge several Chrome traces onto one timeline.
+
+    Timestamps are already wall-clock microseconds, so events only need their
+    pids made unique (client and service can share a pid across machines).
+    """
+    merged = []
+    used_pids = set()
+    for trace in traces:
+        events = trace.get("traceEvents", trace) if isinstance(trace, dict) else trace
+        pids = {e.get("pid") for e in events}
+        remap = {}
+        for pid in pids:
+            new_pid = pid
+            while new_pid in used_pids:
+                new_pid += 100_000
+            remap[pid] = new_pid
+            used_pids.add(new_pid)
+        for event in events:
+            merged.append({**event, "pid": remap[event.get("pid")]})
+    return {"traceEvents": merged, "displayTimeUnit": "ms"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge client and service traces into one file for ui.perfetto.dev or chrome://tracing."
+    )
+    parser.add_argument(
+        "sources", nargs="+",
+        help="Trace JSON files or URLs, e.g. http://localhost:8001/trace http://localhost:8000/trace"
+    )
+    parser.add_argument("-o", "--output", default="trace.json")
+    args = parser.parse_args()
+
+    merged = merge_traces([load_trace(source) for source in args.sources])
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(merged, f)
+    print(f"Wrote {len(merged['traceEvents'])} events to {args.output}")
@@ -0,0 +1,84 @@
+"""Convert metadata.jsonl runs into the columnar run store and query it.
+
+    python utils/metadata_store.py convert vla_evaluation/metadata.jsonl vla_evaluation/store
+    python utils/metadata_store.py drift vla_evaluation/store --min-px 50
+    python utils/metadata_store.py info vla_evaluation/store
+    python utils/metadata_store.py compact vla_evaluation/store
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.run_store import compact, convert_jsonl, drift_filter, load_table
+
+
+def cmd_convert(args):
+    start = time.perf_counter()
+    count, replaced = convert_jsonl(args.jsonl_path, args.store, run_id=args.run_id)
+    print(f"Converted {count} records into {args.store} in {time.perf_counter() - start:.2f}s"
+          + (f" (replacing {replaced} rows of the same runs)" if replaced else ""))
+
+
+def cmd_drift(args):
+    start = time.perf_counter()
+    table = load_table(
+        args.store,
+        columns=["run_id", "iteration", "before_screenshot", "obj_x", "obj_y", "ctr_x", "ctr_y",
+                 "action_dx", "action_dy", "drift_px"],
+        filter=drift_filter(args.min_px),
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    for row in table.slice(0, args.limit).to_pylist():
+        print(
+            row["before_screenshot"], "iter", row["iteration"],
+            "obj", (row["obj_x"], row["obj_y"]), "ctr", (row["ctr_x"], row["ctr_y"]),
+            "act", (row["action_dx"], row["action_dy"]), "||diff||", round(row["drift_px"], 1),
+        )
+    print(f"{table.num_rows} iterations with drift > {args.min_px} px ({elapsed_ms:.1f} ms)")
+
+
+def cmd_info(args):
+    table = load_table(args.store, columns=["run_id", "has_points", "has_action", "has_centre", "drift_px"])
+    n = table.num_rows
+    print(f"{n} rows, {len(set(table['run_id'].to_pylist()))} runs")
+    for name in ("has_points", "has_action", "has_centre"):
+        count = table[name].to_numpy(zero_copy_only=False).sum()
+        print(f"{name:<12}{count:>10}{count / n if n else 0:>10.1%}")
+
+
+def cmd_compact(args):
+    print(f"Compacted into {compact(args.store)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar run store for metadata.jsonl records.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="Write a metadata.jsonl to a store, replacing its runs' existing rows")
+    convert.add_argument("jsonl_path")
+    convert.add_argument("store")
+    convert.add_argument("--run-id", help="Tag the converted rows with this run id")
+    convert.set_defaults(func=cmd_convert)
+
+    drift = sub.add_parser("drift", help="Iterations whose action is off the pointed object")
+    drift.add_argument("store")
+    drift.add_argument("--min-px", type=float, default=50)
+    drift.add_argument("--limit", type=int, default=20, help="Rows printed")
+    drift.set_defaults(func=cmd_drift)
+
+    info = sub.add_parser("info", help="Row counts and output flags")
+    info.add_argument("store")
+    info.set_defaults(func=cmd_info)
+
+    compact_parser = sub.add_parser("compact", help="Merge part files into one")
+    compact_parser.add_argument("store")
+    compact_parser.set_defaults(func=cmd_compact)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
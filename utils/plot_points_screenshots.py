@@ -1,20 +1,11 @@
-import re
-
-# Your regexes
-COORD_REGEX = re.compile(rf"<(?:points|tracks).*? coords=\"([0-9\t:;, .]+)\"/?>")
-FRAME_REGEX = re.compile(rf"(?:^|\t|:|,|;)([0-9\.]+) ([0-9\. ]+)")
-POINTS_REGEX = re.compile(r"([0-9]+) ([0-9]{3,4}) ([0-9]{3,4})")
+import sys
+from pathlib import Path
 
+import numpy as np
 
-def _points_from_num_str(text, image_w, image_h, extract_ids=False):
-    """
-    Yield (idx, x, y) in absolute pixel coords, assuming coords are scaled by 1000.
-    """
-    for points in POINTS_REGEX.finditer(text):
-        ix, x, y = points.group(1), points.group(2), points.group(3)
-        x, y = float(x) / 1000 * image_w, float(y) / 1000 * image_h
-        if 0 <= x <= image_w and 0 <= y <= image_h:
-            yield ix, x, y
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import parse
+from vla_analytics import RunAnalytics
 
 
 def extract_multi_image_points(text, image_w, image_h, extract_ids=False):
@@ -23,31 +14,7 @@ def extract_multi_image_points(text, image_w, image_h, extract_ids=False):
     (frame_id, idx, x, y) if extract_ids=True.
     For your case (single images, fixed res), pass image_w=1920, image_h=1200.
     """
-    all_points = []
-
-    if isinstance(image_w, (list, tuple)) and isinstance(image_h, (list, tuple)):
-        assert len(image_w) == len(image_h)
-        diff_res = True
-    else:
-        diff_res = False
-
-    for coord in COORD_REGEX.finditer(text):
-        for point_grp in FRAME_REGEX.finditer(coord.group(1)):
-            frame_id = int(point_grp.group(1)) if diff_res else float(point_grp.group(1))
-            w, h = (
-                (image_w[frame_id - 1], image_h[frame_id - 1])
-                if diff_res
-                else (image_w, image_h)
-            )
-            for idx, x, y in _points_from_num_str(point_grp.group(2), w, h):
-                if extract_ids:
-                    all_points.append((frame_id, idx, int(x), int(y)))
-                else:
-                    all_points.append((frame_id, int(x), int(y)))
-    return all_points
-
-import json
-from pathlib import Path
+    return parse(text).pixel_points(image_w, image_h, extract_ids)
 
 def extract_points_from_jsonl(jsonl_path, image_w=1920, image_h=1200):
     """
@@ -60,37 +27,26 @@ def extract_points_from_jsonl(jsonl_path, image_w=1920, image_h=1200):
           ...
         }
     Assumes each JSON object has at least 'before_screenshot', 'iteration',
-    and 'vla_output' fields as in your metadata.jsonl.[file:1]
+    and 'vla_output' fields as in your metadata.jsonl.
     """
-    jsonl_path = Path(jsonl_path)
+    analytics = RunAnalytics.scan(jsonl_path)
+    points_by_row = analytics.pixel_points(image_w, image_h)
+    mask = np.zeros(len(analytics), dtype=bool)
+    mask[list(points_by_row)] = True
     results = {}
 
-    with jsonl_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-
-            data = json.loads(line)
-            text = data.get("vla_output", "")
-            before_name = data.get("before_screenshot")
-            iteration = data.get("iteration")
-
-            if not before_name or not text:
-                continue
-
-            points = extract_multi_image_points(text, image_w, image_h)
-
-            if points:
-                results[before_name] = {
-                    "iteration": iteration,
-                    "points": points,
-                }
+    for row, data in zip(sorted(points_by_row), analytics.records(mask)):
+        before_name = data.get("before_screenshot")
+        if before_name:
+            results[before_name] = {
+                "iteration": data.get("iteration"),
+                "points": points_by_row[row],
+            }
 
     return results
 
-import os
 import matplotlib.pyplot as plt
+from render_annotations import open_frame, annotate, build_jobs, render_files
 
 def plot_points_on_befores(
     jsonl_path,
@@ -99,61 +55,53 @@ def plot_points_on_befores(
     image_w=1920,
     image_h=1200,
     show=False,
+    archive=None,
+    workers=None,
 ):
     """
     For each JSONL line with extracted points, load its 'before_screenshot'
-    image, plot the points, and either display or save the figure.
+    image, draw the points, and either display or save it.
 
     - jsonl_path: path to metadata.jsonl
     - images_dir: directory containing before_XXXX.png, etc.
-    - out_dir: if not None, save plots as PNGs there
+    - out_dir: if not None, save annotated PNGs there (rendered with PIL in a
+      process pool; images already in out_dir are skipped)
+    - image_w, image_h: unused, points are scaled to each image's own size
     - show: if True, call plt.show() for each image instead of/besides saving
-    """
-    os.makedirs(out_dir, exist_ok=True) if out_dir is not None else None
-
-    points_by_image = extract_points_from_jsonl(jsonl_path, image_w, image_h)
-
-    for before_name, info in points_by_image.items():
-        img_path = os.path.join(images_dir, before_name)
-        if not os.path.isfile(img_path):
-            # Skip if image is missing
-            continue
-
-        img = plt.imread(img_path)
-        fig, ax = plt.subplots(figsize=(image_w / 200, image_h / 200), dpi=100)
-        ax.imshow(img)
-
-        # Extract x, y from (frame_id, x, y)
-        xs = [p[1] for p in info["points"]]
-        ys = [p[2] for p in info["points"]]
-
-        # Scatter points
-        ax.scatter(xs, ys, c="red", s=40, marker="o")
-
-        # Optional: label points with their index
-        for i, (frame_id, x, y) in enumerate(info["points"]):
-            ax.text(x + 5, y - 5, str(i), color="yellow", fontsize=8)
+    - archive: optional frame archive (see utils/archive_frames.py) to read the
+      images from instead of images_dir
+    - workers: rendering processes (default: one per CPU)
 
-        ax.set_title(f"{before_name} (iteration {info['iteration']})")
-        ax.set_axis_off()
-
-        if out_dir is not None:
-            out_path = os.path.join(out_dir, f"points_{before_name}")
-            fig.savefig(out_path, bbox_inches="tight", pad_inches=0)
-        if show:
+    See utils/render_annotations.py for drift vectors, contact sheets and videos.
+    """
+    jobs = build_jobs(RunAnalytics.scan(jsonl_path))
+    source = ("archive", str(archive.path)) if archive is not None else ("dir", images_dir)
+
+    if out_dir is not None:
+        render_files(jobs, source, out_dir, workers)
+
+    if show:
+        for before_name, iteration, points, drift in jobs:
+            try:
+                image = open_frame(source, before_name)
+            except (OSError, KeyError, ValueError):
+                # Skip if image is missing
+                continue
+            plt.imshow(annotate(image, points, drift, f"{before_name} (iteration {iteration})"))
+            plt.axis("off")
             plt.show()
-        plt.close(fig)
 
-# Paths you need to set
-jsonl_path = "vla_evaluation/metadata.jsonl"
-images_dir = "vla_evaluation/"  # contains before_0001.png, ...
-out_dir = "plots_with_points/"
-
-plot_points_on_befores(
-    jsonl_path=jsonl_path,
-    images_dir=images_dir,
-    out_dir=out_dir,
-    image_w=1920,
-    image_h=1200,
-    show=False,   # set True if you want interactive display
-)
+if __name__ == "__main__":
+    # Paths you need to set
+    jsonl_path = "vla_evaluation/metadata.jsonl"
+    images_dir = "vla_evaluation/"  # contains before_0001.png, ...
+    out_dir = "plots_with_points/"
+
+    plot_points_on_befores(
+        jsonl_path=jsonl_path,
+        images_dir=images_dir,
+        out_dir=out_dir,
+        image_w=1920,
+        image_h=1200,
+        show=False,   # set True if you want interactive display
+    )
@@ -0,0 +1,273 @@
+"""Draw the model's points (and optionally drift vectors) on before screenshots.
+
+Frames are annotated with PIL directly (as utils/gradio-demo.py does) in a process
+pool, in chunks of frames per task. Output is one PNG per frame, contact sheets,
+or a video:
+
+    python utils/render_annotations.py vla_evaluation/metadata.jsonl --images vla_evaluation --out plots_with_points
+    python utils/render_annotations.py vla_evaluation/metadata.jsonl --archive vla_evaluation.frames --sheet sheets --drift
+    python utils/render_annotations.py vla_evaluation/metadata.jsonl --images vla_evaluation --video run.mp4 --drift
+
+Rendering is incremental: per-frame files that already exist are skipped, and so
+are contact sheet pages that are complete on disk. Videos need imageio with its
+ffmpeg plugin (uv pip install imageio imageio-ffmpeg).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.frame_archive import FrameArchive
+from vla_analytics import RunAnalytics
+
+POINT_COLOUR = "red"
+CENTRE_COLOUR = "cyan"
+ACTION_COLOUR = "yellow"
+DRIFT_COLOUR = "magenta"
+SHEET_LABEL_H = 16
+
+
+def output_name(before_name: str) -> str:
+    # before_name may include the run directory (run_id/before_0001.png)
+    return "points_" + before_name.replace("/", "_")
+
+
+def build_jobs(analytics: RunAnalytics, with_drift=False, only_points=True):
+    """
+    One job per record: (before_name, iteration, points, drift). Points stay in the
+    model's 0-1000 coordinates and are scaled to each image's own size when drawn.
+    """
+    points_by_row = {}
+    p = analytics.points
+    for row, frame, x, y in zip(p["point_row"], p["point_frame"], p["point_x"], p["point_y"]):
+        if 0 <= x <= 1000 and 0 <= y <= 1000:
+            points_by_row.setdefault(int(row), []).append((float(frame), int(x), int(y)))
+
+    c = analytics.columns
+    mask = np.zeros(len(analytics), dtype=bool)
+    mask[list(points_by_row)] = True
+    if not only_points:
+        mask[:] = True
+    checkable = ~np.isnan(analytics.drift()[2])
+    jobs = []
+    for row, record in zip(np.flatnonzero(mask), analytics.records(mask)):
+        name = record.get("before_screenshot")
+        if not name:
+            continue
+        drift = None
+        if with_drift and checkable[row]:
+            drift = (
+                (float(c["obj_x"][row]), float(c["obj_y"][row])),
+                (float(c["ctr_x"][row]), float(c["ctr_y"][row])),
+                (float(c["dx"][row]), float(c["dy"][row])),
+            )
+        jobs.append((name, record.get("iteration"), points_by_row.get(int(row), []), drift))
+    return jobs
+
+
+def annotate(image: Image.Image, points, drift=None, label=None) -> Image.Image:
+    """
+    Draw points (frame_id, x, y) given in 0-1000 coordinates. With drift
+    ((obj), (centre), (action)), also draw the centre, the object position the
+    action implies (centre - action) and the drift from the pointed object to it.
+    """
+    image = image.convert("RGB")
+    draw = ImageDraw.Draw(image)
+    sx, sy = image.width / 1000, image.height / 1000
+    radius = max(6, image.width // 320)
+    width = max(2, image.width // 640)
+
+    for i, (frame_id, x, y) in enumerate(points, start=1):
+        x, y = x * sx, y * sy
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), outline=POINT_COLOUR, width=width)
+        draw.text((x + radius + 2, y + radius + 2), str(i), fill=POINT_COLOUR)
+
+    if drift is not None:
+        (ox, oy), (cx, cy), (dx, dy) = drift
+        tx, ty = (cx - dx) * sx, (cy - dy) * sy
+        cx, cy, ox, oy = cx * sx, cy * sy, ox * sx, oy * sy
+        draw.line((cx - radius, cy, cx + radius, cy), fill=CENTRE_COLOUR, width=width)
+        draw.line((cx, cy - radius, cx, cy + radius), fill=CENTRE_COLOUR, width=width)
+        draw.line((cx, cy, tx, ty), fill=ACTION_COLOUR, width=width)
+        draw.line((ox, oy, tx, ty), fill=DRIFT_COLOUR, width=width)
+        draw.rectangle((tx - radius / 2, ty - radius / 2, tx + radius / 2, ty + radius / 2), outline=ACTION_COLOUR, width=width)
+
+    if label:
+        draw.text((8, 8), label, fill=ACTION_COLOUR)
+    return image
+
+
+# ------------- worker side -------------
+
+_archive = None
+
+
+def open_frame(source, name):
+    global _archive
+    kind, path = source
+    if kind == "archive":
+        if _archive is None or _archive.path != Path(path):
+            _archive = FrameArchive(path)
+        return _archive.read_name(name)
+    return Image.open(os.path.join(path, name))
+
+
+def render_chunk(task):
+    """
+    Render one chunk of jobs. In files mode the annotated frames are saved and the
+    number written is returned; otherwise thumbnails are returned as (size, bytes).
+    """
+    jobs, source, options = task
+    written, thumbs = 0, []
+    for name, iteration, points, drift in jobs:
+        try:
+            image = open_frame(source, name)
+        except (OSError, KeyError, ValueError):
+            thumbs.append(None)  # missing frame
+            continue
+        annotated = annotate(image, points, drift, f"{name} (iteration {iteration})")
+        if options["mode"] == "files":
+            annotated.save(Path(options["out_dir"]) / output_name(name), compress_level=1)
+            written += 1
+        else:
+            w = options["thumb_width"]
+            thumb = annotated.resize((w, round(annotated.height * w / annotated.width)), Image.BILINEAR)
+            thumbs.append((thumb.size, thumb.tobytes()))
+    return written if options["mode"] == "files" else thumbs
+
+
+def _chunks(jobs, size):
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+def _map(tasks, workers):
+    """Results of render_chunk in task order, from a process pool when workers > 1."""
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(render_chunk, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(render_chunk, tasks)
+
+
+# ------------- outputs -------------
+
+def render_files(jobs, source, out_dir, workers=None, chunk_size=16, force=False) -> dict:
+    """One annotated PNG per job; existing outputs are kept unless force."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    todo = jobs if force else [job for job in jobs if not (out_dir / output_name(job[0])).exists()]
+    options = {"mode": "files", "out_dir": str(out_dir)}
+    tasks = [(chunk, source, options) for chunk in _chunks(todo, chunk_size)]
+    written = sum(_map(tasks, workers or os.cpu_count()))
+    return {"frames": len(jobs), "skipped": len(jobs) - len(todo), "written": written}
+
+
+def iter_thumbnails(jobs, source, thumb_width, workers=None, chunk_size=16):
+    """Annotated thumbnails in job order (None for missing frames)."""
+    options = {"mode": "thumbs", "thumb_width": thumb_width}
+    tasks = [(chunk, source, options) for chunk in _chunks(jobs, chunk_size)]
+    for thumbs in _map(tasks, workers or os.cpu_count()):
+        for thumb in thumbs:
+            yield None if thumb is None else Image.frombytes("RGB", *thumb)
+
+
+def render_sheets(jobs, source, out_dir, columns=6, rows=5, thumb_width=320, workers=None,
+                  chunk_size=16, force=False) -> dict:
+    """Contact sheets of columns x rows frames; complete pages already on disk are kept."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    per_page = columns * rows
+    pages = _chunks(jobs, per_page)
+    todo = [
+        (page_no, page) for page_no, page in enumerate(pages, start=1)
+        if force or len(page) < per_page or not (out_dir / f"sheet_{page_no:04d}.png").exists()
+    ]
+    # One pass over the frames of every page to render, so the pool stays busy across pages
+    thumbs = iter_thumbnails([job for _, page in todo for job in page], source, thumb_width, workers, chunk_size)
+    written = 0
+    for page_no, page in todo:
+        sheet = None
+        for i, job in enumerate(page):
+            thumb = next(thumbs)
+            if thumb is None:
+                continue
+            if sheet is None:
+                cell_w, cell_h = thumb.width, thumb.height + SHEET_LABEL_H
+                sheet = Image.new("RGB", (columns * cell_w, rows * cell_h), "black")
+                draw = ImageDraw.Draw(sheet)
+            x, y = (i % columns) * cell_w, (i // columns) * cell_h
+            sheet.paste(thumb, (x, y))
+            draw.text((x + 4, y + thumb.height + 2), job[0], fill="white")
+        if sheet is not None:
+            sheet.save(out_dir / f"sheet_{page_no:04d}.png")
+            written += 1
+    return {"frames": len(jobs), "pages": len(pages), "written": written}
+
+
+def render_video(jobs, source, out_path, fps=4, thumb_width=960, workers=None, chunk_size=16) -> dict:
+    """Stream annotated frames into a video file (all frames resized to the first one's size)."""
+    try:
+        import imageio.v2 as imageio
+    except ImportError:
+        raise RuntimeError("Rendering a video needs imageio: uv pip install imageio imageio-ffmpeg")
+    frames, size = 0, None
+    with imageio.get_writer(out_path, fps=fps) as writer:
+        for thumb in iter_thumbnails(jobs, source, thumb_width, workers, chunk_size):
+            if thumb is None:
+                continue
+            if size is None:
+                # Even dimensions for the usual yuv420p encoders
+                size = (thumb.width // 2 * 2, thumb.height // 2 * 2)
+            if thumb.size != size:
+                thumb = thumb.resize(size, Image.BILINEAR)
+            writer.append_data(np.asarray(thumb))
+            frames += 1
+    return {"frames": frames}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate before screenshots with the model's points.")
+    parser.add_argument("jsonl_path", nargs="?", default="vla_evaluation/metadata.jsonl")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--images", default="vla_evaluation", help="Directory the screenshot names are relative to")
+    source.add_argument("--archive", help="Read screenshots from a frame archive instead")
+    parser.add_argument("--out", help="Write one annotated PNG per frame here")
+    parser.add_argument("--sheet", help="Write contact sheets here")
+    parser.add_argument("--video", help="Write a video (e.g. run.mp4)")
+    parser.add_argument("--drift", action="store_true", help="Draw centre, implied object position and drift")
+    parser.add_argument("--all", action="store_true", help="Include frames without points")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=16, help="Frames per pool task")
+    parser.add_argument("--columns", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=5)
+    parser.add_argument("--thumb-width", type=int, default=320, help="Frame width on sheets (video: 3x)")
+    parser.add_argument("--fps", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="Re-render outputs that already exist")
+    args = parser.parse_args()
+    if not (args.out or args.sheet or args.video):
+        parser.error("Pass at least one of --out, --sheet or --video")
+
+    analytics = RunAnalytics.scan(args.jsonl_path)
+    jobs = build_jobs(analytics, with_drift=args.drift, only_points=not args.all)
+    source = ("archive", args.archive) if args.archive else ("dir", args.images)
+    for label, enabled, render in (
+        ("files", args.out, lambda: render_files(jobs, source, args.out, args.workers, args.chunk_size, args.force)),
+        ("sheets", args.sheet, lambda: render_sheets(jobs, source, args.sheet, args.columns, args.rows,
+                                                     args.thumb_width, args.workers, args.chunk_size, args.force)),
+        ("video", args.video, lambda: render_video(jobs, source, args.video, args.fps, args.thumb_width * 3,
+                                                   args.workers, args.chunk_size)),
+    ):
+        if enabled:
+            start = time.perf_counter()
+            result = render()
+            print(f"{label}: {result} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
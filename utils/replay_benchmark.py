@@ -0,0 +1,393 @@
+"""Replay recorded frames against the Molmo service and report latency and throughput.
+
+Closed loop (--concurrency N): N workers each send their next frame as soon as the
+previous response completes. Open loop (--rate R): requests arrive at R per second
+(constant or Poisson) regardless of how fast the service answers, so queueing shows
+up in the latency.
+
+    # CPU-only, against the stub backend: MOLMO_BACKEND=stub python molmo-service/app.py
+    python utils/replay_benchmark.py run --frames vla_evaluation --concurrency 4 --requests 200 --out base.json
+    python utils/replay_benchmark.py run --frames vla_evaluation --rate 2 --duration 60 --out new.json
+    python utils/replay_benchmark.py compare base.json new.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.stats import summarize
+from common.frame_archive import FrameArchive
+from common.molmo_parsing import parse
+
+MOLMO_SERVER = "http://localhost:8000"
+FRAME_PATTERNS = ("before_*.png", "*.png", "*.jpg", "*.jpeg")
+DEFAULT_TARGET = "blue soldier"
+
+
+def find_frames(frames_dir):
+    """Recorded frames in a directory, preferring the before_XXXX.png captures."""
+    frames_dir = Path(frames_dir)
+    if (frames_dir / "manifest.json").exists():
+        # A frame archive: its before frames, read by row instead of by path
+        archive = FrameArchive(frames_dir)
+        return [ArchivedFrame(archive, row, name) for row, name in enumerate(archive.names) if "before_" in name]
+    for pattern in FRAME_PATTERNS:
+        frames = sorted(frames_dir.rglob(pattern))
+        if frames:
+            return frames
+    raise SystemExit(f"No frames found in {frames_dir}")
+
+
+class ArchivedFrame:
+    """A frame of an archive, readable like a Path."""
+
+    def __init__(self, archive, row, name):
+        self.archive = archive
+        self.row = row
+        self.name = name
+
+    def read_bytes(self):
+        return bytes(self.archive.read_bytes(self.row))
+
+    def __str__(self):
+        return self.name
+
+
+class HttpNdjsonTransport:
+    """POST /analyze as multipart form and read the NDJSON stream."""
+
+    name = "http"
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, frame_bytes, filename, form):
+        """Return a result dict with ttfb_ms, total_ms, generated_tokens, text and error."""
+        content_type = "image/jpeg" if filename.lower().endswith((".jpg", ".jpeg")) else "image/png"
+        files = {"file": (filename, frame_bytes, content_type)}
+        result = {"ttfb_ms": None, "total_ms": None, "generated_tokens": None, "text": None, "error": None}
+        start = time.perf_counter()
+        try:
+            async with self.client.stream("POST", f"{self.url}/analyze", files=files, data=form) as response:
+                if response.status_code != 200:
+                    result["error"] = f"HTTP {response.status_code}"
+                async for line in response.aiter_lines():
+                    if result["ttfb_ms"] is None:
+                        result["ttfb_ms"] = (time.perf_counter() - start) * 1000.0
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    status = event.get("status")
+                    if status == "model_output":
+                        result["text"] = event.get("text", "")
+                    elif status == "timings":
+                        result["generated_tokens"] = event.get("data", {}).get("generated_tokens")
+                        result["server"] = event.get("data")
+                    elif status == "error":
+                        result["error"] = event.get("message", "error")
+                        result["dropped"] = event.get("reason")
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["total_ms"] = (time.perf_counter() - start) * 1000.0
+        return result
+
+    async def accelerator_busy_s(self):
+        """The service's molmo_accelerator_busy_seconds_total, or None if it does not export it."""
+        try:
+            text = (await self.client.get(f"{self.url}/metrics")).text
+        except httpx.HTTPError:
+            return None
+        match = re.search(r"^molmo_accelerator_busy_seconds_total (\S+)$", text, re.MULTILINE)
+        return float(match.group(1)) if match else None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+TRANSPORTS = {HttpNdjsonTransport.name: HttpNdjsonTransport}
+
+
+class Replay:
+    def __init__(self, args):
+        self.args = args
+        self.frames = find_frames(args.frames)
+        self.frame_cache = {}
+        self.next_index = 0
+        self.results = []
+        self.form = {
+            "prompt": args.prompt or f"Point to the {args.target} and determine the action to be taken by the camera to align the centre of the image with it.",
+            "include_timings": "true",
+        }
+        if args.adapter:
+            self.form["adapter"] = args.adapter
+        if args.constrained is not None:
+            self.form["constrained"] = args.constrained
+        if args.speculative is not None:
+            self.form["speculative"] = args.speculative
+        if args.cache is not None:
+            self.form["cache"] = args.cache
+        if args.deadline_ms:
+            self.form["deadline_ms"] = str(args.deadline_ms)
+        self.issued = 0
+        self.busy_s = None
+        self.transport = TRANSPORTS[args.transport](args.url, args.timeout)
+
+    def next_frame(self):
+        path = self.frames[self.next_index % len(self.frames)]
+        self.next_index += 1
+        # Read each frame once so disk I/O is not part of the measurement
+        data = self.frame_cache.get(path)
+        if data is None:
+            data = self.frame_cache[path] = path.read_bytes()
+        return path, data
+
+    async def one_request(self, scheduled_at, warmup):
+        path, data = self.next_frame()
+        form = self.form
+        if self.args.sessions:
+            # Round-robin over control-loop sessions: the service keeps only each one's newest queued frame
+            form = {**form, "session_id": f"replay-{self.issued % self.args.sessions}"}
+        self.issued += 1
+        result = await self.transport.send(data, path.name, form)
+        # Open loop: latency counts from the scheduled arrival, including client-side waiting
+        result["queue_ms"] = (time.perf_counter() - scheduled_at) * 1000.0 - result["total_ms"]
+        result["frame"] = str(path)
+        result["finished_at"] = time.perf_counter()
+        if not warmup:
+            self.results.append(result)
+
+    def done(self, started, issued):
+        if self.args.requests and issued >= self.args.requests:
+            return True
+        return bool(self.args.duration) and time.perf_counter() - started >= self.args.duration
+
+    async def run_closed_loop(self):
+        issued = 0
+        started = time.perf_counter()
+
+        async def worker():
+            nonlocal issued
+            while not self.done(started, issued):
+                issued += 1
+                await self.one_request(time.perf_counter(), warmup=False)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return started
+
+    async def run_open_loop(self):
+        issued = 0
+        started = time.perf_counter()
+        in_flight = set()
+        limit = asyncio.Semaphore(self.args.max_in_flight)
+        next_arrival = started
+
+        async def limited(scheduled_at):
+            async with limit:
+                await self.one_request(scheduled_at, warmup=False)
+
+        while not self.done(started, issued):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            issued += 1
+            task = asyncio.create_task(limited(next_arrival))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            gap = 1.0 / self.args.rate
+            next_arrival += random.expovariate(self.args.rate) if self.args.arrival == "poisson" else gap
+        await asyncio.gather(*in_flight)
+        return started
+
+    async def run(self):
+        try:
+            for _ in range(self.args.warmup):
+                await self.one_request(time.perf_counter(), warmup=True)
+            busy_before = await self.transport.accelerator_busy_s()
+            if self.args.rate:
+                started = await self.run_open_loop()
+            else:
+                started = await self.run_closed_loop()
+            elapsed = time.perf_counter() - started
+            busy_after = await self.transport.accelerator_busy_s()
+            if busy_before is not None and busy_after is not None:
+                self.busy_s = busy_after - busy_before
+        finally:
+            await self.transport.close()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        ok = [r for r in self.results if r["error"] is None]
+        errors = [r for r in self.results if r["error"] is not None and not r.get("dropped")]
+        dropped = {}
+        for r in self.results:
+            if r.get("dropped"):
+                dropped[r["dropped"]] = dropped.get(r["dropped"], 0) + 1
+        tokens = [r["generated_tokens"] for r in ok if r["generated_tokens"] is not None]
+        end_to_end = [r["total_ms"] + max(r["queue_ms"], 0.0) for r in ok]
+        # Outputs missing points, the canonical centre tag or the template action
+        malformed = sum(not parse(r["text"] or "").well_formed for r in ok)
+        decode_rates = [r["server"]["tokens_per_s"] for r in ok if (r.get("server") or {}).get("tokens_per_s")]
+        cache_results = {}
+        for r in ok:
+            outcome = (r.get("server") or {}).get("cache")
+            if outcome:
+                cache_results[outcome] = cache_results.get(outcome, 0) + 1
+        drafted = sum((r.get("server") or {}).get("draft_tokens") or 0 for r in ok)
+        accepted = sum((r.get("server") or {}).get("accepted_tokens") or 0 for r in ok)
+        config = {k: v for k, v in vars(self.args).items() if k != "func"}
+        return {
+            "created": datetime.now().isoformat(),
+            "config": config,
+            "summary": {
+                "requests": len(self.results),
+                "errors": len(errors),
+                "error_rate": len(errors) / len(self.results) if self.results else 0.0,
+                "elapsed_s": elapsed,
+                "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+                "tokens_per_s": sum(tokens) / elapsed if elapsed > 0 and tokens else None,
+                "malformed_rate": malformed / len(ok) if ok else 0.0,
+                "decode_tokens_per_s": summarize(decode_rates),
+                "draft_acceptance": accepted / drafted if drafted else None,
+                # Share of the run the model was not generating (server-side busy time)
+                "accelerator_idle_fraction": max(1.0 - self.busy_s / elapsed, 0.0) if self.busy_s is not None and elapsed > 0 else None,
+                "cache": cache_results,
+                "dropped": dropped,
+                "ttfb_ms": summarize([r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None]),
+                "latency_ms": summarize([r["total_ms"] for r in ok]),
+                "end_to_end_ms": summarize(end_to_end),
+                "generated_tokens": summarize(tokens),
+            },
+            "error_samples": sorted({r["error"] for r in errors})[:10],
+            "requests": [{k: v for k, v in r.items() if k not in ("text", "server")} for r in self.results],
+        }
+
+
+def print_summary(report):
+    s = report["summary"]
+    print(f"requests {s['requests']}  errors {s['errors']} ({s['error_rate']:.1%})  "
+          f"throughput {s['throughput_rps']:.2f} req/s"
+          + (f"  {s['tokens_per_s']:.1f} tok/s" if s["tokens_per_s"] else "")
+          + f"  malformed {s['malformed_rate']:.1%}"
+          + (f"  draft acceptance {s['draft_acceptance']:.1%}" if s.get("draft_acceptance") is not None else "")
+          + (f"  accelerator idle {s['accelerator_idle_fraction']:.1%}" if s.get("accelerator_idle_fraction") is not None else ""))
+    if s.get("dropped"):
+        print("  dropped by the scheduler " + "  ".join(f"{k} {v}" for k, v in sorted(s["dropped"].items())))
+    if set(s.get("cache") or {}) - {"miss", "bypass"}:
+        print("  response cache " + "  ".join(f"{k} {v}" for k, v in sorted(s["cache"].items())))
+    if s["decode_tokens_per_s"]["count"]:
+        m = s["decode_tokens_per_s"]
+        print(f"  {'decode_tok/s':<14} p50 {m['p50']:8.1f}  p90 {m['p90']:8.1f}  p99 {m['p99']:8.1f}  max {m['max']:8.1f}")
+    for key in ("ttfb_ms", "latency_ms", "end_to_end_ms"):
+        m = s[key]
+        if m["count"]:
+            print(f"  {key:<14} p50 {m['p50']:8.1f}  p90 {m['p90']:8.1f}  p99 {m['p99']:8.1f}  max {m['max']:8.1f}")
+
+
+# (summary path, higher is better)
+COMPARED_METRICS = [
+    (("throughput_rps",), True),
+    (("error_rate",), False),
+    (("malformed_rate",), False),
+    (("decode_tokens_per_s", "p50"), True),
+    (("accelerator_idle_fraction",), False),
+    (("ttfb_ms", "p50"), False),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p90"), False),
+    (("latency_ms", "p99"), False),
+    (("end_to_end_ms", "p99"), False),
+]
+
+
+def compare_reports(base, new, threshold):
+    """Return rows of (metric, base, new, relative change, regressed)."""
+    rows = []
+    for path, higher_is_better in COMPARED_METRICS:
+        b, n = base["summary"], new["summary"]
+        for key in path:
+            b, n = b.get(key) if b else None, n.get(key) if n else None
+        if b is None or n is None:
+            continue
+        change = (n - b) / b if b else (0.0 if n == b else float("inf"))
+        worse = -change if higher_is_better else change
+        # Error rates are compared absolutely: any increase above the threshold counts
+        if path in (("error_rate",), ("malformed_rate",)):
+            worse = n - b
+        rows.append((".".join(path), b, n, change, worse > threshold))
+    return rows
+
+
+def cmd_run(args):
+    if not args.requests and not args.duration:
+        args.requests = 100
+    report = asyncio.run(Replay(args).run())
+    print_summary(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+
+
+def cmd_compare(args):
+    with open(args.base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = 0
+    print(f"{'metric':<20}{'base':>12}{'new':>12}{'change':>10}")
+    for name, b, n, change, regressed in compare_reports(base, new, args.threshold):
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<20}{b:>12.3f}{n:>12.3f}{change:>+10.1%}{flag}")
+    if regressions:
+        print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark for the Molmo /analyze endpoint.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Replay a frame directory against the service")
+    run.add_argument("--frames", required=True, help="Directory of recorded frames (e.g. vla_evaluation) or a frame archive")
+    run.add_argument("--url", default=MOLMO_SERVER)
+    run.add_argument("--transport", default="http", choices=sorted(TRANSPORTS))
+    run.add_argument("--target", default=DEFAULT_TARGET)
+    run.add_argument("--prompt", help="Override the prompt built from --target")
+    run.add_argument("--adapter")
+    run.add_argument("--constrained", choices=["true", "false"], help="Request template-constrained decoding (default: the service's)")
+    run.add_argument("--speculative", choices=["true", "false"], help="Request prompt-lookup speculative decoding (default: the service's)")
+    run.add_argument("--cache", choices=["true", "false"], help="Allow the service's response cache and coalescing (default: true); false measures the model on every request")
+    run.add_argument("--sessions", type=int, help="Send requests as this many control-loop sessions (latest frame wins)")
+    run.add_argument("--deadline-ms", type=float, help="Requests not started within this are dropped by the service")
+    run.add_argument("--concurrency", type=int, default=1, help="Closed-loop workers")
+    run.add_argument("--rate", type=float, help="Open-loop arrival rate (req/s); overrides --concurrency")
+    run.add_argument("--arrival", choices=["constant", "poisson"], default="constant")
+    run.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on outstanding requests")
+    run.add_argument("--requests", type=int, help="Number of measured requests (default 100)")
+    run.add_argument("--duration", type=float, help="Measure for this many seconds instead")
+    run.add_argument("--warmup", type=int, default=2, help="Unmeasured requests sent first")
+    run.add_argument("--timeout", type=float, default=120.0)
+    run.add_argument("--out", help="Write the JSON report here")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="Compare two reports and flag regressions")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
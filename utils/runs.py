@@ -0,0 +1,71 @@
+"""Look up evaluation runs, iterations and frames in the run catalogue.
+
+    python utils/runs.py list
+    python utils/runs.py iterations 20250101-120000-ab12cd --start 10 --end 20
+    python utils/runs.py show 20250101-120000-ab12cd 42
+    python utils/runs.py frame 20250101-120000-ab12cd/before_0042.png
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.run_catalog import RunCatalog
+
+DEFAULT_CATALOG = "vla_evaluation/runs.sqlite"
+
+
+def cmd_list(catalog, args):
+    print(f"{'run_id':<26}{'status':<10}{'iterations':>11}{'last':>7}  started_at")
+    for run in catalog.runs():
+        print(f"{run['run_id']:<26}{run['status']:<10}{run['iterations']:>11}{run['last_iteration']:>7}  {run['started_at']}")
+
+
+def cmd_iterations(catalog, args):
+    for row in catalog.iterations(args.run_id, args.start, args.end):
+        print(row["iteration"], row["timestamp"], row["before_screenshot"], row["after_screenshot"])
+
+
+def cmd_show(catalog, args):
+    record = catalog.read_metadata(args.run_id, args.iteration)
+    if record is None:
+        raise SystemExit(f"No metadata for run {args.run_id} iteration {args.iteration}")
+    print(json.dumps(record, indent=2))
+
+
+def cmd_frame(catalog, args):
+    frame = catalog.frame(args.path)
+    if frame is None:
+        raise SystemExit(f"{args.path} is not in the catalogue")
+    print(json.dumps(frame))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the run catalogue written by the evalrun client.")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="All runs").set_defaults(func=cmd_list)
+
+    iterations = sub.add_parser("iterations", help="Iterations of a run with their frames")
+    iterations.add_argument("run_id")
+    iterations.add_argument("--start", type=int)
+    iterations.add_argument("--end", type=int)
+    iterations.set_defaults(func=cmd_iterations)
+
+    show = sub.add_parser("show", help="Metadata record of one iteration")
+    show.add_argument("run_id")
+    show.add_argument("iteration", type=int)
+    show.set_defaults(func=cmd_show)
+
+    frame = sub.add_parser("frame", help="Run and iteration a frame file belongs to")
+    frame.add_argument("path", help="Path relative to the screenshots directory")
+    frame.set_defaults(func=cmd_frame)
+
+    args = parser.parse_args()
+    args.func(RunCatalog(args.catalog), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig, TextStreamer
 import torch
-import re
 from PIL import Image
 import requests
 from peft import PeftModel
 import time
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import parse
 
 nf4_config = BitsAndBytesConfig(
     load_in_4bit=True,
@@ -41,38 +45,9 @@ streamer = TextStreamer(tokenizer=processor.tokenizer, skip_special_tokens=True)
 
 model = PeftModel.from_pretrained(model, "checkpoint-8100")
 
-COORD_REGEX = re.compile(rf"<(?:points|tracks).*? coords=\"([0-9\t:;, .]+)\"/?>")
-FRAME_REGEX = re.compile(rf"(?:^|\t|:|,|;)([0-9\.]+) ([0-9\. ]+)")
-POINTS_REGEX = re.compile(r"([0-9]+) ([0-9]{3,4}) ([0-9]{3,4})")
-
-def _points_from_num_str(text, image_w, image_h, extract_ids=False):
-    all_points = []
-    for points in POINTS_REGEX.finditer(text):
-        ix, x, y = points.group(1), points.group(2), points.group(3)
-        # our points format assume coordinates are scaled by 1000
-        x, y = float(x)/1000*image_w, float(y)/1000*image_h
-        if 0 <= x <= image_w and 0 <= y <= image_h:
-            yield ix, x, y
-
-
 def extract_multi_image_points(text, image_w, image_h, extract_ids=False):
     """Extract pointing coordinates as a flattened list of (frame_id, x, y) triplets from model output text."""
-    all_points = []
-    if isinstance(image_w, (list, tuple)) and isinstance(image_h, (list, tuple)):
-        assert len(image_w) == len(image_h)
-        diff_res = True
-    else:
-        diff_res = False
-    for coord in COORD_REGEX.finditer(text):
-        for point_grp in FRAME_REGEX.finditer(coord.group(1)):
-            frame_id = int(point_grp.group(1)) if diff_res else float(point_grp.group(1))
-            w, h = (image_w[frame_id-1], image_h[frame_id-1]) if diff_res else (image_w, image_h)
-            for idx, x, y in _points_from_num_str(point_grp.group(2), w, h):
-                if extract_ids:
-                    all_points.append((frame_id, idx, int(x), int(y)))
-                else:
-                    all_points.append((frame_id, int(x), int(y)))
-    return all_points
+    return parse(text).pixel_points(image_w, image_h, extract_ids)
 
 
 
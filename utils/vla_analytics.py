@@ -0,0 +1,335 @@
+"""One-pass diagnostics over an evaluation run's metadata.jsonl.
+
+Each record's vla_output is parsed once (common/molmo_parsing.py) into NumPy
+columns; the text itself is not kept. Records are re-read by byte offset only
+when a view asks for them, so memory stays around 100 bytes per record
+regardless of output length. The list_* scripts and plot_points_screenshots.py
+are views over RunAnalytics.
+
+    python utils/vla_analytics.py vla_evaluation/metadata.jsonl
+    python utils/vla_analytics.py vla_evaluation/metadata.jsonl --tol-px 10 --json summary.json --export columns.npz
+    python utils/vla_analytics.py big_run/metadata.jsonl --workers 8 --list drifted
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from common.molmo_parsing import parse
+
+COMMAND_KEYS = ("up", "down", "left", "right", "exit")
+# float columns use NaN for "missing"
+COLUMNS = {
+    "offset": np.int64,         # byte offset of the record in the file
+    "iteration": np.float64,
+    "has_output": np.bool_,
+    "has_points": np.bool_,
+    "has_action": np.bool_,     # "The action to be taken is therefore (dx, dy)" present
+    "has_centre": np.bool_,     # canonical centre tag present
+    "obj_x": np.float64,
+    "obj_y": np.float64,
+    "ctr_x": np.float64,
+    "ctr_y": np.float64,
+    "dx": np.float64,
+    "dy": np.float64,
+    **{f"cmd_{key}": np.int64 for key in COMMAND_KEYS},  # commands as recorded
+}
+POINT_COLUMNS = {"point_row": np.int64, "point_frame": np.float64, "point_x": np.int32, "point_y": np.int32}
+NAN = float("nan")
+
+
+def _empty_columns(spec):
+    return {name: [] for name in spec}
+
+
+def _to_arrays(columns, spec):
+    return {name: np.asarray(values, dtype=spec[name]) for name, values in columns.items()}
+
+
+def _concat(parts, spec):
+    if not parts:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in spec.items()}
+    return {name: np.concatenate([part[name] for part in parts]) for name in spec}
+
+
+def scan_range(path, start=0, end=None, chunk_rows=65_536):
+    """
+    Parse the records whose first byte lies in [start, end) into column arrays.
+
+    Rows are converted to arrays every chunk_rows records, so only one chunk of
+    Python objects is alive at a time. Returns (columns, points, bad_lines).
+    """
+    parts, point_parts = [], []
+    cols, pts = _empty_columns(COLUMNS), _empty_columns(POINT_COLUMNS)
+    rows = bad = 0
+    with open(path, "rb") as f:
+        if start > 0:
+            # Start at the first line beginning at or after `start`
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            line_offset, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                bad += 1
+                continue
+
+            text = data.get("vla_output") or ""
+            parsed = parse(text)
+            commands = data.get("commands") or {}
+            obj = parsed.object_point or (NAN, NAN)
+            ctr = parsed.centre_point or (NAN, NAN)
+            action = parsed.template_action or (NAN, NAN)
+            iteration = data.get("iteration")
+
+            cols["offset"].append(line_offset)
+            cols["iteration"].append(iteration if isinstance(iteration, (int, float)) else NAN)
+            cols["has_output"].append(bool(text))
+            cols["has_points"].append(parsed.has_points)
+            cols["has_action"].append(parsed.template_action is not None)
+            cols["has_centre"].append(parsed.has_centre)
+            cols["obj_x"].append(obj[0])
+            cols["obj_y"].append(obj[1])
+            cols["ctr_x"].append(ctr[0])
+            cols["ctr_y"].append(ctr[1])
+            cols["dx"].append(action[0])
+            cols["dy"].append(action[1])
+            for key in COMMAND_KEYS:
+                cols[f"cmd_{key}"].append(commands.get(key, 0))
+            for point in parsed.points:
+                pts["point_row"].append(rows)
+                pts["point_frame"].append(float(point.frame))
+                pts["point_x"].append(point.x)
+                pts["point_y"].append(point.y)
+            rows += 1
+
+            if len(cols["offset"]) >= chunk_rows:
+                parts.append(_to_arrays(cols, COLUMNS))
+                point_parts.append(_to_arrays(pts, POINT_COLUMNS))
+                cols, pts = _empty_columns(COLUMNS), _empty_columns(POINT_COLUMNS)
+    parts.append(_to_arrays(cols, COLUMNS))
+    point_parts.append(_to_arrays(pts, POINT_COLUMNS))
+    return _concat(parts, COLUMNS), _concat(point_parts, POINT_COLUMNS), bad
+
+
+def _scan_range_job(job):
+    return scan_range(*job)
+
+
+class RunAnalytics:
+    """Column arrays for one metadata.jsonl plus the diagnostics computed from them."""
+
+    def __init__(self, path, columns, points, bad_lines=0):
+        self.path = Path(path)
+        self.columns = columns
+        self.points = points
+        self.bad_lines = bad_lines
+
+    @classmethod
+    def scan(cls, path, workers=1, chunk_rows=65_536):
+        """Stream the file once; with workers > 1, byte ranges are parsed in parallel processes."""
+        size = os.path.getsize(path)
+        if workers <= 1 or size < 1 << 20:
+            return cls(path, *scan_range(path, 0, None, chunk_rows))
+
+        bounds = [size * i // workers for i in range(workers + 1)]
+        jobs = [(path, bounds[i], bounds[i + 1], chunk_rows) for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_scan_range_job, jobs))
+        point_parts, row_base = [], 0
+        for columns, points, _ in results:
+            # Point rows are local to each range; shift them to global row numbers
+            points["point_row"] += row_base
+            point_parts.append(points)
+            row_base += len(columns["offset"])
+        return cls(
+            path,
+            _concat([columns for columns, _, _ in results], COLUMNS),
+            _concat(point_parts, POINT_COLUMNS),
+            sum(bad for _, _, bad in results),
+        )
+
+    def __len__(self):
+        return len(self.columns["offset"])
+
+    # ------------- diagnostics (boolean masks over records) -------------
+
+    @property
+    def no_points(self):
+        return ~self.columns["has_points"]
+
+    @property
+    def all_zero_commands(self):
+        c = self.columns
+        return (c["cmd_up"] == 0) & (c["cmd_down"] == 0) & (c["cmd_left"] == 0) & (c["cmd_right"] == 0) & (c["cmd_exit"] == 0)
+
+    @property
+    def no_action(self):
+        """Pointing only: no template action and no command was recorded."""
+        return ~self.columns["has_action"] & self.all_zero_commands
+
+    @property
+    def wrong_centre(self):
+        return ~self.columns["has_centre"]
+
+    def drift(self):
+        """(diff_x, diff_y, norm) of the action against centre - object; NaN where not checkable."""
+        c = self.columns
+        diff_x = (c["ctr_x"] - c["obj_x"]) - c["dx"]
+        diff_y = (c["ctr_y"] - c["obj_y"]) - c["dy"]
+        return diff_x, diff_y, np.sqrt(diff_x ** 2 + diff_y ** 2)
+
+    def drifted(self, tol_px):
+        norm = self.drift()[2]
+        return ~np.isnan(norm) & (norm > tol_px)
+
+    # ------------- views -------------
+
+    def records(self, mask=None):
+        """Yield the original JSON records of the selected rows, re-read by offset."""
+        offsets = self.columns["offset"] if mask is None else self.columns["offset"][mask]
+        with self.path.open("rb") as f:
+            for offset in offsets:
+                f.seek(int(offset))
+                yield json.loads(f.readline())
+
+    def drift_results(self, tol_px, mask=None):
+        """Per-record drift dicts in the layout of list_distance_drift.extract_and_check."""
+        c = self.columns
+        diff_x, diff_y, norm = self.drift()
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+
+        def pair(x, y, i):
+            return None if np.isnan(x[i]) or np.isnan(y[i]) else (int(x[i]), int(y[i]))
+
+        for i, record in zip(rows, self.records(mask)):
+            checkable = not np.isnan(norm[i])
+            yield {
+                "obj_point": pair(c["obj_x"], c["obj_y"], i),
+                "centre_point": pair(c["ctr_x"], c["ctr_y"], i),
+                "action": pair(c["dx"], c["dy"], i),
+                "diff_vec": (int(diff_x[i]), int(diff_y[i])) if checkable else None,
+                "diff_norm": float(norm[i]) if checkable else None,
+                "is_consistent": bool(checkable and norm[i] <= tol_px),
+                "iteration": record.get("iteration"),
+                "before_screenshot": record.get("before_screenshot"),
+            }
+
+    def pixel_points(self, image_w, image_h):
+        """{row: [(frame_id, x, y), ...]} rescaled to pixels, dropping points outside the image."""
+        p = self.points
+        x = p["point_x"] / 1000 * image_w
+        y = p["point_y"] / 1000 * image_h
+        keep = (x >= 0) & (x <= image_w) & (y >= 0) & (y <= image_h)
+        by_row = {}
+        for row, frame, px, py in zip(p["point_row"][keep], p["point_frame"][keep], x[keep].astype(np.int64), y[keep].astype(np.int64)):
+            by_row.setdefault(int(row), []).append((float(frame), int(px), int(py)))
+        return by_row
+
+    # ------------- summary -------------
+
+    def summary(self, tol_px=10):
+        n = len(self)
+        c = self.columns
+        norm = self.drift()[2]
+        checkable = norm[~np.isnan(norm)]
+
+        def rate(mask):
+            count = int(mask.sum())
+            return {"count": count, "rate": count / n if n else 0.0}
+
+        def stats(values):
+            values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+            if not len(values):
+                return {"count": 0}
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            return {"count": int(len(values)), "mean": float(values.mean()), "p50": float(p50),
+                    "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+        horizontal = c["cmd_left"] - c["cmd_right"]
+        vertical = c["cmd_up"] - c["cmd_down"]
+        moved = ~self.all_zero_commands & (c["cmd_exit"] == 0)
+        return {
+            "records": n,
+            "bad_lines": self.bad_lines,
+            "empty_output": rate(~c["has_output"]),
+            "no_points": rate(self.no_points),
+            "no_action": rate(self.no_action),
+            "wrong_centre": rate(self.wrong_centre),
+            "drift": {
+                "tol_px": tol_px,
+                "checkable": int(len(checkable)),
+                "drifted": rate(self.drifted(tol_px)),
+                "norm_px": stats(checkable),
+            },
+            "commands": {
+                "exit": rate(c["cmd_exit"] > 0),
+                "moved": rate(moved),
+                "abs_dx": stats(np.abs(horizontal[moved])),
+                "abs_dy": stats(np.abs(vertical[moved])),
+                "magnitude": stats(np.hypot(horizontal[moved], vertical[moved])),
+            },
+        }
+
+    def export_npz(self, out_path):
+        np.savez_compressed(out_path, **self.columns, **self.points)
+
+
+def print_summary(summary):
+    n = summary["records"]
+    print(f"{n} records ({summary['bad_lines']} unreadable lines)\n")
+    for key in ("empty_output", "no_points", "no_action", "wrong_centre"):
+        print(f"{key:<16}{summary[key]['count']:>10}{summary[key]['rate']:>10.1%}")
+    drift = summary["drift"]
+    print(f"{'drifted':<16}{drift['drifted']['count']:>10}{drift['drifted']['rate']:>10.1%}"
+          f"   (> {drift['tol_px']} px, {drift['checkable']} checkable)")
+    print(f"\n{'':<16}{'n':>10}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for label, s in (("drift px", drift["norm_px"]), ("|dx|", summary["commands"]["abs_dx"]),
+                     ("|dy|", summary["commands"]["abs_dy"]), ("magnitude", summary["commands"]["magnitude"])):
+        if s["count"]:
+            print(f"{label:<16}{s['count']:>10}{s['mean']:>10.1f}{s['p50']:>10.1f}{s['p90']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+    print(f"\nexit {summary['commands']['exit']['count']}, moved {summary['commands']['moved']['count']}")
+
+
+LISTS = ("no_points", "no_action", "wrong_centre", "drifted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnostics over an evaluation run's metadata.jsonl.")
+    parser.add_argument("jsonl_path", nargs="?", default="vla_evaluation/metadata.jsonl")
+    parser.add_argument("--tol-px", type=float, default=10, help="Drift tolerance between action and points")
+    parser.add_argument("--workers", type=int, default=1, help="Processes parsing byte ranges of the file")
+    parser.add_argument("--list", choices=LISTS, help="Also print the records flagged by one diagnostic")
+    parser.add_argument("--json", help="Write the summary as JSON here")
+    parser.add_argument("--export", help="Write the per-record columns to this .npz file")
+    args = parser.parse_args()
+
+    analytics = RunAnalytics.scan(args.jsonl_path, workers=args.workers)
+    summary = analytics.summary(args.tol_px)
+    print_summary(summary)
+
+    if args.list:
+        mask = analytics.drifted(args.tol_px) if args.list == "drifted" else getattr(analytics, args.list)
+        print(f"\n{args.list}:")
+        for record in analytics.records(mask):
+            print(record.get("before_screenshot"), "->", record.get("vla_output"))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.export:
+        analytics.export_npz(args.export)
+
+
+if __name__ == "__main__":
+    main()